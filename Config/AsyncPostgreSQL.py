@@ -0,0 +1,155 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Optional
+from psycopg2.extras import Json as Psycopg2Json
+from dotenv import load_dotenv
+from Config.Metrics import metrics
+from Config.PostgreSQL import connection_kwargs
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+load_dotenv()
+
+"""
+    Asyncio PostgreSQL client (psycopg 3) with its own AsyncConnectionPool, used by the
+    asyncio execution mode so context fetches and result writes are awaited instead of
+    occupying a db thread. Same surface and return shapes as PostgresClient: rows are dicts,
+    execute_res returns the row count and failures raise RuntimeError.
+
+    The pool belongs to the event loop that opened it and is opened lazily on first use. It
+    cannot be moved to another loop, await close() on the loop that used it before running
+    the client on a new one (e.g. one asyncio.run per invocation).
+    Like the threaded client, connections are leased per statement without a ping; the pool
+    drops connections that come back broken and closes the ones idle for longer than
+    POSTGRES_VALIDATE_IDLE_SECONDS beyond its minimum size.
+"""
+
+
+def _conninfo() -> str:
+    from psycopg.conninfo import make_conninfo
+    return make_conninfo(**connection_kwargs())
+
+
+def _adapt(params):
+    """ The processors wrap json values for psycopg2, rewrap them for psycopg 3 """
+    if not params:
+        return params
+    from psycopg.types.json import Json
+    return tuple(Json(value.adapted) if isinstance(value, Psycopg2Json) else value for value in params)
+
+
+class AsyncPostgresClient:
+    def __init__(self):
+        self._pool = None
+        self._loop = None
+        self._opening: Optional[asyncio.Task] = None
+        self.max_conn = int(os.getenv("POSTGRES_ASYNC_MAX_CONN", os.getenv("POSTGRES_MAX_CONN", 10)))
+
+    async def _open_pool(self):
+        from psycopg.rows import dict_row
+        from psycopg_pool import AsyncConnectionPool
+        logger.info(f"[DB] creating async connection pool (max {self.max_conn})")
+        pool = AsyncConnectionPool(
+            _conninfo(),
+            min_size=int(os.getenv("POSTGRES_MIN_CONN", 1)),
+            max_size=self.max_conn,
+            max_idle=float(os.getenv("POSTGRES_VALIDATE_IDLE_SECONDS", 300)),
+            timeout=float(os.getenv("POSTGRES_POOL_TIMEOUT", 30)),
+            kwargs={"autocommit": True, "row_factory": dict_row},
+            open=False
+        )
+        await pool.open()
+        logger.info("✓ PostgreSQL async connection pool created")
+        return pool
+
+    async def _get_pool(self):
+        """ Opened on the first loop that asks, concurrent first callers wait for the same open """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            if self._loop is not None:
+                # its connections and tasks are bound to the old loop, replacing it would leak them
+                raise RuntimeError("Async PostgreSQL pool belongs to another event loop, close() it there first")
+            self._loop = loop
+            self._pool = None
+            self._opening = loop.create_task(self._open_pool())
+        if self._pool is None:
+            try:
+                self._pool = await self._opening
+            except Exception as e:
+                self._loop = None
+                logger.error("Failed to connect to PostgreSQL database.")
+                logger.exception(e)
+                raise RuntimeError("Database connection failed") from e
+        return self._pool
+
+    async def _run(self, query, params, fetch: Optional[str]):
+        from psycopg import Error
+        pool = await self._get_pool()
+        started = time.monotonic()
+        try:
+            async with pool.connection() as conn:
+                leased_at = time.monotonic()
+                metrics.observe("db.async_pool.wait", leased_at - started)
+                stats = pool.get_stats()
+                in_use = stats.get("pool_size", 0) - stats.get("pool_available", 0)
+                metrics.observe("db.async_pool.utilization", round(in_use / self.max_conn, 3))
+                try:
+                    async with conn.cursor() as cursor:
+                        await cursor.execute(query, _adapt(params))
+                        logger.debug(f"Executed query: {query} with params: {params}")
+                        if fetch == "one":
+                            return await cursor.fetchone()
+                        if fetch == "all":
+                            return await cursor.fetchall()
+                        return cursor.rowcount
+                finally:
+                    metrics.observe("db.async_pool.hold", time.monotonic() - leased_at)
+        except Error as e:
+            logger.error(f"Failed to execute query: {query}")
+            logger.exception(e)
+            raise RuntimeError("Database query failed" if fetch else "Database command failed") from e
+
+    async def fetch_one(self, query, params=None):
+        return await self._run(query, params, "one")
+
+    async def fetch_all(self, query, params=None):
+        return await self._run(query, params, "all")
+
+    async def execute(self, query, params=None):
+        await self._run(query, params, None)
+        logger.info(f"Executed command: {query} with params: {params}")
+
+    async def execute_res(self, query, params=None):
+        affected = await self._run(query, params, None)
+        logger.info(f"Executed command: {query} with params: {params}")
+        return affected
+
+    async def execute_values(self, query, rows, template=None):
+        """
+            psycopg 3 has no execute_values. Like psycopg2's, the query holds a single %s, the
+            VALUES placeholder, which is expanded to one template per row.
+        """
+        if not rows:
+            return []
+        head, placeholder, tail = query.partition("%s")
+        if not placeholder or "%s" in tail:
+            raise ValueError("execute_values query must contain exactly one %s, the VALUES placeholder")
+        template = template or "(" + ", ".join(["%s"] * len(rows[0])) + ")"
+        query = head + ", ".join([template] * len(rows)) + tail
+        return await self._run(query, tuple(value for row in rows for value in row), "all")
+
+    async def close(self):
+        opening, self._opening = self._opening, None
+        if self._pool is None and opening is not None:
+            # closed while the first open is still in flight
+            try:
+                self._pool = await opening
+            except Exception:
+                pass
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+            logger.info("PostgreSQL async connection pool closed.")
+        self._loop = None
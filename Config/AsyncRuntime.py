@@ -0,0 +1,52 @@
+import os
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+"""
+    Helpers for the asyncio execution mode (EXECUTION_MODE=async).
+
+    Libraries without an asyncio API (boto3, psycopg2) are driven from dedicated
+    thread pools so the event loop never blocks on them. The io pool carries SQS
+    and Bedrock calls; the repository queries use the asyncio PostgreSQL client
+    (Config/AsyncPostgreSQL.py) and need no thread.
+"""
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def is_async_mode() -> bool:
+    return os.getenv("EXECUTION_MODE", "sync").lower() == "async"
+
+
+def _get_executor(kind: str) -> ThreadPoolExecutor:
+    executor = _executors.get(kind)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(kind)
+            if executor is None:
+                workers = int(os.getenv("ASYNC_BLOCKING_WORKERS", 64))
+                executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"async-{kind}")
+                _executors[kind] = executor
+                logger.info(f"[ASYNC] created {kind} executor with {workers} threads")
+    return executor
+
+
+async def run_blocking(fn: Callable, *args, kind: str = "io", **kwargs) -> Any:
+    """ Run a blocking call on one of the runtime thread pools """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(kind), functools.partial(fn, *args, **kwargs))
+
+
+def shutdown(wait: bool = True, executors: Optional[list] = None):
+    for kind in executors or list(_executors.keys()):
+        with _executors_lock:
+            executor = _executors.pop(kind, None)
+        if executor is not None:
+            executor.shutdown(wait=wait)
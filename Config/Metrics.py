@@ -0,0 +1,86 @@
+import os
+import time
+import json
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Optional
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+""" In-process metrics registry: counters, gauges and timing summaries, logged as json """
+class Metrics:
+    def __init__(self, log_interval: Optional[float] = None):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._timings = {}
+        self._log_interval = log_interval if log_interval is not None else float(os.getenv("METRICS_LOG_INTERVAL", 60))
+        self._last_log = time.monotonic()
+
+    def incr(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def gauge(self, name: str, value: float):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        """ Record one sample (seconds for durations) """
+        with self._lock:
+            summary = self._timings.get(name)
+            if summary is None:
+                summary = {"count": 0, "total": 0.0, "min": value, "max": value}
+                self._timings[name] = summary
+            summary["count"] += 1
+            summary["total"] += value
+            summary["min"] = min(summary["min"], value)
+            summary["max"] = max(summary["max"], value)
+
+    @contextmanager
+    def timer(self, name: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started)
+
+    def counter(self, name: str) -> float:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            timings = {
+                name: dict(summary, avg=summary["total"] / summary["count"] if summary["count"] else 0.0)
+                for name, summary in self._timings.items()
+            }
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "timings": timings,
+            }
+
+    def log_snapshot(self):
+        logger.info(f"[METRICS] {json.dumps(self.snapshot(), default=str)}")
+
+    def maybe_log(self):
+        """ Log a snapshot at most once per METRICS_LOG_INTERVAL seconds """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_log < self._log_interval:
+                return
+            self._last_log = now
+        self.log_snapshot()
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._timings.clear()
+
+
+# Singleton instance
+metrics = Metrics()
@@ -4,8 +4,11 @@ import psycopg2
 from psycopg2.extras import RealDictCursor, execute_values
 from psycopg2 import OperationalError, ProgrammingError, pool
 from dotenv import load_dotenv
+import time
 import datetime
 import logging
+import threading
+from Config.Metrics import metrics
 
 # --- 1. Set up basic logging to stdout ---
 logging.basicConfig(
@@ -15,146 +18,260 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 load_dotenv()
 
+def connection_kwargs() -> dict:
+    """ Connection settings from the environment, for the pool and for dedicated connections """
+    return dict(
+        host=os.getenv("POSTGRES_URL"),
+        port=os.getenv("POSTGRES_PORT"),
+        user=os.getenv("POSTGRES_USER"),
+        password=os.getenv("POSTGRES_PASSWORD"),
+        dbname=os.getenv("POSTGRES_DB_NAME")
+    )
+
+
+"""
+    Connections are leased per operation (or per transaction) from a pool shared by every
+    client and thread, and returned as soon as the statement is done, so one PostgresClient
+    can be shared by all workers. A semaphore in front of the pool makes callers wait for a
+    free connection (POSTGRES_POOL_TIMEOUT) instead of failing when maxconn are in use.
+    Connections are only pinged after POSTGRES_VALIDATE_IDLE_SECONDS of idleness; a
+    connection that breaks is discarded. Connections run in autocommit, so a statement can
+    commit just before the socket dies: it is only run again on a fresh connection when it
+    was never sent (the connection was already closed) or when the caller passes
+    idempotent=True, which reads and true upserts do. Counter updates such as
+    retry_count = retry_count + 1 or the rate limit balances are never repeated.
+"""
 class PostgresClient:
     _pool = None
+    _pool_lock = threading.Lock()
+    _slots = None
+    _max_conn = None
+    _in_use = 0
+    _last_used = {}  # id(connection) -> monotonic time it was returned to the pool
+
     def __init__(self):
-        self.conn = None
-        self._connect()
+        self._get_pool()
 
     @classmethod
     def _get_pool(cls):
-        """Create or get a connection pool"""
+        """Create or get a connection pool, shared by all worker threads"""
         if cls._pool is None:
-            try:
-                logger.info(f"Create a connection pool")
-                cls._pool = pool.SimpleConnectionPool(
-                    minconn=1,
-                    maxconn=10,
-                    host=os.getenv("POSTGRES_URL"),
-                    port=os.getenv("POSTGRES_PORT"),
-                    user=os.getenv("POSTGRES_USER"),
-                    password=os.getenv("POSTGRES_PASSWORD"),
-                    dbname=os.getenv("POSTGRES_DB_NAME")    
-                )
-                logger.info("✓ PostgreSQL connection pool created")
-            except Exception as e:
-                logger.info(f"Error found in creating or getting from PG pool")
-                raise
+            with cls._pool_lock:
+                if cls._pool is None:
+                    try:
+                        logger.info(f"Create a connection pool")
+                        max_conn = int(os.getenv("POSTGRES_MAX_CONN", 10))
+                        created = pool.ThreadedConnectionPool(
+                            minconn=int(os.getenv("POSTGRES_MIN_CONN", 1)),
+                            maxconn=max_conn,
+                            **connection_kwargs()
+                        )
+                        # _pool is the fast path of _lease, publish it only once the slots exist;
+                        # the pool carries its own semaphore so a lease never pairs it with another pool's
+                        cls._max_conn = max_conn
+                        cls._slots = created.slots = threading.BoundedSemaphore(max_conn)
+                        cls._in_use = 0
+                        cls._pool = created
+                        logger.info("✓ PostgreSQL connection pool created")
+                    except OperationalError as e:
+                        logger.error("Failed to connect to PostgreSQL database.")
+                        logger.exception(e)
+                        raise RuntimeError("Database connection failed") from e
+                    except Exception as e:
+                        logger.info(f"Error found in creating or getting from PG pool")
+                        raise
         return cls._pool
 
-    def _connect(self):
-        """Internal method to handle the database connection and logging."""
-        """Updated to connect from pool rather than a single connection """
+    @classmethod
+    def _track(cls, delta: int):
+        with cls._pool_lock:
+            cls._in_use += delta
+            in_use = cls._in_use
+        metrics.gauge("db.pool.in_use", in_use)
+        if delta > 0:
+            # sampled on every lease, its max and average size POSTGRES_MAX_CONN for the worker concurrency
+            metrics.observe("db.pool.utilization", round(in_use / cls._max_conn, 3))
+
+    def _is_usable(self, conn) -> bool:
+        """ Closed connections are dropped, idle ones are pinged before use """
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is None:
+            conn.autocommit = True
+            return True
+        idle_limit = float(os.getenv("POSTGRES_VALIDATE_IDLE_SECONDS", 300))
+        if time.monotonic() - last_used < idle_limit:
+            return True
+        metrics.incr("db.pool.pings")
         try:
-            logger.info("Attempting to connect to PostgreSQL database using connection pool.")
-            pool = self._get_pool()
-            self.conn = pool.getconn()
-            self.conn.autocommit = True
-            logger.info("Successfully connected to PostgreSQL database.")
-        except OperationalError as e:
-            # This handles connection-related errors
-            logger.error("Failed to connect to PostgreSQL database.")
-            logger.exception(e)
-            raise RuntimeError("Database connection failed") from e
+            with conn.cursor() as curr:
+                curr.execute('SELECT 1')
+            return True
+        except (psycopg2.InterfaceError, psycopg2.OperationalError):
+            logger.warning("Database connection is stale/broken, replacing it")
+            return False
+
+    def _discard(self, conn, pg_pool):
+        self._last_used.pop(id(conn), None)
+        metrics.incr("db.pool.discarded")
+        try:
+            pg_pool.putconn(conn, close=True)
         except Exception as e:
-            logger.exception("An unexpected error occurred during database connection.")
-            raise RuntimeError("Database connection failed") from e
-    
+            logger.warning(f"Unable to discard connection: {e}")
 
-    def _test_connection(self):
-        """ Helper function to test the connection and reconnect if necessary."""
-        if self.conn and not self.conn.closed:
+    @contextmanager
+    def _lease(self):
+        """ Borrow a connection for one operation, waiting for a free one when the pool is exhausted """
+        pg_pool = self._get_pool()
+        slots = pg_pool.slots
+        started = time.monotonic()
+        if not slots.acquire(timeout=float(os.getenv("POSTGRES_POOL_TIMEOUT", 30))):
+            metrics.incr("db.pool.timeouts")
+            raise RuntimeError(f"Database connection failed: no free connection within POSTGRES_POOL_TIMEOUT")
+        try:
+            metrics.observe("db.pool.wait", time.monotonic() - started)
             try:
-                with self.conn.cursor() as curr:
-                    curr.execute('SELECT 1')
-                return True
-            except (psycopg2.InterfaceError, psycopg2.OperationalError) as e:
-                logger.warning("Database connection is stale/broken, attempting to reconnect")
-                self._connect()
-                return False
-        elif not self.conn or self.conn.closed:
-            logger.warning("Datebase connection is closed, attepting to connect")
-            self._connect()
-            return False
-        return True
+                conn = pg_pool.getconn()
+                while not self._is_usable(conn):
+                    self._discard(conn, pg_pool)
+                    conn = pg_pool.getconn()
+            except OperationalError as e:
+                logger.error("Failed to connect to PostgreSQL database.")
+                logger.exception(e)
+                raise RuntimeError("Database connection failed") from e
+            self._track(1)
+            leased_at = time.monotonic()
+            try:
+                yield conn
+            except (psycopg2.InterfaceError, psycopg2.OperationalError):
+                if conn.closed:
+                    self._discard(conn, pg_pool)
+                    conn = None
+                raise
+            finally:
+                self._track(-1)
+                metrics.observe("db.pool.hold", time.monotonic() - leased_at)
+                if conn is not None:
+                    self._last_used[id(conn)] = time.monotonic()
+                    pg_pool.putconn(conn)
+        finally:
+            slots.release()
 
+    def _run(self, operation, cursor_factory=None, idempotent=False):
+        """
+        Run operation(cursor) on a leased connection. If the connection broke it is run once
+        more on a fresh one, but only when the statement cannot have been applied already:
+        psycopg2 raises InterfaceError without sending anything on a closed connection,
+        anything else may have committed and is only retried for idempotent statements.
+        """
+        for attempt in range(2):
+            lost = False
+            try:
+                with self._lease() as conn:
+                    try:
+                        with conn.cursor(cursor_factory=cursor_factory) as cursor:
+                            return operation(cursor)
+                    except (psycopg2.InterfaceError, psycopg2.OperationalError) as e:
+                        lost = bool(conn.closed) and (idempotent or isinstance(e, psycopg2.InterfaceError))
+                        raise
+            except (psycopg2.InterfaceError, psycopg2.OperationalError):
+                if attempt or not lost:
+                    raise
+                logger.warning("Database connection was lost, retrying on a fresh connection")
+                metrics.incr("db.pool.reconnects")
 
     @contextmanager
     def _get_cursor_transaction(self, cursor_factory=None):
-        if not self._test_connection():
-            logger.warning("Unable to re-connect to database")
-            
-        if not self.conn or self.conn.closed:
-            logger.warning("Datebase connection is closed.")
-            self._connect()
-        self.conn.autocommit = False
-        curr = self.conn.cursor(cursor_factory=cursor_factory)
-        try:
-            yield curr
-            self.conn.commit()
-        except Exception:
-            self.conn.rollback()
-            logger.exception("Transaction rolled back due to errors")
-            raise
-        finally:
-            curr.close()
-            if self.conn and not self.conn.closed:
-                self.conn.autocommit = True
-    
-    def _get_cursor(self, cursor_factory=None):
-        """Internal helper to get a cursor and handle potential connection issues."""
-        if not self._test_connection():
-            logger.warning("Unable to re-connect to database")
-        if not self.conn or self.conn.closed:
-            logger.warning("Database connection is closed. Attempting to reconnect...")
-            self._connect()
-        return self.conn.cursor(cursor_factory=cursor_factory)
-
-    def fetch_one(self, query, params=None):
+        """ One leased connection for the whole transaction, committed on success """
+        with self._lease() as conn:
+            conn.autocommit = False
+            curr = conn.cursor(cursor_factory=cursor_factory)
+            try:
+                yield curr
+                conn.commit()
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                logger.exception("Transaction rolled back due to errors")
+                raise
+            finally:
+                curr.close()
+                if not conn.closed:
+                    conn.autocommit = True
+
+    def fetch_one(self, query, params=None, idempotent=False):
+        def operation(cursor):
+            cursor.execute(query, params)
+            logger.debug(f"Executed query: {query} with params: {params}")
+            return cursor.fetchone()
         try:
-            with self._get_cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(query, params)
-                logger.debug(f"Executed query: {query} with params: {params}")
-                return cursor.fetchone()
+            return self._run(operation, cursor_factory=RealDictCursor, idempotent=idempotent)
         except (OperationalError, ProgrammingError) as e:
             logger.error(f"Failed to execute query: {query}")
             logger.exception(e)
             raise RuntimeError("Database query failed") from e
         
-    def fetch_all(self, query, params=None):
+    def fetch_all(self, query, params=None, idempotent=False):
+        def operation(cursor):
+            cursor.execute(query, params)
+            logger.debug(f"Executed query: {query} with params: {params}")
+            return cursor.fetchall()
         try:
-            with self._get_cursor(cursor_factory=RealDictCursor) as cursor:
-                cursor.execute(query, params)
-                logger.debug(f"Executed query: {query} with params: {params}")
-                return cursor.fetchall()
+            return self._run(operation, cursor_factory=RealDictCursor, idempotent=idempotent)
         except (OperationalError, ProgrammingError) as e:
             logger.error(f"Failed to execute query: {query}")
             logger.exception(e)
             raise RuntimeError("Database query failed") from e
 
-    def execute(self, query, params=None):
+    def execute(self, query, params=None, idempotent=False):
+        def operation(cursor):
+            cursor.execute(query, params)
+            logger.info(f"Executed command: {query} with params: {params}")
         try:
-            with self._get_cursor() as cursor:
-                cursor.execute(query, params)
-                logger.info(f"Executed command: {query} with params: {params}")
+            self._run(operation, idempotent=idempotent)
         except (OperationalError, ProgrammingError) as e:
             logger.error(f"Failed to execute command: {query}")
             logger.exception(e)
             raise RuntimeError("Database command failed") from e
     
-    def execute_res(self, query, params=None):
+    def execute_res(self, query, params=None, idempotent=False):
+        def operation(cursor):
+            cursor.execute(query, params)
+            logger.info(f"Executed command: {query} with params: {params}")
+            return cursor.rowcount
         try:
-            with self._get_cursor() as cursor:
-                cursor.execute(query, params)
-                logger.info(f"Executed command: {query} with params: {params}")
-                affected = cursor.rowcount
-                return affected
+            return self._run(operation, idempotent=idempotent)
         except (OperationalError, ProgrammingError) as e:
             logger.error(f"Failed to execute command: {query}")
             logger.exception(e)
             raise RuntimeError("Database command failed") from e
-                
+
+    def execute_values(self, query, rows, template=None, idempotent=False):
+        """ One statement for many rows, query holds a single VALUES %s, returns the RETURNING rows """
+        def operation(cursor):
+            result = execute_values(cursor, query, rows, template=template, page_size=max(1, len(rows)), fetch=True)
+            logger.info(f"Executed batch command: {query} with {len(rows)} rows")
+            return result
+        try:
+            return self._run(operation, cursor_factory=RealDictCursor, idempotent=idempotent)
+        except (OperationalError, ProgrammingError) as e:
+            logger.error(f"Failed to execute batch command: {query}")
+            logger.exception(e)
+            raise RuntimeError("Database command failed") from e
+
+    @classmethod
+    def close_pool(cls):
+        """ Close every pooled connection, clients keep working and open a new pool on next use """
+        with cls._pool_lock:
+            if cls._pool is not None:
+                closing, cls._pool = cls._pool, None
+                cls._slots = None
+                cls._in_use = 0
+                closing.closeall()
+                cls._last_used.clear()
+                logger.info("PostgreSQL connection pool closed.")
+
     def close(self):
-        if self.conn and not self.conn.closed:
-            self.conn.close()
-            logger.info("PostgreSQL connection closed.")
\ No newline at end of file
+        """ Connections are returned after every operation, nothing is held by the client """
+        pass
@@ -2,6 +2,7 @@ import os
 import boto3
 from dotenv import load_dotenv
 import logging
+from Config.AsyncRuntime import run_blocking
 
 
 load_dotenv()
@@ -20,7 +21,7 @@ class SQS:
         return bool(os.getenv("APP_MODE") == "dev")
 
     def _sqs(self):
-        if self.is_local_env:
+        if self.local:
             sqs = boto3.client(
                 "sqs",
                 region_name="us-west-1",
@@ -41,8 +42,32 @@ class SQS:
         else:
             return os.getenv("SQS_URL")
         
-    def delete_sqs_message(self, ReceiptHandle: str):
+    def receive_messages(self, queue_url: str, max_messages: int = 1, wait_time: int = 20, visibility_timeout: int = 300) -> list:
+        """ Long poll for up to max_messages (SQS caps a single receive at 10) """
+        response = self.sqs.receive_message(
+            QueueUrl=queue_url,
+            MaxNumberOfMessages=max(1, min(10, max_messages)),
+            WaitTimeSeconds=wait_time,
+            VisibilityTimeout=visibility_timeout
+        )
+        return response.get("Messages", [])
+
+    def delete_sqs_message(self, ReceiptHandle: str, queue_url: str = None):
         self.sqs.delete_message(
-            QueueUrl=self.url,
+            QueueUrl=queue_url or self.url,
             ReceiptHandle=ReceiptHandle,
         )
+
+    @staticmethod
+    def queue_url_from_arn(arn: str) -> str:
+        """ arn:aws:sqs:<region>:<account>:<name> -> https://sqs.<region>.amazonaws.com/<account>/<name> """
+        if not arn:
+            return None
+        _, _, _, region, account, name = arn.split(":", 5)
+        return f"https://sqs.{region}.amazonaws.com/{account}/{name}"
+
+    async def receive_messages_async(self, queue_url: str, max_messages: int = 1, wait_time: int = 20, visibility_timeout: int = 300) -> list:
+        return await run_blocking(self.receive_messages, queue_url, max_messages, wait_time, visibility_timeout)
+
+    async def delete_sqs_message_async(self, ReceiptHandle: str):
+        await run_blocking(self.delete_sqs_message, ReceiptHandle)
@@ -0,0 +1,114 @@
+import os
+import time
+import threading
+import logging
+from typing import Optional
+from Config.Metrics import metrics
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+"""
+    Keeps in-flight SQS messages invisible while they are being processed.
+
+    A background thread periodically pushes the visibility timeout of every tracked
+    message forward, so a generation that outlives the receive VisibilityTimeout is
+    not redelivered and processed twice. Extensions stop as soon as the message is
+    marked done, or once it has been held for SQS_HEARTBEAT_MAX_SECONDS.
+"""
+class VisibilityHeartbeat:
+    # change_message_visibility_batch accepts at most 10 entries
+    BATCH_SIZE = 10
+
+    def __init__(self, sqs, queue_url: str, visibility_timeout: Optional[int] = None, interval: Optional[float] = None, max_seconds: Optional[float] = None):
+        self.sqs = sqs
+        self.queue_url = queue_url
+        self.visibility_timeout = visibility_timeout or int(os.getenv("SQS_VISIBILITY_TIMEOUT", 300))
+        self.interval = interval or float(os.getenv("SQS_HEARTBEAT_INTERVAL", max(5, self.visibility_timeout // 3)))
+        # Bedrock read_timeout is 3600s, keep extending a little longer than that
+        self.max_seconds = max_seconds or float(os.getenv("SQS_HEARTBEAT_MAX_SECONDS", 3600 + self.visibility_timeout))
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="sqs-heartbeat", daemon=True)
+        self._thread.start()
+        logger.info(f"[SQS HEARTBEAT] started, extending to {self.visibility_timeout}s every {self.interval}s")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval)
+            self._thread = None
+
+    def track(self, msg):
+        with self._lock:
+            self._in_flight[msg['MessageId']] = {
+                "receipt_handle": msg['ReceiptHandle'],
+                "started": time.monotonic(),
+                "extensions": 0,
+            }
+            metrics.gauge("sqs.heartbeat.in_flight", len(self._in_flight))
+
+    def done(self, msg):
+        with self._lock:
+            entry = self._in_flight.pop(msg['MessageId'], None)
+            metrics.gauge("sqs.heartbeat.in_flight", len(self._in_flight))
+        if entry is None:
+            return
+        held = time.monotonic() - entry["started"]
+        metrics.observe("sqs.heartbeat.message_duration", held)
+        metrics.observe("sqs.heartbeat.extensions_per_message", entry["extensions"])
+        if entry["extensions"]:
+            metrics.observe("sqs.heartbeat.extended_message_duration", held)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self._beat()
+            except Exception as e:
+                logger.error(f"[SQS HEARTBEAT] beat failed: {e}", exc_info=True)
+
+    def _due_entries(self) -> list:
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            for message_id, entry in list(self._in_flight.items()):
+                if now - entry["started"] > self.max_seconds:
+                    logger.warning(f"[SQS HEARTBEAT] {message_id} held for {int(now - entry['started'])}s, no longer extending")
+                    metrics.incr("sqs.heartbeat.abandoned")
+                    self._in_flight.pop(message_id)
+                    continue
+                due.append((message_id, entry["receipt_handle"]))
+        return due
+
+    def _beat(self):
+        due = self._due_entries()
+        for i in range(0, len(due), self.BATCH_SIZE):
+            batch = due[i:i + self.BATCH_SIZE]
+            started = time.monotonic()
+            response = self.sqs.sqs.change_message_visibility_batch(
+                QueueUrl=self.queue_url,
+                Entries=[
+                    {"Id": message_id, "ReceiptHandle": handle, "VisibilityTimeout": self.visibility_timeout}
+                    for message_id, handle in batch
+                ]
+            )
+            metrics.observe("sqs.heartbeat.extension_call", time.monotonic() - started)
+
+            succeeded = [item["Id"] for item in response.get("Successful", [])]
+            with self._lock:
+                for message_id in succeeded:
+                    entry = self._in_flight.get(message_id)
+                    if entry is not None:
+                        entry["extensions"] += 1
+            metrics.incr("sqs.heartbeat.extensions", len(succeeded))
+
+            for failure in response.get("Failed", []):
+                metrics.incr("sqs.heartbeat.extension_failures")
+                logger.warning(f"[SQS HEARTBEAT] unable to extend {failure.get('Id')}: {failure.get('Code')} {failure.get('Message')}")
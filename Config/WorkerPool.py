@@ -0,0 +1,67 @@
+import os
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Optional
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        logger.warning(f"[WORKER POOL] invalid value for {name}, using default {default}")
+        return default
+
+
+""" Bounded worker pool used by the SQS polling consumer """
+class WorkerPool:
+    def __init__(self, workers: Optional[int] = None, queue_depth: Optional[int] = None):
+        self.workers = max(1, workers if workers is not None else _env_int("SQS_WORKERS", 4))
+        self.queue_depth = max(0, queue_depth if queue_depth is not None else _env_int("SQS_QUEUE_DEPTH", self.workers))
+        self.capacity = self.workers + self.queue_depth
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="sqs-worker")
+        self._slots = threading.Semaphore(self.capacity)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        logger.info(f"[WORKER POOL] started with {self.workers} workers, queue depth {self.queue_depth}")
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return self._in_flight
+
+    def available(self) -> int:
+        """ Number of jobs that can be accepted without blocking """
+        with self._lock:
+            return self.capacity - self._in_flight
+
+    def wait_for_capacity(self, timeout: Optional[float] = None) -> int:
+        """ Block until at least one slot is free, returns the number of free slots """
+        if not self._slots.acquire(timeout=timeout):
+            return 0
+        self._slots.release()
+        return self.available()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """ Submit a job, blocks while the pool and its queue are full """
+        self._slots.acquire()
+        with self._lock:
+            self._in_flight += 1
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def shutdown(self, wait: bool = True):
+        logger.info(f"[WORKER POOL] shutting down with {self.in_flight()} jobs in flight")
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,10 @@
+-- Persistent tier of the LLM response cache (RESPONSE_CACHE=postgres)
+CREATE TABLE IF NOT EXISTS stu_tracker.llm_response_cache (
+    cache_key   TEXT PRIMARY KEY,
+    result      JSONB NOT NULL,
+    usage       JSONB,
+    created_at  TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS llm_response_cache_created_at_idx
+    ON stu_tracker.llm_response_cache (created_at);
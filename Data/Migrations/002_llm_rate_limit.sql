@@ -0,0 +1,9 @@
+-- Shared token buckets for the LLM rate limiter (RATE_LIMIT_BACKEND=postgres)
+-- One row per provider[:model]:rpm|tpm bucket, rows are upserted by the workers.
+CREATE TABLE IF NOT EXISTS stu_tracker.llm_rate_limit (
+    bucket_key      TEXT PRIMARY KEY,
+    tokens          DOUBLE PRECISION NOT NULL,
+    capacity        DOUBLE PRECISION NOT NULL,
+    refill_per_sec  DOUBLE PRECISION NOT NULL,
+    updated_at      TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+);
@@ -0,0 +1,31 @@
+-- Invalidation for the reference row cache (REFERENCE_CACHE_LISTEN=true)
+-- Every change to a district, subject or assessment notifies the workers listening on
+-- reference_cache_invalidation, which drop the cached row (and the assessments of an edited subject).
+CREATE OR REPLACE FUNCTION stu_tracker.notify_reference_change() RETURNS trigger AS $$
+DECLARE
+    changed RECORD;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        changed := OLD;
+    ELSE
+        changed := NEW;
+    END IF;
+    PERFORM pg_notify(
+        'reference_cache_invalidation',
+        json_build_object('table', TG_TABLE_NAME, 'organization_id', changed.organization_id, 'id', changed.id)::text
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS district_reference_cache ON stu_tracker.District;
+CREATE TRIGGER district_reference_cache AFTER UPDATE OR DELETE ON stu_tracker.District
+    FOR EACH ROW EXECUTE FUNCTION stu_tracker.notify_reference_change();
+
+DROP TRIGGER IF EXISTS subjects_reference_cache ON stu_tracker.Subjects;
+CREATE TRIGGER subjects_reference_cache AFTER UPDATE OR DELETE ON stu_tracker.Subjects
+    FOR EACH ROW EXECUTE FUNCTION stu_tracker.notify_reference_change();
+
+DROP TRIGGER IF EXISTS assessments_reference_cache ON stu_tracker.Assessments;
+CREATE TRIGGER assessments_reference_cache AFTER UPDATE OR DELETE ON stu_tracker.Assessments
+    FOR EACH ROW EXECUTE FUNCTION stu_tracker.notify_reference_change();
@@ -0,0 +1,101 @@
+import logging
+from Data.Repositories.BusinessRepository import BusinessRepository
+from Data.Repositories.CompletionWriter import AsyncCompletionWriter, completion_batching_enabled, get_completion_writer
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+""" Awaitable BusinessRepository, same queries and return shapes on the async PostgreSQL client """
+class AsyncBusinessRepository:
+    def __init__(self, db):
+        logger.info("[INFO] call stack init AsyncBusinessRepository")
+        self.db = db
+        self.preloaded = {}
+
+    async def preload_context(self, keys) -> int:
+        loaded = 0
+        for (table, organization_id), ids in BusinessRepository.group_context_keys(keys).items():
+            query = BusinessRepository.GET_DISTRICT_SUBJECTS_BY_IDS if table == "district" else BusinessRepository.GET_ASSESSMENTS_BY_IDS
+            rows = await self._fetch_all("preload_context", query, (organization_id, ids))
+            self.preloaded.update(BusinessRepository.index_context_rows(table, organization_id, ids, rows))
+            loaded += len(ids)
+        return loaded
+
+    _preloaded = BusinessRepository._preloaded
+
+    async def _fetch_dict(self, name: str, query: str, params: tuple):
+        logger.info(f"[DB] executing {name} query: {query} and with {params}")
+        data = await self.db.fetch_one(query, params)
+        if not data:
+            return None
+        return dict(data)
+
+    async def _execute(self, name: str, query: str, params: tuple) -> int:
+        logger.info(f"[DB] executing {name} query: {query} and with {params}")
+        return await self.db.execute_res(query, params)
+
+    async def _fetch_all(self, name: str, query: str, params: tuple) -> list:
+        logger.info(f"[DB] executing {name} query: {query} and with {params}")
+        return await self.db.fetch_all(query, params)
+
+    async def get_district_by_id(self, params: tuple) -> dict:
+        found, row = self._preloaded("district", params)
+        if found:
+            return row
+        return await self._fetch_dict("get_district_by_id", BusinessRepository.GET_DISTRICT_BY_ID, params)
+
+    async def get_subjects_by_id(self, params: tuple) -> dict:
+        found, row = self._preloaded("subjects", params)
+        if found:
+            return row
+        return await self._fetch_dict("get_subjects_by_id", BusinessRepository.GET_SUBJECTS_BY_ID, params)
+
+    async def get_assessment_by_id(self, params: tuple) -> dict:
+        found, row = self._preloaded("assessments", params)
+        if found:
+            return row
+        return await self._fetch_dict("get_assessment_by_id", BusinessRepository.GET_ASSESSMENT_BY_ID, params)
+
+    async def get_status_by_input_key(self, params: tuple) -> dict:
+        logger.info(f"[DB] executing get_status_by_input_key query: {BusinessRepository.GET_STATUS_BY_INPUT_KEY} and with {params}")
+        return await self.db.fetch_one(BusinessRepository.GET_STATUS_BY_INPUT_KEY, params)
+
+    async def update_aquestion_json_by_input_key(self, params: tuple) -> int:
+        return await self._execute("update_aquestion_json_by_input_key", BusinessRepository.UPDATE_AQUESTION_JSON_BY_INPUT_KEY, params)
+
+    async def update_gmaterials_json_by_input_key(self, params: tuple) -> int:
+        return await self._execute("update_gmaterials_json_by_input_key", BusinessRepository.UPDATE_GMATERIALS_JSON_BY_INPUT_KEY, params)
+
+    async def update_questions_status_by_input_key(self, params: tuple) -> int:
+        return await self._execute("update_questions_status_by_input_key", BusinessRepository.UPDATE_QUESTIONS_STATUS_BY_INPUT_KEY, params)
+
+    async def update_materials_status_by_input_key(self, params: tuple) -> int:
+        return await self._execute("update_materials_status_by_input_key", BusinessRepository.UPDATE_MATERIALS_STATUS_BY_INPUT_KEY, params)
+
+    async def update_materials_task_by_input_key(self, params: tuple) -> int:
+        return await self._execute("update_materials_task_by_input_key", BusinessRepository.UPDATE_MATERIALS_TASK_BY_INPUT_KEY, params)
+
+    async def update_aquestion_usage_by_input_key(self, params: tuple) -> int:
+        return await self._execute("update_aquestion_usage_by_input_key", BusinessRepository.UPDATE_AQUESTION_USAGE_BY_INPUT_KEY, params)
+
+    async def update_gmaterials_usage_by_input_key(self, params: tuple) -> int:
+        return await self._execute("update_gmaterials_usage_by_input_key", BusinessRepository.UPDATE_GMATERIALS_USAGE_BY_INPUT_KEY, params)
+
+    async def get_questions_token_history(self, params: tuple) -> list:
+        return await self._fetch_all("get_questions_token_history", BusinessRepository.GET_QUESTIONS_TOKEN_HISTORY, params)
+
+    async def get_materials_token_history(self, params: tuple) -> list:
+        return await self._fetch_all("get_materials_token_history", BusinessRepository.GET_MATERIALS_TOKEN_HISTORY, params)
+
+    async def complete_aquestion_by_input_key(self, params: tuple) -> int:
+        return await self._complete("complete_aquestion_by_input_key", BusinessRepository.COMPLETE_AQUESTION_BY_INPUT_KEY, BusinessRepository.COMPLETE_AQUESTIONS_BATCH, params)
+
+    async def complete_gmaterials_by_input_key(self, params: tuple) -> int:
+        return await self._complete("complete_gmaterials_by_input_key", BusinessRepository.COMPLETE_GMATERIALS_BY_INPUT_KEY, BusinessRepository.COMPLETE_GMATERIALS_BATCH, params)
+
+    async def _complete(self, name: str, query: str, batch_query: str, params: tuple) -> int:
+        if completion_batching_enabled():
+            logger.info(f"[DB] queueing {name} row for {params[3:]}")
+            writer = get_completion_writer(self.db, AsyncCompletionWriter)
+            return await writer.write(batch_query, BusinessRepository.COMPLETE_BATCH_TEMPLATE, tuple(params[3:]), tuple(params))
+        return await self._execute(name, query, params)
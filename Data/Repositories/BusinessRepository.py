@@ -1,97 +1,251 @@
 import logging
+import threading
+from collections import defaultdict
+from typing import Iterable
+from Data.Repositories.CompletionWriter import completion_batching_enabled, get_completion_writer
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 """ Fetch from postgres repository class."""
 class BusinessRepository:
+    # queries are shared with AsyncBusinessRepository, which runs them on the async client
+    GET_DISTRICT_BY_ID = "SELECT name, city, state, region FROM " \
+    "stu_tracker.District WHERE organization_id = %s AND id = %s;"
+    GET_SUBJECTS_BY_ID = "SELECT title, description FROM stu_tracker.Subjects " \
+    "WHERE organization_id = %s AND id = %s;"
+    UPDATE_AQUESTION_JSON_BY_INPUT_KEY = "UPDATE stu_tracker.Generate_questions_task SET " \
+    "json_output = %s, status = 'DONE' WHERE organization_id = %s AND s3_output_key = %s;"
+    UPDATE_GMATERIALS_JSON_BY_INPUT_KEY = "UPDATE stu_tracker.Generate_materials_task SET " \
+    "json_output = %s, status = 'DONE' WHERE organization_id = %s AND s3_output_key = %s;"
+    UPDATE_QUESTIONS_STATUS_BY_INPUT_KEY = "UPDATE stu_tracker.Generate_questions_task SET " \
+    "status = %s, retry_count = retry_count + 1 WHERE organization_id = %s AND s3_output_key = %s;"
+    UPDATE_MATERIALS_STATUS_BY_INPUT_KEY = "UPDATE stu_tracker.Generate_materials_task SET " \
+    "status = %s, retry_count = retry_count + 1 WHERE organization_id = %s AND s3_output_key = %s;"
+    UPDATE_MATERIALS_TASK_BY_INPUT_KEY = "UPDATE stu_tracker.Generate_materials_task SET " \
+    "status = %s, retry_count = retry_count + 1 WHERE organization_id = %s AND s3_output_key = %s;"
+    GET_STATUS_BY_INPUT_KEY = "SELECT status, retry_count FROM stu_tracker.Generate_questions_task " \
+    "WHERE organization_id = %s AND s3_output_key = %s;"
+    UPDATE_AQUESTION_USAGE_BY_INPUT_KEY = "UPDATE stu_tracker.Generate_questions_task SET " \
+    "input_tokens = %s, output_tokens = %s WHERE organization_id = %s AND s3_output_key = %s;"
+    UPDATE_GMATERIALS_USAGE_BY_INPUT_KEY = "UPDATE stu_tracker.Generate_materials_task SET " \
+    "input_tokens = %s, output_tokens = %s WHERE organization_id = %s AND s3_output_key = %s;"
+    GET_QUESTIONS_TOKEN_HISTORY = "SELECT jsonb_array_length(json_output::jsonb -> 'questions') AS item_count, input_tokens, output_tokens " \
+    "FROM stu_tracker.Generate_questions_task " \
+    "WHERE status = 'DONE' AND output_tokens > 0 AND json_output IS NOT NULL LIMIT %s;"
+    GET_MATERIALS_TOKEN_HISTORY = "SELECT 0 AS item_count, input_tokens, output_tokens " \
+    "FROM stu_tracker.Generate_materials_task " \
+    "WHERE status = 'DONE' AND output_tokens > 0 LIMIT %s;"
+    GET_ASSESSMENT_BY_ID = "SELECT a.id, a.title AS assessment_title, a.description AS assessment_description, s.title AS subject_title, s.description AS subject_description " \
+    "FROM stu_tracker.Assessments a JOIN stu_tracker.Subjects s " \
+    "ON s.id = a.subject_id " \
+    "WHERE a.organization_id = %s AND a.id = %s;"
+    # batch loader: subjects are keyed by the job's district_id, the same id get_subjects_by_id is called with
+    GET_DISTRICT_SUBJECTS_BY_IDS = "SELECT d.id, d.name, d.city, d.state, d.region, s.id AS subject_id, s.title, s.description " \
+    "FROM stu_tracker.District d LEFT JOIN stu_tracker.Subjects s " \
+    "ON s.organization_id = d.organization_id AND s.id = d.id " \
+    "WHERE d.organization_id = %s AND d.id = ANY(%s);"
+    GET_ASSESSMENTS_BY_IDS = "SELECT a.id, a.title AS assessment_title, a.description AS assessment_description, s.title AS subject_title, s.description AS subject_description " \
+    "FROM stu_tracker.Assessments a JOIN stu_tracker.Subjects s " \
+    "ON s.id = a.subject_id " \
+    "WHERE a.organization_id = %s AND a.id = ANY(%s);"
+    CONTEXT_TABLES = ("district", "assessments")
+    # finished jobs: result, status and usage in one statement, (json_output, input_tokens, output_tokens, organization_id, s3_output_key)
+    COMPLETE_AQUESTION_BY_INPUT_KEY = "UPDATE stu_tracker.Generate_questions_task SET " \
+    "json_output = %s, status = 'DONE', input_tokens = %s, output_tokens = %s WHERE organization_id = %s AND s3_output_key = %s;"
+    COMPLETE_GMATERIALS_BY_INPUT_KEY = "UPDATE stu_tracker.Generate_materials_task SET " \
+    "json_output = %s, status = 'DONE', input_tokens = %s, output_tokens = %s WHERE organization_id = %s AND s3_output_key = %s;"
+    # the same rows of many jobs at once, written by the CompletionWriter with one VALUES entry per job
+    COMPLETE_AQUESTIONS_BATCH = "UPDATE stu_tracker.Generate_questions_task AS t SET " \
+    "json_output = v.json_output, status = 'DONE', input_tokens = v.input_tokens, output_tokens = v.output_tokens " \
+    "FROM (VALUES %s) AS v (json_output, input_tokens, output_tokens, organization_id, s3_output_key) " \
+    "WHERE t.organization_id = v.organization_id AND t.s3_output_key = v.s3_output_key " \
+    "RETURNING t.organization_id, t.s3_output_key;"
+    COMPLETE_GMATERIALS_BATCH = "UPDATE stu_tracker.Generate_materials_task AS t SET " \
+    "json_output = v.json_output, status = 'DONE', input_tokens = v.input_tokens, output_tokens = v.output_tokens " \
+    "FROM (VALUES %s) AS v (json_output, input_tokens, output_tokens, organization_id, s3_output_key) " \
+    "WHERE t.organization_id = v.organization_id AND t.s3_output_key = v.s3_output_key " \
+    "RETURNING t.organization_id, t.s3_output_key;"
+    # every column typed, VALUES rows have no column types and an untyped str org id would compare as text
+    COMPLETE_BATCH_TEMPLATE = "(%s::jsonb, %s::integer, %s::integer, %s::integer, %s::text)"
+
     def __init__(self, db):
         logger.info("[INFO] call stack init BusinessRepository")
         self.db = db
-    
+        # (table, organization_id, id) -> row or None, filled by preload_context for one batch
+        self.preloaded = {}
+        # set by expire() once the batch that shares this repository has been reported
+        self.expired = threading.Event()
+
+    def expire(self):
+        """ Refuse further writes, a job still running after its batch was reported must not persist """
+        self.expired.set()
+
+    def _check_writable(self):
+        if self.expired.is_set():
+            raise RuntimeError("Batch deadline passed, the record was already reported for retry")
+
+    @classmethod
+    def group_context_keys(cls, keys: Iterable[tuple]) -> dict:
+        """ (table, organization_id, id) keys -> {(table, organization_id): [ids]}, one query per group """
+        groups = defaultdict(list)
+        for table, organization_id, row_id in keys:
+            if table in cls.CONTEXT_TABLES and organization_id is not None and row_id is not None \
+                    and row_id not in groups[(table, organization_id)]:
+                groups[(table, organization_id)].append(row_id)
+        return {group: ids for group, ids in groups.items() if ids}
+
+    @staticmethod
+    def index_context_rows(table: str, organization_id: int, ids: list, rows: list) -> dict:
+        """ Preloaded entries for one group, ids without a row are stored as None so they are not fetched again """
+        if table == "district":
+            entries = {("district", organization_id, row_id): None for row_id in ids}
+            entries.update({("subjects", organization_id, row_id): None for row_id in ids})
+            for row in rows or []:
+                row = dict(row)
+                entries[("district", organization_id, row["id"])] = {name: row[name] for name in ("name", "city", "state", "region")}
+                if row["subject_id"] is not None:
+                    entries[("subjects", organization_id, row["id"])] = {"title": row["title"], "description": row["description"]}
+            return entries
+        entries = {(table, organization_id, row_id): None for row_id in ids}
+        entries.update({(table, organization_id, row["id"]): dict(row) for row in rows or []})
+        return entries
+
+    def preload_context(self, keys: Iterable[tuple]) -> int:
+        """ Resolve the context rows of a whole batch with one query per table and organization """
+        loaded = 0
+        for (table, organization_id), ids in self.group_context_keys(keys).items():
+            query = self.GET_DISTRICT_SUBJECTS_BY_IDS if table == "district" else self.GET_ASSESSMENTS_BY_IDS
+            logger.info(f"[DB] executing preload_context query: {query} and with {(organization_id, ids)}")
+            rows = self.db.fetch_all(query, (organization_id, ids), idempotent=True)
+            self.preloaded.update(self.index_context_rows(table, organization_id, ids, rows))
+            loaded += len(ids)
+        return loaded
+
+    def _preloaded(self, table: str, params: tuple) -> tuple:
+        """ (found, row), found is False when the batch loader did not cover this key """
+        key = (table,) + tuple(params)
+        if key not in self.preloaded:
+            return False, None
+        row = self.preloaded[key]
+        return True, dict(row) if row is not None else None
+
     def get_district_by_id(self, params: tuple)->list:
         """ Returns an array of values """
-        query = "SELECT name, city, state, region FROM " \
-        "stu_tracker.District WHERE organization_id = %s AND id = %s;"
+        found, row = self._preloaded("district", params)
+        if found:
+            return row
+        query = self.GET_DISTRICT_BY_ID
         logger.info(f"[DB] executing get_district_by_id query: {query} and with {params}")
-        data = self.db.fetch_one(query, params)
+        data = self.db.fetch_one(query, params, idempotent=True)
         if not data:
             return None
-        return dict(data)    
+        return dict(data)
 
     def get_subjects_by_id(self, params: tuple)->list:
         """ Returns an array of values """
-        query = "SELECT title, description FROM stu_tracker.Subjects " \
-        "WHERE organization_id = %s AND id = %s;"
+        found, row = self._preloaded("subjects", params)
+        if found:
+            return row
+        query = self.GET_SUBJECTS_BY_ID
         logger.info(f"[DB] executing get_subjects_by_id query: {query} and with {params}")
-        data = self.db.fetch_one(query, params)
+        data = self.db.fetch_one(query, params, idempotent=True)
         if not data:
             return None
         return dict(data)
 
     def update_aquestion_json_by_input_key(self, params: tuple) ->int:
         """ Update a Generate_questions_task given a input_key and organization_id"""
-        query = "UPDATE stu_tracker.Generate_questions_task SET " \
-        "json_output = %s, status = 'DONE' WHERE organization_id = %s AND s3_output_key = %s;"
+        query = self.UPDATE_AQUESTION_JSON_BY_INPUT_KEY
         logger.info(f"[DB] executing update_aquestion_json_by_input_key query: {query} and with {params}")
+        self._check_writable()
         return self.db.execute_res(query, params)
-    
+
     def update_gmaterials_json_by_input_key(self, params: tuple) ->int:
         """ Update a Generate_questions_task given a input_key and organization_id"""
-        query = "UPDATE stu_tracker.Generate_materials_task SET " \
-        "json_output = %s, status = 'DONE' WHERE organization_id = %s AND s3_output_key = %s;"
+        query = self.UPDATE_GMATERIALS_JSON_BY_INPUT_KEY
         logger.info(f"[DB] executing update_gmaterials_json_by_input_key query: {query} and with {params}")
+        self._check_writable()
         return self.db.execute_res(query, params)
-    
+
     def update_questions_status_by_input_key(self, params: tuple) ->int:
         """ Update state of request """
-        query = "UPDATE stu_tracker.Generate_questions_task SET " \
-        "status = %s, retry_count = retry_count + 1 WHERE organization_id = %s AND s3_output_key = %s;"
+        query = self.UPDATE_QUESTIONS_STATUS_BY_INPUT_KEY
         logger.info(f"[DB] executing update_questions_status_by_input_key query: {query} and with {params}")
+        self._check_writable()
         return self.db.execute_res(query, params)
 
     def update_materials_status_by_input_key(self, params: tuple) ->int:
         """ Update state of request """
-        query = "UPDATE stu_tracker.Generate_materials_task SET " \
-        "status = %s, retry_count = retry_count + 1 WHERE organization_id = %s AND s3_output_key = %s;"
+        query = self.UPDATE_MATERIALS_STATUS_BY_INPUT_KEY
         logger.info(f"[DB] executing update_materials_status_by_input_key query: {query} and with {params}")
+        self._check_writable()
         return self.db.execute_res(query, params)
-    
+
     def update_materials_task_by_input_key(self, params: tuple) ->int:
         """ Update state of request """
-        query = "UPDATE stu_tracker.Generate_materials_task SET " \
-        "status = %s, retry_count = retry_count + 1 WHERE organization_id = %s AND s3_output_key = %s;"
+        query = self.UPDATE_MATERIALS_TASK_BY_INPUT_KEY
         logger.info(f"[DB] executing update_materials_task_by_input_key query: {query} and with {params}")
+        self._check_writable()
         return self.db.execute_res(query, params)
-    
+
     def get_status_by_input_key(self, params: tuple)->dict:
-        query = "SELECT status, retry_count FROM stu_tracker.Generate_questions_task " \
-        "WHERE organization_id = %s AND s3_output_key = %s;"
+        query = self.GET_STATUS_BY_INPUT_KEY
         logger.info(f"[DB] executing get_status_by_input_key query: {query} and with {params}")
-        return self.db.fetch_one(query, params)
-    
+        return self.db.fetch_one(query, params, idempotent=True)
+
 
     def update_aquestion_usage_by_input_key(self, params: tuple) ->int:
         """ Update a Generate_questions_task given a input_key and organization_id"""
-        query = "UPDATE stu_tracker.Generate_questions_task SET " \
-        "input_tokens = %s, output_tokens = %s WHERE organization_id = %s AND s3_output_key = %s;"
+        query = self.UPDATE_AQUESTION_USAGE_BY_INPUT_KEY
         logger.info(f"[DB] executing update_aquestion_usage_by_input_key query: {query} and with {params}")
+        self._check_writable()
         return self.db.execute_res(query, params)
-    
+
     def update_gmaterials_usage_by_input_key(self, params: tuple) ->int:
         """ Update a Generate_questions_task given a input_key and organization_id"""
-        query = "UPDATE stu_tracker.Generate_materials_task SET " \
-        "input_tokens = %s, output_tokens = %s WHERE organization_id = %s AND s3_output_key = %s;"
+        query = self.UPDATE_GMATERIALS_USAGE_BY_INPUT_KEY
         logger.info(f"[DB] executing update_gmaterials_usage_by_input_key query: {query} and with {params}")
+        self._check_writable()
         return self.db.execute_res(query, params)
-    
+
+    def get_questions_token_history(self, params: tuple) ->list:
+        """ Question count and token usage of finished question tasks, fits the output size model """
+        query = self.GET_QUESTIONS_TOKEN_HISTORY
+        logger.info(f"[DB] executing get_questions_token_history query: {query} and with {params}")
+        return self.db.fetch_all(query, params, idempotent=True)
+
+    def get_materials_token_history(self, params: tuple) ->list:
+        """ Token usage of finished materials tasks, fits the output size model """
+        query = self.GET_MATERIALS_TOKEN_HISTORY
+        logger.info(f"[DB] executing get_materials_token_history query: {query} and with {params}")
+        return self.db.fetch_all(query, params, idempotent=True)
+
     def get_assessment_by_id(self, params: tuple) ->dict:
-        query = "SELECT a.id, a.title AS assessment_title, a.description AS assessment_description, s.title AS subject_title, s.description AS subject_description " \
-        "FROM stu_tracker.Assessments a JOIN stu_tracker.Subjects s " \
-        "ON s.id = a.subject_id " \
-        "WHERE a.organization_id = %s AND a.id = %s;"
+        found, row = self._preloaded("assessments", params)
+        if found:
+            return row
+        query = self.GET_ASSESSMENT_BY_ID
         logger.info(f"[DB] executing update_gmaterials_usage_by_input_key query: {query} and with {params}")
-        data = self.db.fetch_one(query, params)
+        data = self.db.fetch_one(query, params, idempotent=True)
         if not data:
             return None
-        return dict(data)
\ No newline at end of file
+        return dict(data)
+
+    def complete_aquestion_by_input_key(self, params: tuple) ->int:
+        """ Store the questions, status DONE and token usage of a job in one UPDATE """
+        return self._complete("complete_aquestion_by_input_key", self.COMPLETE_AQUESTION_BY_INPUT_KEY, self.COMPLETE_AQUESTIONS_BATCH, params)
+
+    def complete_gmaterials_by_input_key(self, params: tuple) ->int:
+        """ Store the materials, status DONE and token usage of a job in one UPDATE """
+        return self._complete("complete_gmaterials_by_input_key", self.COMPLETE_GMATERIALS_BY_INPUT_KEY, self.COMPLETE_GMATERIALS_BATCH, params)
+
+    def _complete(self, name: str, query: str, batch_query: str, params: tuple) ->int:
+        """ Blocks until the row is written, batched with other jobs' completions unless COMPLETION_BATCHING=false """
+        self._check_writable()
+        if completion_batching_enabled():
+            logger.info(f"[DB] queueing {name} row for {params[3:]}")
+            return get_completion_writer(self.db).write(batch_query, self.COMPLETE_BATCH_TEMPLATE, tuple(params[3:]), tuple(params), self.expired)
+        logger.info(f"[DB] executing {name} query: {query} and with {params}")
+        # sets absolute values, safe to repeat after a lost connection
+        return self.db.execute_res(query, params, idempotent=True)
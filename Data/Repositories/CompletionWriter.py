@@ -0,0 +1,215 @@
+import os
+import time
+import queue
+import asyncio
+import threading
+import logging
+from concurrent.futures import Future, wait
+from typing import Optional
+from Config.Metrics import metrics
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+"""
+    Batched writer for finished task rows (COMPLETION_BATCHING, on by default).
+
+    Jobs hand in their completion UPDATE row and wait for it. Rows arriving within
+    COMPLETION_FLUSH_MS of each other, up to COMPLETION_BATCH_SIZE of them, are written with
+    one UPDATE ... FROM (VALUES ...) statement per query. A job only returns, and its SQS
+    message is only acknowledged, once the statement holding its row has run. Rows for the
+    same key in one batch are coalesced, the last one is written and every waiter gets its
+    result. Each waiter gets the number of rows its key matched, like execute_res.
+
+    A row handed in with its repository's expired event is dropped at flush time once the
+    event is set, its waiter gets an error instead. A thread-mode waiter gives up after
+    COMPLETION_WRITE_TIMEOUT seconds.
+"""
+
+
+def completion_batching_enabled() -> bool:
+    return os.getenv("COMPLETION_BATCHING", "true").lower() in ("1", "true", "yes")
+
+
+def _write_timeout() -> float:
+    return float(os.getenv("COMPLETION_WRITE_TIMEOUT", 120))
+
+
+def _settings(batch_size: Optional[int], flush_ms: Optional[float]) -> tuple:
+    return (
+        max(1, batch_size or int(os.getenv("COMPLETION_BATCH_SIZE", 50))),
+        max(0.0, flush_ms if flush_ms is not None else float(os.getenv("COMPLETION_FLUSH_MS", 20))) / 1000
+    )
+
+
+def _key(values) -> tuple:
+    """ Keys compare as text, a job may carry organization_id as a str while RETURNING gives an int """
+    return tuple(str(value) for value in values)
+
+
+def _group(batch: list) -> dict:
+    """ (query, template) -> {key: [row, waiters, expired]}, later rows for a key replace earlier ones """
+    groups = {}
+    for query, template, key, row, waiter, expired in batch:
+        entry = groups.setdefault((query, template), {}).setdefault(_key(key), [row, [], expired])
+        if entry[1]:
+            metrics.incr("db.completion_writer.coalesced")
+        entry[0], entry[2] = row, expired
+        entry[1].append(waiter)
+    return groups
+
+
+def _fail(waiters: list, error: Exception):
+    for waiter in waiters:
+        if not waiter.done():
+            waiter.set_exception(error)
+
+
+def _live(rows: dict) -> dict:
+    """ Rows still to write, the ones whose batch deadline passed while queued are dropped """
+    live = {}
+    for key, (row, waiters, expired) in rows.items():
+        if expired is not None and expired.is_set():
+            metrics.incr("db.completion_writer.expired")
+            _fail(waiters, RuntimeError("Batch deadline passed before the completion was written"))
+            continue
+        live[key] = (row, waiters)
+    return live
+
+
+def _matched(returned) -> set:
+    """ RETURNING rows are the keys that matched, as dicts or tuples depending on the cursor """
+    return {_key(row.values() if isinstance(row, dict) else row) for row in returned or []}
+
+
+class CompletionWriter:
+    """ Thread-mode writer, one flusher thread and waiters blocked on concurrent futures """
+    def __init__(self, db, batch_size: Optional[int] = None, flush_ms: Optional[float] = None):
+        self.db = db
+        self.batch_size, self.flush_seconds = _settings(batch_size, flush_ms)
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="completion-writer", daemon=True)
+                self._thread.start()
+
+    def write(self, query: str, template: str, key: tuple, row: tuple, expired: Optional[threading.Event] = None) -> int:
+        """ Queue one row and block until it is written, raises what the flush raised or TimeoutError """
+        self._start()
+        waiter = Future()
+        self._queue.put((query, template, key, row, waiter, expired))
+        done, _ = wait([waiter], timeout=_write_timeout())
+        if not done:
+            metrics.incr("db.completion_writer.timeouts")
+            raise TimeoutError(f"completion row {key} not written within {_write_timeout():.0f}s")
+        return waiter.result()
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            for (query, template), rows in _group(batch).items():
+                try:
+                    self._flush(query, template, rows)
+                except Exception as e:
+                    # keep the thread alive, the batch's waiters get the error
+                    logger.error(f"[DB] completion writer flush failed: {e}", exc_info=True)
+                    _fail([waiter for _, waiters, _ in rows.values() for waiter in waiters], e)
+
+    def _flush(self, query: str, template: str, rows: dict):
+        rows = _live(rows)
+        if not rows:
+            return
+        started = time.monotonic()
+        try:
+            # completions set absolute values, a retry on a fresh connection is safe
+            matched = _matched(self.db.execute_values(query, [row for row, _ in rows.values()], template, idempotent=True))
+        except Exception as e:
+            logger.error(f"[DB] completion batch of {len(rows)} rows failed: {e}")
+            metrics.incr("db.completion_writer.failed_batches")
+            for _, waiters in rows.values():
+                _fail(waiters, e)
+            return
+        metrics.observe("db.completion_writer.batch_rows", len(rows))
+        metrics.observe("db.completion_writer.flush", time.monotonic() - started)
+        for key, (_, waiters) in rows.items():
+            for waiter in waiters:
+                waiter.set_result(int(key in matched))
+
+
+class AsyncCompletionWriter:
+    """ Asyncio-mode writer, rows pending on the running loop are flushed by one task per batch """
+    def __init__(self, db, batch_size: Optional[int] = None, flush_ms: Optional[float] = None):
+        self.db = db
+        self.batch_size, self.flush_seconds = _settings(batch_size, flush_ms)
+        self._pending = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # the loop only keeps weak references to tasks
+        self._flushes = set()
+
+    async def write(self, query: str, template: str, key: tuple, row: tuple, expired: Optional[threading.Event] = None) -> int:
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._pending.append((query, template, key, row, waiter, expired))
+        if len(self._pending) >= self.batch_size:
+            self._flush_now(loop)
+        elif self._timer is None:
+            self._timer = loop.call_later(self.flush_seconds, self._flush_now, loop)
+        return await waiter
+
+    def _flush_now(self, loop):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        for (query, template), rows in _group(batch).items():
+            task = loop.create_task(self._flush(query, template, rows))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, query: str, template: str, rows: dict):
+        rows = _live(rows)
+        if not rows:
+            return
+        started = time.monotonic()
+        try:
+            matched = _matched(await self.db.execute_values(query, [row for row, _ in rows.values()], template))
+        except Exception as e:
+            logger.error(f"[DB] completion batch of {len(rows)} rows failed: {e}")
+            metrics.incr("db.completion_writer.failed_batches")
+            for _, waiters in rows.values():
+                _fail(waiters, e)
+            return
+        metrics.observe("db.completion_writer.batch_rows", len(rows))
+        metrics.observe("db.completion_writer.flush", time.monotonic() - started)
+        for key, (_, waiters) in rows.items():
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(int(key in matched))
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+def get_completion_writer(db, writer_class=CompletionWriter):
+    """ One writer per database client, AsyncBusinessRepository asks for an AsyncCompletionWriter """
+    key = (writer_class, id(db))
+    if key not in _writers:
+        with _writers_lock:
+            if key not in _writers:
+                _writers[key] = writer_class(db)
+    return _writers[key]
@@ -0,0 +1,198 @@
+import os
+import json
+import select
+import threading
+import logging
+from typing import Any, Callable, Hashable, Optional
+from Config.LRUCache import TTLCache
+from Config.Metrics import metrics
+from Data.Repositories.BusinessRepository import BusinessRepository
+from Data.Repositories.AsyncBusinessRepository import AsyncBusinessRepository
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+"""
+    Read-through cache for the reference rows every job looks up (REFERENCE_CACHE, on by default).
+
+    District, subject and assessment rows are cached per (table, organization_id, id) in an
+    LRU bounded by REFERENCE_CACHE_MAX_ENTRIES, for REFERENCE_CACHE_TTL seconds. Missing rows
+    are not cached. With REFERENCE_CACHE_LISTEN=true a background thread LISTENs on
+    REFERENCE_CACHE_CHANNEL and drops the entries named by each notification, so edits show
+    up before the TTL runs out; see Data/Migrations/003_reference_cache_notify.sql for the
+    triggers that send them.
+"""
+# notifications name the table the trigger fired on
+TABLES = ("district", "subjects", "assessments")
+# assessment rows carry their subject's title and description
+DEPENDENTS = {"subjects": ("assessments",)}
+
+
+def reference_cache_enabled() -> bool:
+    return os.getenv("REFERENCE_CACHE", "true").lower() in ("1", "true", "yes")
+
+
+class ReferenceCache:
+    def __init__(self, max_entries: Optional[int] = None, ttl_seconds: Optional[float] = None):
+        self.cache = TTLCache(
+            max_entries or int(os.getenv("REFERENCE_CACHE_MAX_ENTRIES", 4096)),
+            ttl_seconds or float(os.getenv("REFERENCE_CACHE_TTL", 600))
+        )
+
+    @staticmethod
+    def key(table: str, params: tuple) -> Hashable:
+        organization_id, row_id = params
+        return table, organization_id, row_id
+
+    def get(self, table: str, params: tuple) -> Optional[dict]:
+        if not reference_cache_enabled():
+            return None
+        row = self.cache.get(self.key(table, params))
+        metrics.incr(f"reference_cache.{table}.{'hit' if row is not None else 'miss'}")
+        # callers may edit the row they get, never hand out the cached dict itself
+        return dict(row) if row is not None else None
+
+    def put(self, table: str, params: tuple, row: Optional[dict]):
+        if row is not None and reference_cache_enabled():
+            self.cache.set(self.key(table, params), dict(row))
+
+    def read_through(self, table: str, params: tuple, load: Callable[[], Optional[dict]]) -> Optional[dict]:
+        row = self.get(table, params)
+        if row is None:
+            row = load()
+            self.put(table, params, row)
+        return row
+
+    async def read_through_async(self, table: str, params: tuple, load: Callable[[], Any]) -> Optional[dict]:
+        row = self.get(table, params)
+        if row is None:
+            row = await load()
+            self.put(table, params, row)
+        return row
+
+    def uncached(self, keys) -> list:
+        """ Batch keys the cache cannot answer yet, a district key also needs its subjects row """
+        if not reference_cache_enabled():
+            return list(keys)
+        # a membership check, planning the batch query is not a lookup and must not count as a hit or miss
+        def cached(table, organization_id, row_id):
+            return (table, organization_id, row_id) in self.cache
+        return [
+            (table, organization_id, row_id) for table, organization_id, row_id in keys
+            if not cached(table, organization_id, row_id)
+            or (table == "district" and not cached("subjects", organization_id, row_id))
+        ]
+
+    def invalidate(self, table: str, organization_id: Optional[int] = None, row_id: Optional[int] = None) -> int:
+        """ Drop one row, every row of an organization or the whole table, and the rows built from it """
+        def matches(key, name=table, by_row=True):
+            return key[0] == name \
+                and (organization_id is None or key[1] == organization_id) \
+                and (not by_row or row_id is None or key[2] == row_id)
+        dropped = self.cache.delete_where(matches)
+        for dependent in DEPENDENTS.get(table, ()):
+            dropped += self.cache.delete_where(lambda key, name=dependent: matches(key, name, by_row=False))
+        metrics.incr("reference_cache.invalidations")
+        logger.info(f"[REFERENCE CACHE] invalidated {table} organization={organization_id} id={row_id}: {dropped} entries")
+        return dropped
+
+    def invalidate_payload(self, payload: str):
+        """ Notification payload: {"table": ..., "organization_id": ..., "id": ...}, anything unreadable clears all """
+        try:
+            change = json.loads(payload)
+            table = str(change["table"]).lower()
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"[REFERENCE CACHE] unreadable notification {payload!r}, clearing the cache")
+            self.cache.clear()
+            return
+        if table in TABLES:
+            self.invalidate(table, change.get("organization_id"), change.get("id"))
+
+
+class InvalidationListener(threading.Thread):
+    """ Holds one dedicated connection in LISTEN, reconnects with backoff and clears the cache after a gap """
+    def __init__(self, cache: ReferenceCache, channel: Optional[str] = None):
+        super().__init__(name="reference-cache-listen", daemon=True)
+        self.cache = cache
+        self.channel = channel or os.getenv("REFERENCE_CACHE_CHANNEL", "reference_cache_invalidation")
+        self._stop_event = threading.Event()
+
+    def _connect(self):
+        import psycopg2
+        from Config.PostgreSQL import connection_kwargs
+        conn = psycopg2.connect(**connection_kwargs())
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {self.channel};")
+        return conn
+
+    def run(self):
+        delay = 1.0
+        while not self._stop_event.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                # notifications sent while we were not listening are lost
+                self.cache.cache.clear()
+                logger.info(f"[REFERENCE CACHE] listening on {self.channel}")
+                delay = 1.0
+                while not self._stop_event.is_set():
+                    if select.select([conn], [], [], 5.0)[0]:
+                        conn.poll()
+                        while conn.notifies:
+                            self.cache.invalidate_payload(conn.notifies.pop(0).payload)
+            except Exception as e:
+                logger.warning(f"[REFERENCE CACHE] listener failed ({e}), reconnecting in {delay:.0f}s")
+                metrics.incr("reference_cache.listener_errors")
+                self._stop_event.wait(delay)
+                delay = min(delay * 2, 60.0)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_reference_cache() -> ReferenceCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ReferenceCache()
+                if reference_cache_enabled() and os.getenv("REFERENCE_CACHE_LISTEN", "false").lower() in ("1", "true", "yes"):
+                    InvalidationListener(_cache).start()
+    return _cache
+
+
+class CachedBusinessRepository(BusinessRepository):
+    """ BusinessRepository with the reference lookups read through the shared cache """
+    def preload_context(self, keys) -> int:
+        # preloaded rows reach the cache on the processors' first read through
+        return super().preload_context(get_reference_cache().uncached(keys))
+
+    def get_district_by_id(self, params: tuple) -> dict:
+        return get_reference_cache().read_through("district", params, lambda: super(CachedBusinessRepository, self).get_district_by_id(params))
+
+    def get_subjects_by_id(self, params: tuple) -> dict:
+        return get_reference_cache().read_through("subjects", params, lambda: super(CachedBusinessRepository, self).get_subjects_by_id(params))
+
+    def get_assessment_by_id(self, params: tuple) -> dict:
+        return get_reference_cache().read_through("assessments", params, lambda: super(CachedBusinessRepository, self).get_assessment_by_id(params))
+
+
+class AsyncCachedBusinessRepository(AsyncBusinessRepository):
+    async def preload_context(self, keys) -> int:
+        return await super().preload_context(get_reference_cache().uncached(keys))
+
+    async def get_district_by_id(self, params: tuple) -> dict:
+        return await get_reference_cache().read_through_async("district", params, lambda: super(AsyncCachedBusinessRepository, self).get_district_by_id(params))
+
+    async def get_subjects_by_id(self, params: tuple) -> dict:
+        return await get_reference_cache().read_through_async("subjects", params, lambda: super(AsyncCachedBusinessRepository, self).get_subjects_by_id(params))
+
+    async def get_assessment_by_id(self, params: tuple) -> dict:
+        return await get_reference_cache().read_through_async("assessments", params, lambda: super(AsyncCachedBusinessRepository, self).get_assessment_by_id(params))
@@ -1,11 +1,19 @@
 import os
+import re
 import json
+import threading
 import boto3
 from botocore.config import Config
 from botocore.exceptions import BotoCoreError, ClientError
 from dotenv import load_dotenv
 from typing import Optional
 from pydantic import BaseModel, ValidationError, ValidationError
+from Config.AsyncRuntime import run_blocking
+from Validation.StreamingParser import IncrementalJSONValidator, streaming_enabled
+from Models.PromptCache import cacheable_prefix, stats as prompt_cache_stats
+from Validation.Schemas import response_schema
+from Config.Metrics import metrics
+from Config.LRUCache import TTLCache
 import logging
 load_dotenv()
 
@@ -18,7 +26,17 @@ custom_config = Config(
     retries={'max_attempts': 2}
 )
 
-bedrock = boto3.client('bedrock-runtime', region_name='us-west-1', config=custom_config)
+_bedrock = None
+_bedrock_lock = threading.Lock()
+
+def get_bedrock():
+    """ Create the bedrock-runtime client on first use and reuse it afterwards """
+    global _bedrock
+    if _bedrock is None:
+        with _bedrock_lock:
+            if _bedrock is None:
+                _bedrock = boto3.client('bedrock-runtime', region_name='us-west-1', config=custom_config)
+    return _bedrock
 
 class AmazonModelError(Exception):
     """Custom exception for Amazon Model errors"""
@@ -28,6 +46,50 @@ class AmazonModelError(Exception):
         self.original_error = original_error
         super().__init__(self.message)
 
+"""
+    Structured output on Bedrock (BEDROCK_API=converse, the default).
+
+    The Converse API is called with the validator's JSON schema as the input schema of a single
+    tool, and toolChoice forces the model to call it, so the response is the tool input rather than
+    free text. Model families that reject a forced tool fall back to toolChoice any and then to a
+    plain text prompt; the accepted mode is remembered per model id for BEDROCK_TOOL_FALLBACK_TTL
+    seconds (default 3600) and the forced tool is tried again afterwards. BEDROCK_API=invoke keeps
+    the legacy invoke_model request.
+"""
+TOOL_NAME = "record_response"
+TOOL_MODES = ("tool", "any", "text")
+# model id -> toolChoice mode Bedrock accepted, a downgrade expires so a transient answer is not kept forever
+_tool_modes = TTLCache(256, float(os.getenv("BEDROCK_TOOL_FALLBACK_TTL", 3600)))
+# only Bedrock's "not supported" answers step down a mode, any other ValidationException is a real error
+TOOL_CHOICE_UNSUPPORTED = re.compile(r"(doesn't|does not) support the toolconfig\.toolchoice|toolchoice(\.\w+)? (is )?not supported")
+TOOL_USE_UNSUPPORTED = re.compile(r"(doesn't|does not) support tool use|tool use (is )?not supported")
+
+
+def bedrock_api() -> str:
+    return os.getenv("BEDROCK_API", "converse").lower()
+
+
+def _fallback_mode(error: Exception, mode: str) -> Optional[str]:
+    """ Next toolChoice mode to try when Bedrock rejects the current one for this model, None otherwise """
+    if not isinstance(error, ClientError) or error.response.get('Error', {}).get('Code') != 'ValidationException':
+        return None
+    message = error.response.get('Error', {}).get('Message', '').lower()
+    if mode != "text" and TOOL_USE_UNSUPPORTED.search(message):
+        return "text"
+    if mode != "text" and TOOL_CHOICE_UNSUPPORTED.search(message):
+        return TOOL_MODES[TOOL_MODES.index(mode) + 1]
+    return None
+
+
+def _strip_fences(text: str) -> str:
+    text = text.strip()
+    if text.startswith('```json'):
+        return text[7:-3]
+    if text.startswith('```'):
+        return text[3:-3]
+    return text
+
+
 class AmazonModel:
     def __init__(self, response_validator: Optional[BaseModel], prompt_data: Optional[dict]):
         logger.info("[DEBUG AMAZON] === AmazonModel.__init__ called ===")
@@ -38,6 +100,7 @@ class AmazonModel:
         self.response_validator = response_validator
         self.prompt_data = prompt_data
         self.metadata = None
+        self.output_mode = f"amazon.{bedrock_api()}"
 
     def set_metadata(self, meta: Optional[dict]):
         logger.info(f"[DEBUG AMAZON] set_metadata called with: {meta}")
@@ -58,14 +121,37 @@ class AmazonModel:
             logger.error(f"[ERROR AMAZON] get_usage failed: {e}")
             raise Exception(f"Unable to find metatdata for amazon invoke call.: {e}")
         
+    def _content_blocks(self) -> list:
+        """ One text block per message, with a prompt cache checkpoint after the template's static prefix """
+        prefix = cacheable_prefix(self.prompt_data)
+        blocks = []
+        for item in self.prompt_data.get("messages"):
+            text = item['content']
+            if prefix and text.startswith(prefix) and len(text) > len(prefix):
+                blocks.extend([{"text": prefix}, {"cachePoint": {"type": "default"}}, {"text": text[len(prefix):]}])
+                prefix = None
+            else:
+                blocks.append({"text": text})
+        return blocks
+
+    def _record_prompt_cache(self):
+        usage = self.metadata or {}
+        prompt_cache_stats.record(
+            self.prompt_data,
+            "amazon",
+            usage.get('cacheReadInputTokenCount', usage.get('cacheReadInputTokens')),
+            usage.get('cacheWriteInputTokenCount', usage.get('cacheWriteInputTokens'))
+        )
+
     """ 
         Response varies by model so using Nova or claude ... will change the response dict
         To have a window of deterministic responses, models must be tracker of their response types and logged.
         
     """
-    def _invoke_model(self) -> dict:
+    def _invoke_raw(self) -> Optional[str]:
+        """ Call Bedrock and return the response text with code fences removed, unvalidated """
         logger.info("[DEBUG AMAZON] ========================================")
-        logger.info("[DEBUG AMAZON] === _invoke_model CALLED ===")
+        logger.info("[DEBUG AMAZON] === _invoke_raw CALLED ===")
         logger.info("[DEBUG AMAZON] ========================================")
         
         logger.info(f"[DEBUG AMAZON] prompt_data exists: {self.prompt_data is not None}")
@@ -94,11 +180,7 @@ class AmazonModel:
             messages = [
                 {
                     "role": "user",
-                    "content": [
-                        {
-                            "text": item['content']
-                        } for item in self.prompt_data.get("messages")
-                    ]
+                    "content": self._content_blocks()
                 }
             ]
             logger.info(f"[DEBUG AMAZON] ✓ Messages constructed successfully")
@@ -146,8 +228,15 @@ class AmazonModel:
             logger.info(f"[DEBUG AMAZON] ✓ Using model ID: {model_id}")
             
             logger.info("[DEBUG AMAZON] ===== STEP 4: Checking Bedrock client =====")
+            bedrock = get_bedrock()
             logger.info(f"[DEBUG AMAZON] Bedrock client type: {type(bedrock)}")
             logger.info(f"[DEBUG AMAZON] Bedrock client region: {bedrock.meta.region_name}")
+
+            if bedrock_api() == "converse":
+                return self._converse(bedrock, model_id)
+
+            if streaming_enabled():
+                return self._invoke_stream(bedrock, model_id, request_body)
             
             logger.info("[DEBUG AMAZON] ===== STEP 5: Invoking Bedrock model =====")
             logger.info(f"[DEBUG AMAZON] About to call bedrock.invoke_model with:")
@@ -200,6 +289,7 @@ class AmazonModel:
             logger.info(f"[DEBUG AMAZON] Usage metadata: {usage}")
 
             self.set_metadata(usage)    
+            self._record_prompt_cache()
             logger.info(f"[DEBUG AMAZON] ✓ Successfully invoked model '{model_id}'")
             
             logger.info("[DEBUG AMAZON] ===== STEP 8: Extracting text from response =====")
@@ -225,28 +315,11 @@ class AmazonModel:
             logger.info(f"[DEBUG AMAZON] Cleaned text (length: {len(text)})")
             logger.info(f"[DEBUG AMAZON] Cleaned text first 500 chars: {text[:500]}")
             
-            logger.info("[DEBUG AMAZON] ===== STEP 10: Validating response with Pydantic =====")
-            logger.info(f"[DEBUG AMAZON] Validator class: {self.response_validator}")
-            
-            try:
-                logger.info("[DEBUG AMAZON] Calling model_validate_json()...")
-                valid_response = self.response_validator.model_validate_json(text)
-                logger.info("[DEBUG AMAZON] ✓ Validation successful")
-            except ValidationError as ve:
-                logger.error("[ERROR AMAZON] !!! Pydantic validation failed !!!")
-                logger.error(f"[ERROR AMAZON] Validation errors: {ve.errors()}")
-                logger.error(f"[ERROR AMAZON] Failed text: {text}")
-                raise
-            
-            logger.info(f"[DEBUG AMAZON] Valid response type: {type(valid_response)}")
-            result = valid_response.model_dump()
-            logger.info(f"[DEBUG AMAZON] Result keys: {list(result.keys()) if isinstance(result, dict) else 'N/A'}")
-            
             logger.info("[DEBUG AMAZON] ========================================")
-            logger.info("[DEBUG AMAZON] === _invoke_model COMPLETED SUCCESSFULLY ===")
+            logger.info("[DEBUG AMAZON] === _invoke_raw COMPLETED SUCCESSFULLY ===")
             logger.info("[DEBUG AMAZON] ========================================")
             
-            return result
+            return text
             
         except (BotoCoreError, ClientError, ValidationError, ValueError) as e:
             logger.error(f"[ERROR AMAZON] !!! Known error type caught: {type(e).__name__} !!!")
@@ -259,4 +332,158 @@ class AmazonModel:
             raise AmazonModelError(
                 message=f"Unexpected error: {str(e)}",
                 error_type="UnexpectedError"
-            )
\ No newline at end of file
+            )
+
+    def _invoke_stream(self, bedrock, model_id: str, request_body: dict) -> Optional[str]:
+        """ Streamed variant of STEP 5-9, the event stream is closed as soon as the parser rejects the output """
+        logger.info("[DEBUG AMAZON] >>> CALLING bedrock.invoke_model_with_response_stream() NOW <<<")
+        parser = IncrementalJSONValidator(self.response_validator, provider="amazon")
+        response = bedrock.invoke_model_with_response_stream(
+            modelId=model_id,
+            body=json.dumps(request_body)
+        )
+        stream = response['body']
+        try:
+            for event in stream:
+                if 'chunk' not in event:
+                    continue
+                payload = json.loads(event['chunk']['bytes'])
+                delta = payload.get('contentBlockDelta', {}).get('delta', {})
+                parser.feed(delta.get('text'))
+                if 'metadata' in payload:
+                    self.set_metadata(payload['metadata'].get('usage', {}))
+                elif 'amazon-bedrock-invocationMetrics' in payload and self.metadata is None:
+                    invocation = payload['amazon-bedrock-invocationMetrics']
+                    self.set_metadata({
+                        'inputTokens': invocation.get('inputTokenCount'),
+                        'outputTokens': invocation.get('outputTokenCount'),
+                        'totalTokens': (invocation.get('inputTokenCount') or 0) + (invocation.get('outputTokenCount') or 0),
+                        'cacheReadInputTokenCount': invocation.get('cacheReadInputTokenCount'),
+                        'cacheWriteInputTokenCount': invocation.get('cacheWriteInputTokenCount')
+                    })
+        finally:
+            stream.close()
+        self._record_prompt_cache()
+        logger.info(f"[DEBUG AMAZON] ✓ Streamed {parser.items} items from '{model_id}'")
+        return parser.finish()
+
+    # --- Converse API ---
+    def _tool_config(self, mode: str) -> Optional[dict]:
+        if mode == "text" or self.response_validator is None:
+            return None
+        return {
+            "tools": [{
+                "toolSpec": {
+                    "name": TOOL_NAME,
+                    "description": f"Record the generated {self.response_validator.__name__}.",
+                    "inputSchema": {"json": response_schema(self.response_validator)}
+                }
+            }],
+            "toolChoice": {"tool": {"name": TOOL_NAME}} if mode == "tool" else {"any": {}}
+        }
+
+    def _converse_request(self, model_id: str, mode: str) -> dict:
+        inference = {
+            "maxTokens": self.prompt_data.get("max_tokens", 20000),
+            "topP": self.prompt_data.get("top_p", 0.7),
+            "temperature": self.prompt_data.get("temperature")
+        }
+        request = {
+            "modelId": model_id,
+            "messages": [{"role": "user", "content": self._content_blocks()}],
+            "inferenceConfig": {name: value for name, value in inference.items() if value is not None}
+        }
+        tool_config = self._tool_config(mode)
+        if tool_config is not None:
+            request["toolConfig"] = tool_config
+        return request
+
+    def _converse(self, bedrock, model_id: str) -> Optional[str]:
+        """ Converse with the schema as a forced tool, stepping down the toolChoice modes the model rejects """
+        mode = _tool_modes.get(model_id) or TOOL_MODES[0]
+        while True:
+            request = self._converse_request(model_id, mode)
+            try:
+                if streaming_enabled():
+                    text = self._converse_stream(bedrock, model_id, request)
+                else:
+                    text = self._converse_once(bedrock, model_id, request)
+            except ClientError as ce:
+                fallback = _fallback_mode(ce, mode)
+                if fallback is None:
+                    raise
+                logger.warning(f"[BEDROCK] {model_id} rejected toolChoice {mode}, falling back to {fallback}: {ce}")
+                metrics.incr(f"llm.bedrock.tool_fallback.{mode}_to_{fallback}")
+                _tool_modes.set(model_id, fallback)
+                mode = fallback
+                continue
+            self.output_mode = f"amazon.converse.{mode}"
+            return text
+
+    def _converse_once(self, bedrock, model_id: str, request: dict) -> Optional[str]:
+        logger.info(f"[DEBUG AMAZON] >>> CALLING bedrock.converse() NOW <<< toolConfig: {'toolConfig' in request}")
+        response = bedrock.converse(**request)
+        self.set_metadata(response.get('usage', {}))
+        self._record_prompt_cache()
+        if response.get('stopReason') == 'max_tokens':
+            logger.warning(f"[BEDROCK] {model_id} stopped at maxTokens, the output is incomplete")
+        content = response['output']['message']['content']
+        for block in content:
+            if 'toolUse' in block:
+                return json.dumps(block['toolUse']['input'], ensure_ascii=False)
+        text = "".join(block.get('text', '') for block in content)
+        return _strip_fences(text) if text else None
+
+    def _converse_stream(self, bedrock, model_id: str, request: dict) -> Optional[str]:
+        """ Streamed Converse, tool input arrives as partial JSON strings and goes through the same parser """
+        logger.info("[DEBUG AMAZON] >>> CALLING bedrock.converse_stream() NOW <<<")
+        parser = IncrementalJSONValidator(self.response_validator, provider="amazon")
+        stream = bedrock.converse_stream(**request)['stream']
+        try:
+            for event in stream:
+                if 'contentBlockDelta' in event:
+                    delta = event['contentBlockDelta']['delta']
+                    parser.feed(delta['toolUse'].get('input') if 'toolUse' in delta else delta.get('text'))
+                elif 'metadata' in event:
+                    self.set_metadata(event['metadata'].get('usage', {}))
+        finally:
+            stream.close()
+        self._record_prompt_cache()
+        logger.info(f"[DEBUG AMAZON] ✓ Streamed {parser.items} items from '{model_id}'")
+        return parser.finish()
+
+    def validate(self, text: str) -> dict:
+        logger.info("[DEBUG AMAZON] ===== STEP 10: Validating response with Pydantic =====")
+        logger.info(f"[DEBUG AMAZON] Validator class: {self.response_validator}")
+        
+        try:
+            logger.info("[DEBUG AMAZON] Calling model_validate_json()...")
+            valid_response = self.response_validator.model_validate_json(text)
+            logger.info("[DEBUG AMAZON] ✓ Validation successful")
+        except ValidationError as ve:
+            logger.error("[ERROR AMAZON] !!! Pydantic validation failed !!!")
+            logger.error(f"[ERROR AMAZON] Validation errors: {ve.errors()}")
+            logger.error(f"[ERROR AMAZON] Failed text: {text}")
+            raise
+        
+        logger.info(f"[DEBUG AMAZON] Valid response type: {type(valid_response)}")
+        result = valid_response.model_dump()
+        logger.info(f"[DEBUG AMAZON] Result keys: {list(result.keys()) if isinstance(result, dict) else 'N/A'}")
+        return result
+
+    def _invoke_model(self) -> dict:
+        text = self._invoke_raw()
+        if text is None:
+            return None
+        return self.validate(text)
+
+    async def _invoke_raw_async(self) -> Optional[str]:
+        """ boto3 has no asyncio API, so the blocking Bedrock call runs on the runtime io pool """
+        logger.info("[DEBUG AMAZON] === _invoke_raw_async CALLED ===")
+        return await run_blocking(self._invoke_raw)
+
+    async def _invoke_model_async(self) -> dict:
+        text = await self._invoke_raw_async()
+        if text is None:
+            return None
+        return self.validate(text)
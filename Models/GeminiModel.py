@@ -1,13 +1,13 @@
 import os
 import json
-import boto3
-from botocore.exceptions import ClientError
+import threading
 from dotenv import load_dotenv
-from google import genai
-from google.genai import types
 from pydantic import BaseModel, ValidationError, ValidationError
 from typing import Optional
-from Validation.AssessmentResponseValidator import Assessment
+from Validation.Schemas import response_schema
+from Validation.StreamingParser import IncrementalJSONValidator, streaming_enabled
+from Config.AsyncRuntime import run_blocking
+from Models.PromptCache import cacheable_prefix, get_gemini_prefix_cache, stats as prompt_cache_stats
 
 import logging
 
@@ -16,14 +16,29 @@ logger.setLevel(logging.INFO)
 
 load_dotenv()
 
-bedrock = boto3.client("bedrock-runtime", region_name="us-east-1")
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+MODEL_NAME = "gemini-2.5-flash"
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """ Create the genai client on first use; the SDK import alone is a large share of cold start """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from google import genai
+                _client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+    return _client
 
 """
     Gemini Model 
 
 """
 class GeminiModel:
+    # label of the structured output mechanism, validation metrics are split by it
+    output_mode = "google.response_schema"
+
     def __init__(self, response_validator: Optional[BaseModel], prompt_data: Optional[dict] ):
         logger.info("[INFO] call stack init GeminiModel")
         self.prompt_data = prompt_data 
@@ -33,32 +48,151 @@ class GeminiModel:
     def set_metadata(self, metadata: Optional[dict]):
         self.response_metadata = metadata
     
-    def _invoke_model(self) -> dict:
-        try:
-            content = [item['content'] for item in self.prompt_data.get("messages")]
-            response = client.models.generate_content(
-                model="gemini-2.5-flash",
-                contents=content,
-                config = types.GenerateContentConfig(
-                    response_mime_type="application/json",
-                    response_schema=self.response_validator.model_json_schema(),
-                    temperature=self.prompt_data.get("temperature")
-                )
+    def _generate_kwargs(self, cached_content: Optional[str] = None) -> dict:
+        from google.genai import types
+        content = [item['content'] for item in self.prompt_data.get("messages")]
+        if cached_content:
+            # the static prefix already lives in the cached content, only send what follows it
+            prefix = self.prompt_data["cache_prefix"]
+            content = [text[len(prefix):] if text.startswith(prefix) else text for text in content]
+        return dict(
+            model=MODEL_NAME,
+            contents=content,
+            config = types.GenerateContentConfig(
+                response_mime_type="application/json",
+                response_schema=response_schema(self.response_validator),
+                temperature=self.prompt_data.get("temperature"),
+                cached_content=cached_content
             )
-            if not response:
-                return None
-            
-            logger.info(f"[INFO GOOGLE] Successfully invoked model with response type {type(response)}'.")
-            validated_data = self.response_validator.model_validate_json(response.text)
-            self.set_metadata(dict(response.usage_metadata))
+        )
+
+    def _cached_content(self, prefix: str) -> Optional[str]:
+        return get_gemini_prefix_cache().get(get_client(), MODEL_NAME, prefix, self.prompt_data.get("template"))
+
+    def _cache_expired(self, cached_content: Optional[str], error: Exception) -> bool:
+        """ Gemini dropped the cached content before our TTL did, forget it and resend the full prompt """
+        if cached_content is None or getattr(error, "code", None) != 404:
+            return False
+        logger.warning(f"[PROMPT CACHE] {cached_content} no longer exists, sending the full prompt")
+        get_gemini_prefix_cache().invalidate(MODEL_NAME, self.prompt_data["cache_prefix"])
+        return True
+
+    def _record_prompt_cache(self):
+        metadata = self.response_metadata or {}
+        prompt_cache_stats.record(self.prompt_data, "google", metadata.get("cached_content_token_count"))
+
+    def _parse_response(self, response) -> Optional[str]:
+        if not response:
+            return None
+        
+        logger.info(f"[INFO GOOGLE] Successfully invoked model with response type {type(response)}'.")
+        self.set_metadata(dict(response.usage_metadata))
+        return response.text
+
+    def validate(self, text: str) -> dict:
+        validated_data = self.response_validator.model_validate_json(text)
+        return validated_data.model_dump()
+
+    def _stream_chunk(self, parser: IncrementalJSONValidator, chunk):
+        if chunk.usage_metadata:
+            self.set_metadata(dict(chunk.usage_metadata))
+        parser.feed(chunk.text)
+
+    def _invoke_stream(self, cached_content: Optional[str] = None) -> Optional[str]:
+        """ Streamed variant of _invoke_raw, stops reading as soon as the parser rejects the output """
+        parser = IncrementalJSONValidator(self.response_validator, provider="google")
+        stream = get_client().models.generate_content_stream(**self._generate_kwargs(cached_content))
+        try:
+            for chunk in stream:
+                self._stream_chunk(parser, chunk)
+        finally:
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+        logger.info(f"[INFO GOOGLE] Streamed {parser.items} items")
+        return parser.finish()
+
+    async def _invoke_stream_async(self, cached_content: Optional[str] = None) -> Optional[str]:
+        parser = IncrementalJSONValidator(self.response_validator, provider="google")
+        stream = await get_client().aio.models.generate_content_stream(**self._generate_kwargs(cached_content))
+        try:
+            async for chunk in stream:
+                self._stream_chunk(parser, chunk)
+        finally:
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        logger.info(f"[INFO GOOGLE] Streamed {parser.items} items")
+        return parser.finish()
 
-            return validated_data.model_dump()
-        except (ValidationError, ClientError) as e:
+    def _generate(self, cached_content: Optional[str]) -> Optional[str]:
+        if streaming_enabled():
+            text = self._invoke_stream(cached_content)
+        else:
+            response = get_client().models.generate_content(**self._generate_kwargs(cached_content))
+            text = self._parse_response(response)
+        self._record_prompt_cache()
+        return text
+
+    async def _generate_async(self, cached_content: Optional[str]) -> Optional[str]:
+        if streaming_enabled():
+            text = await self._invoke_stream_async(cached_content)
+        else:
+            response = await get_client().aio.models.generate_content(**self._generate_kwargs(cached_content))
+            text = self._parse_response(response)
+        self._record_prompt_cache()
+        return text
+
+    def _invoke_raw(self) -> Optional[str]:
+        """ Call Gemini and return the response text, unvalidated """
+        try:
+            prefix = cacheable_prefix(self.prompt_data)
+            cached_content = self._cached_content(prefix) if prefix else None
+            try:
+                return self._generate(cached_content)
+            except Exception as e:
+                if not self._cache_expired(cached_content, e):
+                    raise
+                return self._generate(None)
+        except Exception as e:
             logger.info(f"[ERROR] Exception found:  {e}")
             raise
+
+    async def _invoke_raw_async(self) -> Optional[str]:
+        """ Same contract as _invoke_raw, using the SDK's native asyncio client """
+        try:
+            # the cache lookup may create the cached content, a blocking call done once per prefix
+            prefix = cacheable_prefix(self.prompt_data)
+            cached_content = await run_blocking(self._cached_content, prefix) if prefix else None
+            try:
+                return await self._generate_async(cached_content)
+            except Exception as e:
+                if not self._cache_expired(cached_content, e):
+                    raise
+                return await self._generate_async(None)
         except Exception as e:
             logger.info(f"[ERROR] Exception found:  {e}")
             raise
+
+    def _invoke_model(self) -> dict:
+        try:
+            text = self._invoke_raw()
+            if text is None:
+                return None
+            return self.validate(text)
+        except ValidationError as e:
+            logger.info(f"[ERROR] Exception found:  {e}")
+            raise
+
+    async def _invoke_model_async(self) -> dict:
+        try:
+            text = await self._invoke_raw_async()
+            if text is None:
+                return None
+            return self.validate(text)
+        except ValidationError as e:
+            logger.info(f"[ERROR] Exception found:  {e}")
+            raise
         
     """ 
         Parse the response metadata according to GeminiAPI
@@ -0,0 +1,196 @@
+import os
+import math
+import time
+import asyncio
+import threading
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Optional
+from Config.Metrics import metrics
+from Models.Resilience import ALTERNATE
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+"""
+    Hedged provider calls (LLM_HEDGING=true).
+
+    If a call has not produced a validated result after the HEDGE_PERCENTILE latency of
+    the last HEDGE_WINDOW successful calls of the same kind (provider, template and output
+    budget, see latency_key), a second request is sent to
+    the same provider or, with HEDGE_TARGET=alternate, to the other one. The first
+    attempt that returns a validated result wins and the other one is cancelled. Until
+    HEDGE_MIN_SAMPLES latencies are known no hedge is sent.
+
+    Attempts are callables returning (llm_model, result, usage); an exception or a None
+    result counts as a failed attempt.
+"""
+
+
+def hedging_enabled() -> bool:
+    return os.getenv("LLM_HEDGING", "false").lower() in ("1", "true", "yes")
+
+
+def hedge_prompt_data(prompt_data: dict) -> dict:
+    """ Prompt data for the hedge request, same provider unless HEDGE_TARGET=alternate """
+    model_type = (prompt_data.get("model") or "GOOGLE").upper()
+    if os.getenv("HEDGE_TARGET", "same").lower() == "alternate" and model_type in ALTERNATE:
+        return dict(prompt_data, model=ALTERNATE[model_type])
+    return prompt_data
+
+
+def latency_key(prompt_data: dict) -> str:
+    """ Latency window of a request, e.g. GOOGLE:Identity_questions:8k, max_tokens rounded up to a power of two """
+    max_tokens = int(prompt_data.get("max_tokens") or 0)
+    size = f"{2 ** max(0, math.ceil(math.log2(max_tokens / 1024)))}k" if max_tokens else "any"
+    return f"{(prompt_data.get('model') or 'GOOGLE').upper()}:{prompt_data.get('template') or 'default'}:{size}"
+
+
+def _succeeded(future) -> bool:
+    if future.cancelled() or future.exception() is not None:
+        return False
+    return future.result()[1] is not None
+
+
+class LatencyTracker:
+    """ Rolling window of successful call latencies per latency_key """
+    def __init__(self, window: int, min_samples: int):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, provider: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(provider, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, provider: str, percentile: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(provider, ()))
+        if len(samples) < self.min_samples:
+            return None
+        index = min(len(samples) - 1, int(round(percentile / 100.0 * (len(samples) - 1))))
+        return samples[index]
+
+
+class Hedger:
+    def __init__(self):
+        self.percentile = float(os.getenv("HEDGE_PERCENTILE", 95))
+        self.tracker = LatencyTracker(int(os.getenv("HEDGE_WINDOW", 200)), int(os.getenv("HEDGE_MIN_SAMPLES", 20)))
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(2, int(os.getenv("HEDGE_WORKERS", 64))),
+            thread_name_prefix="hedge"
+        )
+        logger.info(f"[HEDGE] hedging after p{self.percentile:g} latency, target {os.getenv('HEDGE_TARGET', 'same')}")
+
+    def threshold(self, provider: str) -> Optional[float]:
+        threshold = self.tracker.percentile(provider, self.percentile)
+        if threshold is not None:
+            metrics.gauge(f"llm.hedge.{provider}.threshold", round(threshold, 3))
+        return threshold
+
+    def _timed(self, provider: str, attempt: Callable) -> tuple:
+        started = time.monotonic()
+        result = attempt()
+        if result[1] is not None:
+            self.tracker.record(provider, time.monotonic() - started)
+        return result
+
+    async def _timed_async(self, provider: str, attempt: Callable) -> tuple:
+        started = time.monotonic()
+        result = await attempt()
+        if result[1] is not None:
+            self.tracker.record(provider, time.monotonic() - started)
+        return result
+
+    def _count_waste(self, future):
+        """ Tokens spent by the losing attempt once it finishes anyway """
+        if future.cancelled():
+            metrics.incr("llm.hedge.cancelled")
+            return
+        if future.exception() is None:
+            usage = future.result()[2] or {}
+            metrics.incr("llm.hedge.extra_tokens", int(usage.get("total_tokens") or 0))
+
+    def _fire(self, provider: str, hedge_provider: str, threshold: float):
+        metrics.incr("llm.hedge.fired")
+        logger.info(f"[HEDGE] {provider} call exceeded {threshold:.2f}s, sending hedge to {hedge_provider}")
+
+    def _settle(self, winner, hedge) -> tuple:
+        metrics.incr("llm.hedge.won_by_hedge" if winner is hedge else "llm.hedge.won_by_primary")
+        return winner.result()
+
+    def call(self, provider: str, primary: Callable, hedge_provider: str, hedge: Callable) -> tuple:
+        metrics.incr("llm.hedge.calls")
+        first = self._executor.submit(self._timed, provider, primary)
+        threshold = self.threshold(provider)
+        # not result(timeout=), on 3.11+ a TimeoutError raised by the provider would pass for the threshold
+        done, _ = wait([first], timeout=threshold)
+        if done:
+            return first.result()
+
+        self._fire(provider, hedge_provider, threshold)
+        second = self._executor.submit(self._timed, hedge_provider, hedge)
+        pending = {first, second}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = next((future for future in done if _succeeded(future)), None)
+            if winner is not None:
+                for loser in pending:
+                    # threads cannot be interrupted, a started loser runs to completion and is discarded
+                    loser.cancel()
+                    loser.add_done_callback(self._count_waste)
+                for loser in done - {winner}:
+                    self._count_waste(loser)
+                return self._settle(winner, second)
+            for future in done:
+                self._count_waste(future)
+        # both attempts failed, surface the primary's outcome
+        return first.result()
+
+    async def call_async(self, provider: str, primary: Callable, hedge_provider: str, hedge: Callable) -> tuple:
+        metrics.incr("llm.hedge.calls")
+        first = asyncio.ensure_future(self._timed_async(provider, primary))
+        second = None
+        try:
+            threshold = self.threshold(provider)
+            done, _ = await asyncio.wait({first}, timeout=threshold)
+            if done:
+                return first.result()
+
+            self._fire(provider, hedge_provider, threshold)
+            second = asyncio.ensure_future(self._timed_async(hedge_provider, hedge))
+            pending = {first, second}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in done if _succeeded(task)), None)
+                if winner is not None:
+                    for loser in pending:
+                        loser.cancel()
+                        loser.add_done_callback(self._count_waste)
+                    for loser in done - {winner}:
+                        self._count_waste(loser)
+                    return self._settle(winner, second)
+                for task in done:
+                    self._count_waste(task)
+            return first.result()
+        except asyncio.CancelledError:
+            # the caller was cancelled (Lambda deadline, shutdown), do not leave the attempts running
+            for task in (first, second):
+                if task is not None and not task.done():
+                    task.cancel()
+            metrics.incr("llm.hedge.caller_cancelled")
+            raise
+
+
+_hedger = None
+_hedger_lock = threading.Lock()
+
+def get_hedger() -> Hedger:
+    global _hedger
+    if _hedger is None:
+        with _hedger_lock:
+            if _hedger is None:
+                _hedger = Hedger()
+    return _hedger
@@ -0,0 +1,140 @@
+import os
+import hashlib
+import threading
+import logging
+from typing import Dict, Optional
+from Config.LRUCache import TTLCache
+from Config.Metrics import metrics
+from Models.RateLimiter import CHARS_PER_TOKEN
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+"""
+    Provider-side prompt prefix caching (PROMPT_PREFIX_CACHE=true).
+
+    Templates keep their instructions and example output in a static block ahead of the
+    request variables, and PromptBuilder sends the rendered static block along as
+    prompt_data["cache_prefix"]. Gemini gets an explicit cached content per prefix that is
+    created once and reused for PROMPT_CACHE_TTL seconds. Bedrock gets a cachePoint after
+    the prefix. Prefixes shorter than PROMPT_CACHE_MIN_TOKENS are sent as they are, because
+    both providers refuse to cache them.
+
+    Hits and savings are counted per template from the cached token counts the providers
+    report, which also covers Gemini's implicit caching of the same prefix.
+"""
+
+
+def prefix_caching_enabled() -> bool:
+    return os.getenv("PROMPT_PREFIX_CACHE", "false").lower() in ("1", "true", "yes")
+
+
+def _template(prompt_data: dict) -> str:
+    return prompt_data.get("template") or "unknown"
+
+
+def cacheable_prefix(prompt_data: Optional[dict]) -> Optional[str]:
+    """ The static prefix of this prompt when it is worth caching on the provider, else None """
+    if not prompt_data or not prefix_caching_enabled():
+        return None
+    prefix = prompt_data.get("cache_prefix")
+    if not prefix:
+        return None
+    if len(prefix) // CHARS_PER_TOKEN < int(os.getenv("PROMPT_CACHE_MIN_TOKENS", 1024)):
+        metrics.incr(f"prompt_cache.{_template(prompt_data)}.below_minimum")
+        return None
+    return prefix
+
+
+class PromptCacheStats:
+    """ Per template request/hit counters and the input tokens served from the provider cache """
+    def __init__(self):
+        self.read_price = float(os.getenv("PROMPT_CACHE_READ_PRICE", 0.25))
+        self._counts: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def record(self, prompt_data: Optional[dict], provider: str, cached_tokens: Optional[int], written_tokens: Optional[int] = None):
+        if not prompt_data or not prompt_data.get("cache_prefix"):
+            return
+        template = _template(prompt_data)
+        cached_tokens = int(cached_tokens or 0)
+        with self._lock:
+            counts = self._counts.setdefault(template, [0, 0])
+            counts[0] += 1
+            counts[1] += 1 if cached_tokens else 0
+            hit_rate = counts[1] / counts[0]
+        metrics.incr(f"prompt_cache.{template}.requests")
+        metrics.gauge(f"prompt_cache.{template}.hit_rate", round(hit_rate, 3))
+        if written_tokens:
+            metrics.incr(f"prompt_cache.{template}.written_tokens", int(written_tokens))
+        if cached_tokens:
+            metrics.incr(f"prompt_cache.{template}.hits")
+            metrics.incr(f"prompt_cache.{template}.{provider}.cached_tokens", cached_tokens)
+            # cached input is billed at PROMPT_CACHE_READ_PRICE of the normal input price
+            metrics.incr(f"prompt_cache.{template}.saved_tokens", int(cached_tokens * (1 - self.read_price)))
+
+
+class GeminiPrefixCache:
+    """ Names of the Gemini cached contents created by this process, one per (model, prefix) """
+    def __init__(self):
+        self.ttl = int(os.getenv("PROMPT_CACHE_TTL", 3600))
+        # forget a name a minute before Gemini expires it so a request never races the expiry
+        self._names = TTLCache(int(os.getenv("PROMPT_CACHE_MAX_PREFIXES", 64)), max(60, self.ttl - 60))
+        self._refused = TTLCache(256, self.ttl)
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model: str, prefix: str) -> str:
+        return hashlib.sha256(f"{model}\n{prefix}".encode("utf-8")).hexdigest()
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get(self, client, model: str, prefix: str, template: str) -> Optional[str]:
+        """ Cached content name for the prefix, created on first use; None when Gemini refuses it """
+        key = self.key(model, prefix)
+        name = self._names.get(key)
+        if name is not None or self._refused.get(key):
+            return name
+        with self._key_lock(key):
+            name = self._names.get(key)
+            if name is not None:
+                return name
+            from google.genai import types
+            try:
+                cached = client.caches.create(
+                    model=model,
+                    config=types.CreateCachedContentConfig(
+                        contents=[prefix],
+                        ttl=f"{self.ttl}s",
+                        display_name=f"{template}-{key[:12]}"
+                    )
+                )
+            except Exception as e:
+                logger.warning(f"[PROMPT CACHE] could not cache the {template} prefix on Gemini: {e}")
+                metrics.incr(f"prompt_cache.{template}.create_failed")
+                self._refused.set(key, True)
+                return None
+            logger.info(f"[PROMPT CACHE] created {cached.name} for the {template} prefix, ttl {self.ttl}s")
+            metrics.incr(f"prompt_cache.{template}.created")
+            self._names.set(key, cached.name)
+            return cached.name
+
+    def invalidate(self, model: str, prefix: str):
+        self._names.delete(self.key(model, prefix))
+
+
+stats = PromptCacheStats()
+
+_gemini_cache = None
+_gemini_cache_lock = threading.Lock()
+
+def get_gemini_prefix_cache() -> GeminiPrefixCache:
+    global _gemini_cache
+    if _gemini_cache is None:
+        with _gemini_cache_lock:
+            if _gemini_cache is None:
+                _gemini_cache = GeminiPrefixCache()
+    return _gemini_cache
@@ -39,15 +39,17 @@ class PromptBuilder:
             Returns:
                 Dict with 'messages', 'max_tokens', 'temperature', etc.
             """
-            # Render user prompt
-            user_prompt = self.registry.render(
+            # Render user prompt, static prefix first so providers can cache it
+            parts = self.registry.render_parts(
                 config.template_name,
                 **config.variables
             )
             
-            if not user_prompt:
+            if not parts or not "".join(parts):
                 logger.error(f"[ERROR]Failed to render template: {config.template_name}")
                 return None
+            cache_prefix, dynamic_prompt = parts
+            user_prompt = cache_prefix + dynamic_prompt
             
             # Build system prompt
             system_prompt = config.system_prompt
@@ -69,7 +71,9 @@ class PromptBuilder:
                 "messages": messages,
                 "max_tokens": config.max_tokens,
                 "temperature": config.temperature,
-                "model": config.model
+                "model": config.model,
+                "template": config.template_name,
+                "cache_prefix": cache_prefix or None
             }
         except Exception as e:
             logger.error(f"[ERROR Builder.py] Error on build func {e}")
@@ -1,6 +1,6 @@
 # prompts/registry.py
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 from jinja2 import Environment, FileSystemLoader, Template
 import logging
 
@@ -41,6 +41,12 @@ class PromptRegistry:
             logger.error(f"Failed to load template '{name}': {e}")
             return None
     
+    def preload(self) -> int:
+        """Compile every template up front, returns how many are loaded"""
+        for name in self.env.list_templates(extensions=["j2"]):
+            self.get_template(name[:-len(".j2")])
+        return len(self._templates)
+
     def render(self, template_name: str, **kwargs) -> Optional[str]:
         template = self.get_template(template_name)
         if not template:
@@ -54,5 +60,33 @@ class PromptRegistry:
             logger.error(f"Failed to render template '{template_name}': {e}")
             return None
 
+    def render_parts(self, template_name: str, **kwargs) -> Optional[Tuple[str, str]]:
+        """
+        Render a template as (static prefix, dynamic suffix).
+
+        Templates keep their instructions and example output in a `static` block that
+        does not use any variable, followed by a `dynamic` block with the request
+        variables, so the prefix is identical across requests and can be cached by the
+        provider. The two parts joined are exactly what render() returns; templates
+        without a `static` block have an empty prefix.
+        """
+        template = self.get_template(template_name)
+        if not template:
+            return None
+
+        try:
+            if "static" not in template.blocks:
+                return "", template.render(**kwargs)
+            context = template.new_context(kwargs)
+            prefix = "".join(template.blocks["static"](context))
+            rendered = template.render(**kwargs)
+            if not rendered.startswith(prefix):
+                logger.warning(f"Template '{template_name}' renders content before its static block, not caching it")
+                return "", rendered
+            return prefix, rendered[len(prefix):]
+        except Exception as e:
+            logger.error(f"Failed to render template '{template_name}': {e}")
+            return None
+
 # Singleton instance
 registry = PromptRegistry()
\ No newline at end of file
@@ -0,0 +1,224 @@
+import os
+import json
+import time
+import asyncio
+import threading
+import logging
+from typing import Any, Dict, Optional
+from Config.Metrics import metrics
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+"""
+    Request and token per minute limits in front of the model adapters.
+
+    RATE_LIMITS is a json object keyed by provider or provider:model, e.g.
+        {"GOOGLE": {"rpm": 1000, "tpm": 1000000},
+         "AMAZON:us.amazon.nova-pro-v1:0": {"rpm": 100, "tpm": 400000}}
+    The most specific key wins, providers without an entry are not limited.
+
+    A call reserves one request and (estimated input tokens + max_tokens) before it is
+    sent, and the unused tokens are refunded from the real usage afterwards. The input
+    estimate comes from the TokenEstimator when the prompt was sized. Buckets can go
+    into debt, so callers are queued in reservation order and sleep for exactly their share
+    instead of failing. RATE_LIMIT_BACKEND=postgres keeps the buckets in
+    stu_tracker.llm_rate_limit (Data/Migrations/002) so every worker shares the quota.
+"""
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(prompt_data: Dict[str, Any]) -> int:
+    input_tokens = prompt_data.get("estimated_input_tokens")
+    if input_tokens is None:
+        chars = sum(len(str(item.get("content", ""))) for item in prompt_data.get("messages") or [])
+        input_tokens = chars // CHARS_PER_TOKEN
+    return int(input_tokens) + int(prompt_data.get("max_tokens") or 0)
+
+
+class TokenBucket:
+    """ In-process bucket refilled continuously at capacity per minute """
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self, amount: float) -> float:
+        """ Debit the bucket and return how long the caller has to wait for its turn """
+        with self._lock:
+            self._refill()
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+    def refund(self, amount: float):
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class PostgresTokenBucket:
+    """ Same contract as TokenBucket, the balance lives in one row updated atomically, so no local lock is needed """
+    def __init__(self, key: str, per_minute: float, db):
+        self.key = key
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self._db = db
+        self._ensure()
+
+    def _ensure(self):
+        query = "INSERT INTO stu_tracker.llm_rate_limit (bucket_key, tokens, capacity, refill_per_sec, updated_at) " \
+        "VALUES (%s, %s, %s, %s, clock_timestamp()) ON CONFLICT (bucket_key) DO UPDATE " \
+        "SET capacity = EXCLUDED.capacity, refill_per_sec = EXCLUDED.refill_per_sec;"
+        self._db.execute(query, (self.key, self.capacity, self.capacity, self.rate), idempotent=True)
+
+    def reserve(self, amount: float) -> float:
+        query = "UPDATE stu_tracker.llm_rate_limit " \
+        "SET tokens = LEAST(capacity, tokens + EXTRACT(EPOCH FROM clock_timestamp() - updated_at) * refill_per_sec) - %s, " \
+        "updated_at = clock_timestamp() WHERE bucket_key = %s RETURNING tokens;"
+        # not idempotent: a retry after a lost connection could take the tokens twice
+        row = self._db.fetch_one(query, (amount, self.key))
+        if row is None:
+            # the row is gone (deleted, truncated, failover to a fresh database), start a full bucket again
+            logger.warning(f"[RATE LIMIT] bucket row {self.key} missing, recreating it")
+            metrics.incr("ratelimit.bucket_recreated")
+            self._ensure()
+            row = self._db.fetch_one(query, (amount, self.key))
+        if row is None:
+            raise RuntimeError(f"Rate limit bucket {self.key} has no row in stu_tracker.llm_rate_limit")
+        return max(0.0, -float(row["tokens"]) / self.rate)
+
+    def refund(self, amount: float):
+        query = "UPDATE stu_tracker.llm_rate_limit " \
+        "SET tokens = LEAST(capacity, tokens + EXTRACT(EPOCH FROM clock_timestamp() - updated_at) * refill_per_sec + %s), " \
+        "updated_at = clock_timestamp() WHERE bucket_key = %s;"
+        self._db.execute(query, (amount, self.key))
+
+
+class Reservation:
+    def __init__(self, limiter: Optional["ProviderLimiter"], tokens: int, wait: float):
+        self.limiter = limiter
+        self.tokens = tokens
+        self.wait = wait
+
+    def settle(self, usage: Optional[dict]):
+        """ Refund what the call did not use, a failed call without usage keeps its reservation """
+        if self.limiter is None or self.limiter.tpm is None or not usage:
+            return
+        unused = self.tokens - int(usage.get("total_tokens") or 0)
+        if unused > 0:
+            self.limiter.tpm.refund(unused)
+
+    async def settle_async(self, usage: Optional[dict]):
+        if isinstance(getattr(self.limiter, "tpm", None), PostgresTokenBucket):
+            from Config.AsyncRuntime import run_blocking
+            await run_blocking(self.settle, usage)
+        else:
+            self.settle(usage)
+
+
+class ProviderLimiter:
+    def __init__(self, key: str, rpm: Optional[float], tpm: Optional[float], bucket_factory):
+        self.key = key
+        self.rpm = bucket_factory(f"{key}:rpm", rpm) if rpm else None
+        self.tpm = bucket_factory(f"{key}:tpm", tpm) if tpm else None
+
+    def reserve(self, tokens: int) -> float:
+        wait = 0.0
+        if self.rpm is not None:
+            wait = max(wait, self.rpm.reserve(1))
+        if self.tpm is not None:
+            wait = max(wait, self.tpm.reserve(tokens))
+        return wait
+
+
+class RateLimiter:
+    def __init__(self, limits: Optional[Dict[str, dict]] = None, backend: Optional[str] = None):
+        self.limits = limits if limits is not None else json.loads(os.getenv("RATE_LIMITS") or "{}")
+        self.backend = (backend or os.getenv("RATE_LIMIT_BACKEND", "memory")).lower()
+        self._limiters: Dict[str, Optional[ProviderLimiter]] = {}
+        self._lock = threading.Lock()
+        self._db = None
+        self._waiting = 0
+        logger.info(f"[RATE LIMIT] backend: {self.backend}, limits: {self.limits}")
+
+    def _bucket(self, key: str, per_minute: float):
+        if self.backend == "postgres":
+            if self._db is None:
+                from Config.PostgreSQL import PostgresClient
+                self._db = PostgresClient()
+            return PostgresTokenBucket(key, per_minute, self._db)
+        return TokenBucket(per_minute)
+
+    def _limiter(self, model_id: str) -> Optional[ProviderLimiter]:
+        if model_id in self._limiters:
+            return self._limiters[model_id]
+        # built outside the lock, a postgres bucket upserts its row. Racing threads build their own,
+        # the upsert is idempotent and the first one published is kept
+        provider = model_id.split(":", 1)[0]
+        key = model_id if model_id in self.limits else provider
+        config = self.limits.get(key)
+        limiter = ProviderLimiter(key, config.get("rpm"), config.get("tpm"), self._bucket) if config else None
+        return self._limiters.setdefault(model_id, limiter)
+
+    def reserve(self, model_id: str, prompt_data: Dict[str, Any]) -> Reservation:
+        limiter = self._limiter(model_id)
+        if limiter is None:
+            return Reservation(None, 0, 0.0)
+        tokens = estimate_tokens(prompt_data)
+        if limiter.tpm is not None:
+            # a single request larger than the whole minute would never be admitted
+            tokens = min(tokens, int(limiter.tpm.capacity))
+        wait = limiter.reserve(tokens)
+        metrics.observe(f"ratelimit.{limiter.key}.wait", wait)
+        metrics.incr(f"ratelimit.{limiter.key}.reserved_tokens", tokens)
+        if wait > 0:
+            logger.info(f"[RATE LIMIT] {limiter.key} queued for {wait:.2f}s ({tokens} tokens reserved)")
+        return Reservation(limiter, tokens, wait)
+
+    def _track_waiting(self, delta: int):
+        with self._lock:
+            self._waiting += delta
+            metrics.gauge("ratelimit.waiting", self._waiting)
+
+    def acquire(self, model_id: str, prompt_data: Dict[str, Any]) -> Reservation:
+        reservation = self.reserve(model_id, prompt_data)
+        if reservation.wait > 0:
+            self._track_waiting(1)
+            try:
+                time.sleep(reservation.wait)
+            finally:
+                self._track_waiting(-1)
+        return reservation
+
+    async def acquire_async(self, model_id: str, prompt_data: Dict[str, Any]) -> Reservation:
+        if self.backend == "postgres":
+            from Config.AsyncRuntime import run_blocking
+            reservation = await run_blocking(self.reserve, model_id, prompt_data)
+        else:
+            reservation = self.reserve(model_id, prompt_data)
+        if reservation.wait > 0:
+            self._track_waiting(1)
+            try:
+                await asyncio.sleep(reservation.wait)
+            finally:
+                self._track_waiting(-1)
+        return reservation
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+def get_rate_limiter() -> RateLimiter:
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = RateLimiter()
+    return _limiter
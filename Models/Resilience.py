@@ -0,0 +1,231 @@
+import os
+import time
+import random
+import asyncio
+import threading
+import logging
+from typing import Callable, Dict, List, Optional
+from Config.Metrics import metrics
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+"""
+    Retries, circuit breakers and failover for the provider calls.
+
+    Retryable errors (throttling, 429, 5xx, timeouts, dropped connections) are retried
+    LLM_RETRY_ATTEMPTS times with full jitter exponential backoff. Each provider has a
+    circuit breaker that opens after CIRCUIT_FAILURE_THRESHOLD consecutive retryable
+    failures and lets one probe through after CIRCUIT_RESET_SECONDS. MODEL_FAILOVER=true
+    sends a call to the other provider when its own is exhausted or open.
+"""
+RETRYABLE_CODES = {
+    "ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException",
+    "ServiceUnavailable", "InternalServerException", "ModelNotReadyException",
+    "ModelTimeoutException", "RequestTimeout", "RequestTimeoutException",
+    "RESOURCE_EXHAUSTED", "UNAVAILABLE", "DEADLINE_EXCEEDED", "INTERNAL",
+}
+RETRYABLE_BOTOCORE = {
+    "EndpointConnectionError", "ConnectTimeoutError", "ReadTimeoutError",
+    "ConnectionClosedError", "ResponseStreamingError",
+}
+ALTERNATE = {"AMAZON": "GOOGLE", "GOOGLE": "AMAZON"}
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """ The provider's circuit is open, the call was not sent """
+    def __init__(self, provider: str, retry_in: float):
+        self.provider = provider
+        self.retry_in = retry_in
+        super().__init__(f"circuit for {provider} is open, retry in {retry_in:.1f}s")
+
+
+def _status_code(exc: Exception) -> Optional[int]:
+    response = getattr(exc, "response", None)
+    if isinstance(response, dict):
+        return response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    return code if isinstance(code, int) else None
+
+
+def _error_code(exc: Exception) -> Optional[str]:
+    response = getattr(exc, "response", None)
+    if isinstance(response, dict):
+        return response.get("Error", {}).get("Code")
+    return getattr(exc, "status", None)
+
+
+def is_retryable(exc: Exception) -> bool:
+    """ Classify provider errors: throttling and transient faults are retried, the rest are not """
+    original = getattr(exc, "original_error", None)
+    if original is not None:
+        return is_retryable(original)
+    if isinstance(exc, (TimeoutError, ConnectionError, asyncio.TimeoutError)):
+        return True
+    if type(exc).__name__ in RETRYABLE_BOTOCORE:
+        return True
+    if _error_code(exc) in RETRYABLE_CODES:
+        return True
+    status = _status_code(exc)
+    return status is not None and (status == 429 or status == 408 or status >= 500)
+
+
+def backoff_delay(attempt: int) -> float:
+    """ Full jitter: uniform between 0 and min(cap, base * 2^attempt) """
+    base = float(os.getenv("LLM_RETRY_BASE_SECONDS", 1))
+    cap = float(os.getenv("LLM_RETRY_MAX_SECONDS", 20))
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    def __init__(self, provider: str, failure_threshold: Optional[int] = None, reset_timeout: Optional[float] = None):
+        self.provider = provider
+        self.failure_threshold = failure_threshold or int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+        self.reset_timeout = reset_timeout or float(os.getenv("CIRCUIT_RESET_SECONDS", 60))
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self._publish()
+
+    def _publish(self):
+        metrics.gauge(f"circuit.{self.provider}.state", STATE_VALUE[self.state])
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            logger.warning(f"[CIRCUIT] {self.provider} {self.state} -> {state}")
+            self.state = state
+            metrics.incr(f"circuit.{self.provider}.{state}")
+            self._publish()
+
+    def retry_in(self) -> float:
+        """ Seconds until an open circuit lets a probe through, 0 when calls are allowed """
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self):
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    raise CircuitOpenError(self.provider, self.opened_at + self.reset_timeout - time.monotonic())
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probe_in_flight:
+                    raise CircuitOpenError(self.provider, self.reset_timeout)
+                self._probe_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probe_in_flight = False
+            self._set_state(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    def release(self):
+        """ The call ended without telling us anything about the provider's health """
+        with self._lock:
+            self._probe_in_flight = False
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(provider: str) -> CircuitBreaker:
+    with _breakers_lock:
+        if provider not in _breakers:
+            _breakers[provider] = CircuitBreaker(provider)
+        return _breakers[provider]
+
+
+def failover_enabled() -> bool:
+    return os.getenv("MODEL_FAILOVER", "false").lower() in ("1", "true", "yes")
+
+
+def provider_chain(model_type: str) -> List[str]:
+    """ Providers to try in order for one call """
+    alternate = ALTERNATE.get(model_type)
+    if failover_enabled() and alternate:
+        return [model_type, alternate]
+    return [model_type]
+
+
+def polling_pause() -> float:
+    """ Seconds the SQS consumer should wait because every provider it could use is open """
+    primary = (os.getenv("MODEL_TYPE") or "GOOGLE").upper()
+    waits = [get_breaker(provider).retry_in() for provider in provider_chain(primary)]
+    return min(waits) if waits else 0.0
+
+
+def _attempts() -> int:
+    return max(1, int(os.getenv("LLM_RETRY_ATTEMPTS", 3)))
+
+
+def _on_error(provider: str, breaker: CircuitBreaker, exc: Exception, attempt: int) -> Optional[float]:
+    """ Returns the backoff before the next attempt, None when the error should propagate """
+    if not is_retryable(exc):
+        breaker.release()
+        return None
+    breaker.record_failure()
+    metrics.incr(f"llm.retry.{provider}.retryable_errors")
+    if attempt + 1 >= _attempts() or breaker.state == OPEN:
+        return None
+    delay = backoff_delay(attempt)
+    logger.warning(f"[RETRY] {provider} attempt {attempt + 1} failed ({type(exc).__name__}: {exc}), retrying in {delay:.2f}s")
+    metrics.incr(f"llm.retry.{provider}.retries")
+    return delay
+
+
+def call_with_retry(provider: str, fn: Callable):
+    breaker = get_breaker(provider)
+    attempt = 0
+    while True:
+        breaker.allow()
+        try:
+            result = fn()
+        except Exception as e:
+            delay = _on_error(provider, breaker, e, attempt)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            attempt += 1
+            continue
+        breaker.record_success()
+        return result
+
+
+async def call_with_retry_async(provider: str, fn: Callable):
+    breaker = get_breaker(provider)
+    attempt = 0
+    while True:
+        breaker.allow()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception as e:
+            delay = _on_error(provider, breaker, e, attempt)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        breaker.record_success()
+        return result
+
+
+def should_fail_over(exc: Exception) -> bool:
+    return isinstance(exc, CircuitOpenError) or is_retryable(exc)
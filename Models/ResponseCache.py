@@ -0,0 +1,263 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import logging
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from Config.LRUCache import TTLCache
+from Config.Metrics import metrics
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+"""
+    Response cache for LLM generations.
+
+    Keys are a sha256 over the rendered messages and every model parameter that
+    changes the output. Lookups go to an in-memory LRU first and then to an
+    optional persistent tier (RESPONSE_CACHE=disk|postgres). Identical requests
+    that are in flight at the same time share one provider call (single flight).
+
+    RESPONSE_CACHE=off disables it, the default is memory only.
+"""
+CACHED_USAGE = {'input_tokens': 0, 'output_tokens': 0, 'total_tokens': 0}
+
+
+def resolved_model_id(prompt_data: Dict[str, Any]) -> str:
+    """ Provider model behind the MODEL_TYPE selector, part of the cache key """
+    model_type = (prompt_data.get("model") or "GOOGLE").upper()
+    if model_type == "AMAZON":
+        return f"AMAZON:{os.getenv('MODEL_ID')}"
+    return f"{model_type}:gemini-2.5-flash"
+
+
+def cache_key(prompt_data: Dict[str, Any], validator=None) -> str:
+    payload = {
+        "messages": prompt_data.get("messages"),
+        "model": resolved_model_id(prompt_data),
+        "temperature": prompt_data.get("temperature"),
+        "top_p": prompt_data.get("top_p"),
+        "max_tokens": prompt_data.get("max_tokens"),
+        "validator": getattr(validator, "__name__", None),
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class DiskCacheTier:
+    """
+        One json file per key, expired by mtime, oldest files evicted past max_bytes.
+        The total size is tracked as files are written, the directory is only scanned
+        when it passes max_bytes or every EVICT_EVERY writes to drop expired files.
+    """
+    EVICT_EVERY = 100
+    # evict down to this share of max_bytes so a full cache is not rescanned on every write
+    LOW_WATER = 0.9
+
+    def __init__(self, directory: str, ttl_seconds: float, max_bytes: int):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._bytes = None  # unknown until the first scan
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Tuple[dict, dict]]:
+        path = self._path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self.ttl_seconds:
+                path.unlink(missing_ok=True)
+                return None
+            entry = json.loads(path.read_text())
+            return entry["result"], entry["usage"]
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"[RESPONSE CACHE] unreadable disk entry {key}: {e}")
+            return None
+
+    def put(self, key: str, result: dict, usage: dict):
+        path = self._path(key)
+        data = json.dumps({"result": result, "usage": usage}, default=str).encode("utf-8")
+        # a unique temp file, concurrent puts of the same key must not write into each other's file
+        tmp = tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False)
+        try:
+            with tmp:
+                tmp.write(data)
+            try:
+                replaced = path.stat().st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp.name, path)
+        except BaseException:
+            Path(tmp.name).unlink(missing_ok=True)
+            raise
+        with self._lock:
+            self._writes += 1
+            if self._bytes is not None:
+                self._bytes += len(data) - replaced
+            evict = self._bytes is None or self._bytes > self.max_bytes or self._writes % self.EVICT_EVERY == 0
+        if evict:
+            self._evict()
+
+    def _evict(self):
+        """ Drop expired files, then the oldest ones down to LOW_WATER, and resync the tracked size """
+        with self._lock:
+            files = []
+            total = 0
+            now = time.time()
+            for path in self.directory.glob("*.json"):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                if now - stat.st_mtime > self.ttl_seconds:
+                    path.unlink(missing_ok=True)
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+            if total > self.max_bytes:
+                for _, size, path in sorted(files):
+                    if total <= self.max_bytes * self.LOW_WATER:
+                        break
+                    path.unlink(missing_ok=True)
+                    total -= size
+                    metrics.incr("response_cache.disk.evictions")
+            self._bytes = total
+
+
+class PostgresCacheTier:
+    """ Shared across workers, see Data/Migrations/001_llm_response_cache.sql """
+    def __init__(self, ttl_seconds: float, max_rows: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_rows = max_rows
+        self._db = None
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _get_db(self):
+        if self._db is None:
+            from Config.PostgreSQL import PostgresClient
+            self._db = PostgresClient()
+        return self._db
+
+    def get(self, key: str) -> Optional[Tuple[dict, dict]]:
+        query = "SELECT result, usage FROM stu_tracker.llm_response_cache " \
+        "WHERE cache_key = %s AND created_at > now() - make_interval(secs => %s);"
+        row = self._get_db().fetch_one(query, (key, self.ttl_seconds), idempotent=True)
+        if not row:
+            return None
+        return row["result"], row["usage"]
+
+    def put(self, key: str, result: dict, usage: dict):
+        from psycopg2.extras import Json
+        query = "INSERT INTO stu_tracker.llm_response_cache (cache_key, result, usage, created_at) " \
+        "VALUES (%s, %s, %s, now()) ON CONFLICT (cache_key) DO UPDATE " \
+        "SET result = EXCLUDED.result, usage = EXCLUDED.usage, created_at = EXCLUDED.created_at;"
+        self._get_db().execute_res(query, (key, Json(result), Json(usage)), idempotent=True)
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % 100 == 0
+        if evict:
+            self._evict()
+
+    def _evict(self):
+        expired = "DELETE FROM stu_tracker.llm_response_cache WHERE created_at < now() - make_interval(secs => %s);"
+        oversize = "DELETE FROM stu_tracker.llm_response_cache WHERE cache_key IN (" \
+        "SELECT cache_key FROM stu_tracker.llm_response_cache ORDER BY created_at DESC OFFSET %s);"
+        db = self._get_db()
+        removed = db.execute_res(expired, (self.ttl_seconds,), idempotent=True) + db.execute_res(oversize, (self.max_rows,), idempotent=True)
+        metrics.incr("response_cache.postgres.evictions", removed or 0)
+
+
+class ResponseCache:
+    def __init__(self, backend: Optional[str] = None):
+        self.backend = (backend or os.getenv("RESPONSE_CACHE", "memory")).lower()
+        self.enabled = self.backend != "off"
+        ttl = float(os.getenv("RESPONSE_CACHE_TTL", 24 * 3600))
+        self.memory = TTLCache(int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 512)), ttl)
+        self.persistent = None
+        if self.backend == "disk":
+            self.persistent = DiskCacheTier(
+                os.getenv("RESPONSE_CACHE_DIR", "/tmp/llm_response_cache"),
+                ttl,
+                int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+            )
+        elif self.backend == "postgres":
+            self.persistent = PostgresCacheTier(ttl, int(os.getenv("RESPONSE_CACHE_MAX_ROWS", 10000)))
+        self._flights: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        logger.info(f"[RESPONSE CACHE] backend: {self.backend}")
+
+    def get(self, key: str) -> Optional[Tuple[dict, dict]]:
+        if not self.enabled:
+            return None
+        entry = self.memory.get(key)
+        if entry is not None:
+            metrics.incr("response_cache.hit.memory")
+            return entry
+        if self.persistent is not None:
+            try:
+                entry = self.persistent.get(key)
+            except Exception as e:
+                logger.warning(f"[RESPONSE CACHE] persistent lookup failed: {e}")
+                entry = None
+            if entry is not None:
+                metrics.incr(f"response_cache.hit.{self.backend}")
+                self.memory.set(key, entry)
+                return entry
+        metrics.incr("response_cache.miss")
+        return None
+
+    def put(self, key: str, result: dict, usage: dict):
+        if not self.enabled:
+            return
+        self.memory.set(key, (result, usage))
+        if self.persistent is not None:
+            try:
+                self.persistent.put(key, result, usage)
+            except Exception as e:
+                logger.warning(f"[RESPONSE CACHE] persistent write failed: {e}")
+
+    def begin(self, key: str) -> Tuple[bool, Future]:
+        """
+            Join or start the flight for a key. The leader (True) must call finish(),
+            followers wait on the future, which resolves to (result, usage) or None.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                metrics.incr("response_cache.coalesced")
+                return False, flight
+            flight = Future()
+            self._flights[key] = flight
+            return True, flight
+
+    def finish(self, key: str, result: Optional[dict] = None, usage: Optional[dict] = None):
+        """ Leader side: store a successful result and release the followers """
+        if result is not None:
+            self.put(key, result, usage)
+        with self._lock:
+            flight = self._flights.pop(key, None)
+        if flight is not None and not flight.done():
+            flight.set_result((result, usage) if result is not None else None)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_response_cache() -> ResponseCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
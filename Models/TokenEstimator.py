@@ -0,0 +1,206 @@
+import os
+import re
+import json
+import math
+import time
+import threading
+import logging
+from typing import Dict, Iterable, Optional, Tuple
+from Config.Metrics import metrics
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+"""
+    Pre-flight token estimation and adaptive max_tokens (ADAPTIVE_MAX_TOKENS, on by default).
+
+    The rendered prompt is counted locally. The expected output is predicted per template
+    from the number of questions requested, with a linear model fitted on the
+    input_tokens/output_tokens of finished tasks and refreshed in the background every
+    TOKEN_MODEL_REFRESH_SECONDS. The job's max_tokens becomes the prediction plus the 95th
+    percentile of the fit's residuals plus TOKEN_MARGIN, and never more than what the
+    processor asked for. Jobs whose prompt and output cannot fit the provider's context
+    window (MODEL_CONTEXT_TOKENS) raise ContextOverflowError before any provider call.
+"""
+# history each template's output model is fitted on, other templates keep their configured max_tokens
+TEMPLATE_HISTORY = {
+    "Identity_questions": "questions",
+    "Identity_question_given_materials": "questions",
+    "Identity_materials": "materials",
+}
+# (base tokens, tokens per question) used until enough history is available
+DEFAULT_MODELS = {
+    "questions": (300.0, 350.0),
+    "materials": (5000.0, 0.0),
+}
+CONTEXT_WINDOWS = {"GOOGLE": 1048576, "AMAZON": 300000}
+MIN_MAX_TOKENS = 1024
+
+_PIECES = re.compile(r"[^\W\d_]+|\d|[^\w\s]|_|\n[ \t]*")
+
+
+def count_tokens(text: Optional[str]) -> int:
+    """ Local approximation of a BPE tokenizer: words split every 8 letters, digits, punctuation and indented line breaks alone """
+    if not text:
+        return 0
+    return sum(1 + len(piece) // 8 if piece[0].isalpha() else 1 for piece in _PIECES.findall(text))
+
+
+def count_prompt_tokens(prompt_data: dict) -> int:
+    return sum(count_tokens(str(item.get("content", ""))) for item in prompt_data.get("messages") or [])
+
+
+def adaptive_enabled() -> bool:
+    return os.getenv("ADAPTIVE_MAX_TOKENS", "true").lower() in ("1", "true", "yes")
+
+
+class ContextOverflowError(ValueError):
+    """ The prompt and its expected output do not fit the provider's context window """
+    def __init__(self, template: str, input_tokens: int, output_tokens: int, window: int):
+        self.template = template
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.window = window
+        super().__init__(f"{template} needs ~{input_tokens} input + {output_tokens} output tokens, context window is {window}")
+
+
+class OutputSizeModel:
+    """ output_tokens ~ base + per_item * items, spread is the 95th percentile of the residuals """
+    def __init__(self, base: float, per_item: float, spread: float = 0.0, samples: int = 0):
+        self.base = base
+        self.per_item = per_item
+        self.spread = spread
+        self.samples = samples
+
+    def predict(self, items: int) -> float:
+        return self.base + self.per_item * max(0, items)
+
+    def upper(self, items: int) -> float:
+        return self.predict(items) + self.spread
+
+    @classmethod
+    def fit(cls, rows: Iterable[Tuple[int, int]]) -> Optional["OutputSizeModel"]:
+        rows = [(float(items or 0), float(output)) for items, output in rows if output]
+        if not rows:
+            return None
+        n = len(rows)
+        mean_x = sum(x for x, _ in rows) / n
+        mean_y = sum(y for _, y in rows) / n
+        var_x = sum((x - mean_x) ** 2 for x, _ in rows)
+        per_item = sum((x - mean_x) * (y - mean_y) for x, y in rows) / var_x if var_x else 0.0
+        per_item = max(0.0, per_item)
+        base = max(0.0, mean_y - per_item * mean_x)
+        residuals = sorted(y - (base + per_item * x) for x, y in rows)
+        spread = max(0.0, residuals[min(n - 1, int(math.ceil(0.95 * n)) - 1)])
+        return cls(base, per_item, spread, n)
+
+    def __repr__(self):
+        return f"OutputSizeModel(base={self.base:.0f}, per_item={self.per_item:.1f}, spread={self.spread:.0f}, samples={self.samples})"
+
+
+class TokenEstimator:
+    def __init__(self, repository=None):
+        self.margin = float(os.getenv("TOKEN_MARGIN", 0.2))
+        self.min_samples = int(os.getenv("TOKEN_MODEL_MIN_SAMPLES", 30))
+        self.refresh_seconds = float(os.getenv("TOKEN_MODEL_REFRESH_SECONDS", 3600))
+        self.history_rows = int(os.getenv("TOKEN_MODEL_HISTORY_ROWS", 5000))
+        self.windows = dict(CONTEXT_WINDOWS, **json.loads(os.getenv("MODEL_CONTEXT_TOKENS") or "{}"))
+        self.models: Dict[str, OutputSizeModel] = {
+            history: OutputSizeModel(*default) for history, default in DEFAULT_MODELS.items()
+        }
+        self._repository = repository
+        self._fitted_at = None
+        self._fitting = False
+        self._lock = threading.Lock()
+
+    # --- fitting ---
+    def _history_enabled(self) -> bool:
+        return os.getenv("TOKEN_MODEL_HISTORY", "true").lower() in ("1", "true", "yes")
+
+    def _get_repository(self):
+        if self._repository is None:
+            from Config.PostgreSQL import PostgresClient
+            from Data.Repositories.BusinessRepository import BusinessRepository
+            self._repository = BusinessRepository(PostgresClient())
+        return self._repository
+
+    def refit(self):
+        """ Fit every output model on the finished tasks, keeps the previous model when history is short """
+        try:
+            repository = self._get_repository()
+            history = {
+                "questions": repository.get_questions_token_history((self.history_rows,)),
+                "materials": repository.get_materials_token_history((self.history_rows,)),
+            }
+            for name, rows in history.items():
+                model = OutputSizeModel.fit((row["item_count"], row["output_tokens"]) for row in rows or [])
+                if model is None or model.samples < self.min_samples:
+                    logger.info(f"[TOKENS] {name}: {model.samples if model else 0} samples, keeping {self.models[name]}")
+                    continue
+                self.models[name] = model
+                metrics.gauge(f"tokens.model.{name}.per_item", round(model.per_item, 1))
+                metrics.gauge(f"tokens.model.{name}.spread", round(model.spread))
+                logger.info(f"[TOKENS] fitted {name}: {model}")
+        except Exception as e:
+            logger.warning(f"[TOKENS] could not fit output models from history: {e}")
+        finally:
+            with self._lock:
+                self._fitted_at = time.monotonic()
+                self._fitting = False
+
+    def _maybe_refit(self):
+        """ Refits run on a background thread, jobs keep using the current models meanwhile """
+        if not self._history_enabled():
+            return
+        with self._lock:
+            stale = self._fitted_at is None or time.monotonic() - self._fitted_at > self.refresh_seconds
+            if not stale or self._fitting:
+                return
+            self._fitting = True
+        threading.Thread(target=self.refit, name="token-model-fit", daemon=True).start()
+
+    # --- sizing ---
+    def max_output_tokens(self, template: str, items: int, ceiling: Optional[int]) -> Optional[int]:
+        history = TEMPLATE_HISTORY.get(template)
+        if history is None:
+            return ceiling
+        self._maybe_refit()
+        estimate = math.ceil(self.models[history].upper(items) * (1 + self.margin))
+        estimate = max(MIN_MAX_TOKENS, estimate)
+        return min(ceiling, estimate) if ceiling else estimate
+
+    def size(self, prompt_config, prompt_data: dict) -> dict:
+        """ Sets max_tokens on the config and the prompt data, raises ContextOverflowError when it cannot fit """
+        template = prompt_config.template_name
+        input_tokens = count_prompt_tokens(prompt_data)
+        prompt_data["estimated_input_tokens"] = input_tokens
+        if adaptive_enabled():
+            items = int(prompt_config.variables.get("question_count") or 0)
+            max_tokens = self.max_output_tokens(template, items, prompt_config.max_tokens)
+            if max_tokens != prompt_config.max_tokens:
+                logger.info(f"[TOKENS] {template} ({items} questions): max_tokens {prompt_config.max_tokens} -> {max_tokens}")
+            prompt_config.max_tokens = max_tokens
+            prompt_data["max_tokens"] = max_tokens
+        metrics.observe(f"tokens.{template}.estimated_input", input_tokens)
+        if prompt_data.get("max_tokens"):
+            metrics.observe(f"tokens.{template}.max_tokens", prompt_data["max_tokens"])
+
+        provider = (prompt_data.get("model") or "GOOGLE").upper()
+        window = int(self.windows.get(provider) or 0)
+        needed = math.ceil(input_tokens * (1 + self.margin)) + int(prompt_data.get("max_tokens") or 0)
+        if window and needed > window:
+            metrics.incr(f"tokens.{template}.rejected")
+            raise ContextOverflowError(template, input_tokens, int(prompt_data.get("max_tokens") or 0), window)
+        return prompt_data
+
+
+_estimator = None
+_estimator_lock = threading.Lock()
+
+def get_token_estimator() -> TokenEstimator:
+    global _estimator
+    if _estimator is None:
+        with _estimator_lock:
+            if _estimator is None:
+                _estimator = TokenEstimator()
+    return _estimator
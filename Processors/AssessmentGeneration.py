@@ -1,11 +1,14 @@
-
 import os
+import re
+import math
+from difflib import SequenceMatcher
 from typing import Optional
 import logging
-from Models.Prompts.Builder import PromptBuilder, PromptConfig
-from Models.GeminiModel import GeminiModel
-from Models.AmazonModel import AmazonModel
+from Models.Prompts.Builder import PromptConfig
+from Processors.Pipeline import GenerationProcessor
 from Validation.AssessmentResponseValidator import Assessment
+from Validation.CompactSchema import compact_enabled
+from Config.Metrics import metrics
 from psycopg2.extras import Json
 from typing import Dict, Any, Optional, List
 
@@ -13,123 +16,242 @@ from typing import Dict, Any, Optional, List
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-    
-# Test they exist
-logger.info(f"[INFO] PromptBuilder: {PromptBuilder}")
-logger.info(f"[INFO] PromptConfig: {PromptConfig}")
+MAX_TOKENS = 20000
+
+
+def split_evenly(total: int, parts: int) -> List[int]:
+    """ 23 into 3 -> [8, 8, 7] """
+    base, extra = divmod(total, parts)
+    return [base + (1 if index < extra else 0) for index in range(parts)]
+
+
+def split_points(max_points, counts: List[int]) -> List[float]:
+    """ Each chunk's share of max_points, whole points when max_points is whole """
+    total = sum(counts)
+    if float(max_points).is_integer():
+        shares = [int(max_points) * count // total for count in counts]
+        for index in range(int(max_points) - sum(shares)):
+            shares[index % len(shares)] += 1
+        return shares
+    shares = [round(float(max_points) * count / total, 2) for count in counts]
+    # rounding residue goes to the last chunk so the shares still add up to max_points
+    shares[-1] = round(shares[-1] + float(max_points) - sum(shares), 2)
+    return shares
+
+
+def rebalance_points(questions: List[dict], max_points) -> None:
+    """ Scale the points so they add up to max_points again after merging and dedupe """
+    current = sum(float(question.get("points") or 0) for question in questions)
+    if not questions or not max_points or current <= 0:
+        return
+    scale = float(max_points) / current
+    for question in questions:
+        question["points"] = round(float(question.get("points") or 0) * scale, 2)
+    # rounding residue goes to the last question
+    questions[-1]["points"] = round(questions[-1]["points"] + float(max_points) - sum(q["points"] for q in questions), 2)
+
 
-class AssessmentGeneration:
-    def __init__(self, organization_id: int, generate_assessment: Optional[dict],  business_repository: Optional[any]):
-        logger.info("[INFO] call stack init AssessmentGeneration")
-        self.organization_id = organization_id
-        self.business_repository = business_repository
+def _normalize(text: Optional[str]) -> str:
+    return " ".join(re.sub(r"[^a-z0-9 ]", " ", (text or "").lower()).split())
+
+
+def _similar(left: str, right: str, threshold: float) -> bool:
+    matcher = SequenceMatcher(None, left, right)
+    return matcher.quick_ratio() >= threshold and matcher.ratio() >= threshold
+
+
+class AssessmentGeneration(GenerationProcessor):
+    template_name = "Identity_questions"
+    validator_class = Assessment
+
+    def __init__(self, organization_id: int, generate_assessment: Optional[dict],  business_repository: Optional[any], async_repository: Optional[any] = None):
+        logger.info(f"[INFO] call stack init {type(self).__name__}")
+        super().__init__(organization_id, business_repository, async_repository)
         self.generate_assessment = generate_assessment
-        self.prompt_builder = PromptBuilder()
-        self.validator_class = Assessment
-    
 
-    """ To do: Log the LLM usage to stu_tracker.LLM_usage for both generation types """        
+
+    """ To do: Log the LLM usage to stu_tracker.LLM_usage for both generation types """
     def process_question_generation(self) ->bool:
         """ Main caller, returns true boolean if succeded."""
         try:
-            district = self.business_repository.get_district_by_id((self.organization_id, self.generate_assessment.get("district_id")))
-            if district is None:
-                logger.info(f"[INFO] unable to get get_district_by_id")
-                return False
-            subjects = self.business_repository.get_subjects_by_id((self.organization_id, self.generate_assessment.get("district_id")))
-            if subjects is None:
-                logger.info(f"[INFO] unable to get get_district_by_id")
-                return False
+            return self.run()
+        except Exception as e:
+            logger.error(f"[ERROR] Questions generation {e}")
+            return False
+
+    async def process_question_generation_async(self) -> bool:
+        """ Asyncio execution mode, same stages awaiting the repository and the provider """
+        try:
+            return await self.run_async()
+        except Exception as e:
+            logger.error(f"[ERROR] Questions generation (async) {e}")
+            return False
 
+    def _context_params(self) -> tuple:
+        return (self.organization_id, self.generate_assessment.get("district_id"))
+
+    def _check_context(self, district: Optional[dict], subjects: Optional[dict]) -> Optional[dict]:
+        if district is None:
+            logger.info(f"[INFO] unable to get get_district_by_id")
+            return None
+        if subjects is None:
+            logger.info(f"[INFO] unable to get get_subjects_by_id")
+            return None
+        logger.info(f"[INFO] district data:  {district}")
+        logger.info(f"[INFO] subjects data:  {subjects}")
+        return {"district": district, "subjects": subjects}
+
+    def _fetch_context(self) -> Optional[dict]:
+        district = self.business_repository.get_district_by_id(self._context_params())
+        subjects = self.business_repository.get_subjects_by_id(self._context_params()) if district else None
+        return self._check_context(district, subjects)
+
+    async def _fetch_context_async(self) -> Optional[dict]:
+        district = await self.async_repository.get_district_by_id(self._context_params())
+        subjects = await self.async_repository.get_subjects_by_id(self._context_params()) if district else None
+        return self._check_context(district, subjects)
+
+    def _prompt_variables(self, context: dict) -> dict:
+        return {
+            "grade_level": self.generate_assessment.get("grade"),
+            "difficulty": self.generate_assessment.get("difficulty"),
+            "question_count": self.generate_assessment.get("question_count"),
+            "max_points": self.generate_assessment.get("max_points"),
+            "topic": context["subjects"]['title'],
+            "district": context["district"]['name'],
+            "custom_instructions": self.generate_assessment.get("description"),
+            "compact_schema": compact_enabled()
+        }
+
+    def _build_prompt_config(self, context: dict) -> Optional[PromptConfig]:
+        try:
+            prompt_config = PromptConfig(
+                model=os.getenv("MODEL_TYPE"),
+                template_name=self.template_name,
+                variables=self._prompt_variables(context),
+                temperature=0.6,
+                max_tokens=MAX_TOKENS
+            )
+            logger.info(f"[INFO] Created prompt_config for {self.template_name}")
+            return prompt_config
+        except Exception as e:
+            logger.error(f"[ERROR] Failed to create PromptConfig: {e}")
+            return None
 
-            logger.info(f"[INFO] district data:  {district}")
-            logger.info(f"[INFO] subjects data:  {subjects}")
-            try:
-                prompt_config = PromptConfig(
+    def _build_prompt_chunks(self, context: dict, outline: Optional[dict] = None) -> Optional[List[PromptConfig]]:
+        """ Large assessments are requested ASSESSMENT_CHUNK_SIZE questions at a time, in parallel """
+        question_count = int(self.generate_assessment.get("question_count") or 0)
+        chunk_size = max(1, int(os.getenv("ASSESSMENT_CHUNK_SIZE", 10)))
+        if question_count <= chunk_size:
+            return None
+        counts = split_evenly(question_count, math.ceil(question_count / chunk_size))
+        max_points = self.generate_assessment.get("max_points")
+        points = split_points(max_points, counts) if max_points else [None] * len(counts)
+        try:
+            configs = []
+            start = 1
+            for index, (count, share) in enumerate(zip(counts, points)):
+                variables = self._prompt_variables(context)
+                variables.update({
+                    "question_count": count,
+                    "max_points": share,
+                    "chunk_index": index + 1,
+                    "chunk_count": len(counts),
+                    "first_number": start,
+                    "last_number": start + count - 1,
+                    "total_question_count": question_count
+                })
+                configs.append(PromptConfig(
                     model=os.getenv("MODEL_TYPE"),
-                    template_name=f"Identity_questions",
-                    variables={
-                        "grade_level": self.generate_assessment.get("grade"),
-                        "difficulty": self.generate_assessment.get("difficulty"),
-                        "question_count": self.generate_assessment.get("question_count"),
-                        "max_points": self.generate_assessment.get("max_points"),
-                        "topic": subjects['title'],
-                        "district": district['name'],
-                        "custom_instructions": self.generate_assessment.get("description")
-                        },
-                        temperature=0.6,
-                        max_tokens=20000
-                )
-                logger.info(f"[INFO] Step 3: Created prompt_config")
-            except Exception as e:
-                logger.error(f"[ERROR] Failed to create PromptConfig: {e}")
-                return False
+                    template_name=self.template_name,
+                    variables=variables,
+                    temperature=0.6,
+                    # output scales with the slice, keep headroom for long questions
+                    max_tokens=min(MAX_TOKENS, math.ceil(MAX_TOKENS * count / question_count) + 2000)
+                ))
+                start += count
+            logger.info(f"[INFO] Split {question_count} questions into {len(configs)} chunks of {counts}")
+            return configs
+        except Exception as e:
+            logger.error(f"[ERROR] Failed to create chunked PromptConfig: {e}")
+            return None
 
-            if prompt_config is None:
-                logger.info(f"[INFO] unable to create prompt_config {prompt_config}")
-                return False
+    def _merge_chunks(self, results: List[dict], outline: Optional[dict] = None) -> Optional[dict]:
+        """ Concatenate the fragments, drop near-duplicates, renumber and rebalance the points """
+        threshold = float(os.getenv("ASSESSMENT_DEDUPE_THRESHOLD", 0.9))
+        questions = []
+        seen = []
+        for fragment in results:
+            for question in fragment.get("questions", []):
+                text = _normalize(question.get("question_text"))
+                if any(_similar(text, other, threshold) for other in seen):
+                    logger.info(f"[INFO] Dropping near-duplicate question: {question.get('question_text')}")
+                    continue
+                seen.append(text)
+                questions.append(question)
 
-            prompt_data = self.prompt_builder.build(prompt_config)
-            if not prompt_data:
-                logger.info(f"[INFO] unable to get prompt data")
-                return False
-            
-            logger.info(f"[INFO] Step 4: Built prompt_data for model: {prompt_data.get('model')}")
+        for number, question in enumerate(questions, start=1):
+            question["order_number"] = number
+        rebalance_points(questions, self.generate_assessment.get("max_points"))
+
+        requested = int(self.generate_assessment.get("question_count") or 0)
+        logger.info(f"[INFO] Merged {len(results)} chunks into {len(questions)} questions ({requested} requested)")
+        if not questions:
+            return None
+        shortfall = requested - len(questions)
+        if shortfall > 0:
+            # a few dropped duplicates are accepted and recorded, below ASSESSMENT_MIN_FILL the job fails and is retried
+            metrics.incr("assessment.merge.short_jobs")
+            metrics.incr("assessment.merge.missing_questions", shortfall)
+            if len(questions) < math.ceil(requested * float(os.getenv("ASSESSMENT_MIN_FILL", 0.9))):
+                logger.error(f"[ERROR] Only {len(questions)} of {requested} questions left after dedupe")
+                metrics.incr("assessment.merge.rejected")
+                return None
+            logger.warning(f"[WARNING] {shortfall} of {requested} questions dropped as duplicates")
+        return Assessment.model_validate({"questions": questions}).model_dump()
 
-            model_result, usage = self._invoke_llm_model(prompt_data)
-            if model_result is None:
+    def _save_generation_results(self, model_result, usage) -> bool:
+        """Save generation results to database, returns once the row is written."""
+        try:
+            updated = self.business_repository.complete_aquestion_by_input_key((Json(model_result), usage['input_tokens'], usage['output_tokens'], self.organization_id, self.generate_assessment.get("s3_output_key")))
+            if not updated:
+                logger.error(f"[ERROR] No question task row for {self.generate_assessment.get('s3_output_key')}, results not saved")
                 return False
 
-            logger.info(f"[INFO] Step 5: Invoking {type(model_result)} model")
-            
-            success = self._save_generation_results(model_result, usage)
-            return success
+            logger.info("[INFO] Successfully saved generation results")
+            return True
+
         except Exception as e:
-            logger.error("[ERROR] Questions generation", e)
+            logger.error(f"[ERROR] Failed to save generation results: {e}")
             return False
-    
-    def _invoke_llm_model(self, prompt_data: Dict[str, Any]) -> tuple:
-        """Invoke appropriate LLM model based on configuration."""
-        try:
-            model_type = prompt_data.get('model', 'GOOGLE').upper()
-            match model_type:
-                case "GOOGLE":
-                    llm_model = GeminiModel(self.validator_class, prompt_data)
-                case "AMAZON":
-                    llm_model = AmazonModel(self.validator_class, prompt_data)
-                case _:
-                    logger.error(f"[ERROR] Unsupported model type: {model_type}")
-                    return None, None
-
-            # Invoke model
-            success = llm_model._invoke_model()
-            if not success:
-                logger.warning(f"[WARN] Model invocation failed for {model_type}, triggering retry")
-                self.retry_event()
-                return None, None
-
-            # Get usage metrics
-            usage = llm_model.get_usage()
-            if not usage:
-                logger.error(f"[ERROR] No usage metrics returned from {model_type} model")
-                return None, None
-
-            logger.info(f"[INFO {model_type}] Usage: {usage}")
-            return success, usage
 
-        except Exception as e:
-            logger.error(f"[ERROR] Failed in _invoke_llm_model: {e}")
-            return None, None
-    
-    def _save_generation_results(self, model_result, usage) -> bool:
-        """Save generation results to database."""
+    async def _save_generation_results_async(self, model_result, usage) -> bool:
         try:
-            self.business_repository.update_aquestion_usage_by_input_key((usage['input_tokens'], usage['output_tokens'], self.organization_id, self.generate_assessment.get("s3_output_key")))
-            self.business_repository.update_aquestion_json_by_input_key((Json(model_result), self.organization_id, self.generate_assessment.get("s3_output_key")))
-            
+            updated = await self.async_repository.complete_aquestion_by_input_key((Json(model_result), usage['input_tokens'], usage['output_tokens'], self.organization_id, self.generate_assessment.get("s3_output_key")))
+            if not updated:
+                logger.error(f"[ERROR] No question task row for {self.generate_assessment.get('s3_output_key')}, results not saved")
+                return False
+
             logger.info("[INFO] Successfully saved generation results")
             return True
-            
         except Exception as e:
             logger.error(f"[ERROR] Failed to save generation results: {e}")
-            return False
\ No newline at end of file
+            return False
+
+    def _save_rejection(self, reason: str) -> bool:
+        try:
+            self.business_repository.update_questions_status_by_input_key(('REJECTED', self.organization_id, self.generate_assessment.get("s3_output_key")))
+            logger.info(f"[INFO] Marked question task REJECTED: {reason}")
+            return True
+        except Exception as e:
+            logger.error(f"[ERROR] Failed to save rejection: {e}")
+            return False
+
+    async def _save_rejection_async(self, reason: str) -> bool:
+        try:
+            await self.async_repository.update_questions_status_by_input_key(('REJECTED', self.organization_id, self.generate_assessment.get("s3_output_key")))
+            logger.info(f"[INFO] Marked question task REJECTED: {reason}")
+            return True
+        except Exception as e:
+            logger.error(f"[ERROR] Failed to save rejection: {e}")
+            return False
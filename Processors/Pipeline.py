@@ -0,0 +1,791 @@
+import os
+import copy
+import time
+import asyncio
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from typing import Dict, Any, List, Optional
+from Models.Prompts.Builder import PromptBuilder, PromptConfig
+from Config.Metrics import metrics
+from Models.ResponseCache import get_response_cache, cache_key, resolved_model_id, CACHED_USAGE
+from Models.RateLimiter import get_rate_limiter
+from Models.Resilience import call_with_retry, call_with_retry_async, provider_chain, should_fail_over
+from Models.Hedging import get_hedger, hedge_prompt_data, hedging_enabled, latency_key
+from Models.TokenEstimator import get_token_estimator, count_prompt_tokens, ContextOverflowError
+from Validation.CompactSchema import wire_model, expand
+from Validation.Salvage import Salvage, salvage, salvage_enabled
+from Models.Prompts.Registry import registry
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+"""
+    Staged generation pipeline shared by every processor.
+
+    Each job runs: context -> prompt -> invoke -> validate -> persist.
+    Every stage has its own queue and concurrency limit (PIPELINE_<STAGE>_CONCURRENCY),
+    so DB context fetches and result writes for some jobs overlap with the LLM calls
+    of others instead of every job holding a worker for its whole lifetime.
+"""
+STAGES = ("context", "prompt", "invoke", "validate", "persist")
+
+DEFAULT_LIMITS = {
+    "context": 4,
+    "prompt": 4,
+    "invoke": 32,
+    "validate": 4,
+    "persist": 4,
+}
+CHUNK_CONCURRENCY = 16
+# salvage repairs run in their own lane, followers waiting on a flight hold invoke slots and
+# must not keep the leader's repair from running
+REPAIR_CONCURRENCY = 8
+
+
+class GenerationJob:
+    """ State of one generation as it moves through the stages """
+    def __init__(self, processor):
+        self.processor = processor
+        self.context = None
+        self.prompt_config = None
+        self.prompt_data = None
+        self.outline_chunk: Optional[Chunk] = None
+        self.outline = None
+        self.chunks: Optional[List[Chunk]] = None
+        self.llm_model = None
+        self.raw_result = None
+        self.result = None
+        self.usage = None
+        self.cache_key = None
+        self.flight_leader = False
+        self.rejected: Optional[str] = None
+        # a salvaged response waiting for its repair call, and that call's (llm_model, raw, usage)
+        self.salvage: Optional[Salvage] = None
+        self.repair = None
+        self.timings: Dict[str, float] = {}
+        self.enqueued_at = time.monotonic()
+        self.created_at = self.enqueued_at
+
+    def __repr__(self):
+        return f"{type(self.processor).__name__}(organization_id={self.processor.organization_id})"
+
+
+class Chunk:
+    """ One sub-request of a chunked job, validated against its own model when given """
+    def __init__(self, prompt_config: PromptConfig, validator=None, name: Optional[str] = None):
+        self.prompt_config = prompt_config
+        self.validator = validator
+        self.name = name or prompt_config.template_name
+        self.prompt_data = None
+
+
+class GenerationProcessor:
+    """
+        Base class for the processors. Subclasses provide the job specific hooks
+        (context fetch, prompt config, persistence) and the pipeline runs them.
+    """
+    validator_class = None
+    log_tag = "[INFO]"
+
+    def __init__(self, organization_id: int, business_repository: Optional[any], async_repository: Optional[any] = None):
+        self.organization_id = organization_id
+        self.business_repository = business_repository
+        self.async_repository = async_repository
+        self.prompt_builder = PromptBuilder()
+
+    # --- hooks implemented by the processors ---
+    def _fetch_context(self) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def _fetch_context_async(self) -> Optional[dict]:
+        raise NotImplementedError
+
+    def _build_prompt_config(self, context: dict) -> Optional[PromptConfig]:
+        raise NotImplementedError
+
+    def _build_outline_config(self, context: dict) -> Optional["Chunk"]:
+        """ Optional: a first call whose result is handed to _build_prompt_chunks """
+        return None
+
+    def _build_prompt_chunks(self, context: dict, outline: Optional[dict] = None) -> Optional[List]:
+        """
+            Optional: PromptConfigs (or Chunks with their own validator) generated in parallel
+            and merged, None for a single call
+        """
+        return None
+
+    def _merge_chunks(self, results: List[dict], outline: Optional[dict] = None) -> Optional[dict]:
+        raise NotImplementedError
+
+    def _save_generation_results(self, model_result, usage) -> bool:
+        raise NotImplementedError
+
+    async def _save_generation_results_async(self, model_result, usage) -> bool:
+        raise NotImplementedError
+
+    def _save_rejection(self, reason: str) -> bool:
+        """ Mark the task REJECTED, the message is acknowledged when this succeeds """
+        raise NotImplementedError
+
+    async def _save_rejection_async(self, reason: str) -> bool:
+        raise NotImplementedError
+
+    # --- model dispatch shared by all processors ---
+    def _create_llm_model(self, model_type: str, prompt_data: Dict[str, Any], validator=None):
+        # with COMPACT_SCHEMA the provider writes the short-key wire model, _validate_response expands it
+        validator = wire_model(validator or self.validator_class)
+        match model_type:
+            case "GOOGLE":
+                from Models.GeminiModel import GeminiModel
+                return GeminiModel(validator, prompt_data)
+            case "AMAZON":
+                from Models.AmazonModel import AmazonModel
+                return AmazonModel(validator, prompt_data)
+            case _:
+                logger.error(f"{self.log_tag} Unsupported model type: {model_type}")
+                return None
+
+    def _build_prompt_data(self, prompt_config: PromptConfig) -> Optional[Dict[str, Any]]:
+        prompt_data = self.prompt_builder.build(prompt_config)
+        if not prompt_data:
+            logger.info(f"{self.log_tag} unable to get prompt data")
+            return None
+        # raises ContextOverflowError for prompts that cannot fit, the pipeline rejects the job
+        get_token_estimator().size(prompt_config, prompt_data)
+        # lets salvage tell how many items a truncated response lost
+        prompt_data["expected_items"] = prompt_config.variables.get("question_count")
+        logger.info(f"{self.log_tag} Built prompt_data for model: {prompt_data.get('model')}")
+        return prompt_data
+
+    def _invoke_raw(self, prompt_data: Dict[str, Any], validator=None) -> tuple:
+        """ Returns (llm_model, raw_text, usage) or (None, None, None), retried and failed over per provider """
+        chain = provider_chain((prompt_data.get('model') or 'GOOGLE').upper())
+        for index, model_type in enumerate(chain):
+            data = prompt_data if index == 0 else dict(prompt_data, model=model_type)
+            try:
+                return call_with_retry(model_type, lambda: self._invoke_provider(model_type, data, validator))
+            except Exception as e:
+                if index + 1 == len(chain) or not should_fail_over(e):
+                    raise
+                self._log_failover(model_type, chain[index + 1], e)
+
+    async def _invoke_raw_async(self, prompt_data: Dict[str, Any], validator=None) -> tuple:
+        chain = provider_chain((prompt_data.get('model') or 'GOOGLE').upper())
+        for index, model_type in enumerate(chain):
+            data = prompt_data if index == 0 else dict(prompt_data, model=model_type)
+            try:
+                return await call_with_retry_async(model_type, lambda: self._invoke_provider_async(model_type, data, validator))
+            except Exception as e:
+                if index + 1 == len(chain) or not should_fail_over(e):
+                    raise
+                self._log_failover(model_type, chain[index + 1], e)
+
+    def _log_failover(self, model_type: str, alternate: str, error: Exception):
+        logger.warning(f"{self.log_tag} {model_type} unavailable ({type(error).__name__}: {error}), failing over to {alternate}")
+        metrics.incr(f"llm.failover.{model_type}_to_{alternate}")
+
+    def _invoke_provider(self, model_type: str, prompt_data: Dict[str, Any], validator=None) -> tuple:
+        llm_model = self._create_llm_model(model_type, prompt_data, validator)
+        if llm_model is None:
+            return None, None, None
+        reservation = get_rate_limiter().acquire(resolved_model_id(prompt_data), prompt_data)
+        result = None, None, None
+        try:
+            raw = llm_model._invoke_raw()
+            result = self._with_usage(model_type, llm_model, raw)
+        finally:
+            reservation.settle(result[2])
+        return result
+
+    async def _invoke_provider_async(self, model_type: str, prompt_data: Dict[str, Any], validator=None) -> tuple:
+        llm_model = self._create_llm_model(model_type, prompt_data, validator)
+        if llm_model is None:
+            return None, None, None
+        reservation = await get_rate_limiter().acquire_async(resolved_model_id(prompt_data), prompt_data)
+        result = None, None, None
+        try:
+            raw = await llm_model._invoke_raw_async()
+            result = self._with_usage(model_type, llm_model, raw)
+        finally:
+            await reservation.settle_async(result[2])
+        return result
+
+    def _with_usage(self, model_type: str, llm_model, raw) -> tuple:
+        if not raw:
+            logger.warning(f"{self.log_tag} Model invocation failed for {model_type}")
+            return None, None, None
+        usage = llm_model.get_usage()
+        if not usage:
+            logger.error(f"{self.log_tag} No usage metrics returned from {model_type} model")
+            return None, None, None
+        logger.info(f"{self.log_tag} {model_type} usage: {usage}")
+        return llm_model, raw, usage
+
+    def _validate_response(self, llm_model, raw) -> Optional[dict]:
+        """ Counts passed and failed validations per output mode, a failure means a regeneration """
+        mode = getattr(llm_model, "output_mode", type(llm_model).__name__)
+        try:
+            result = expand(llm_model.response_validator, llm_model.validate(raw))
+        except ValueError:
+            metrics.incr(f"llm.validation.{mode}.failed")
+            raise
+        metrics.incr(f"llm.validation.{mode}.passed")
+        return result
+
+    # --- salvage of partially invalid output ---
+    def _salvage(self, llm_model, raw, error: Exception) -> Salvage:
+        """ Valid part of a failed response, re-raises the validation error when nothing can be kept """
+        prompt_data = llm_model.prompt_data or {}
+        partial = salvage(llm_model.response_validator, raw, prompt_data.get("expected_items")) if salvage_enabled() else None
+        if partial is None:
+            raise error
+        metrics.incr("llm.salvage.attempted")
+        return partial
+
+    def _repair_prompt_data(self, llm_model, partial: Salvage) -> Dict[str, Any]:
+        """ The original prompt followed by the repair request, so its cached static prefix still applies """
+        messages = [dict(message) for message in llm_model.prompt_data["messages"]]
+        messages[-1]["content"] += registry.render("Identity_repair", **partial.repair_variables())
+        prompt_data = dict(llm_model.prompt_data, messages=messages)
+        prompt_data["estimated_input_tokens"] = count_prompt_tokens(prompt_data)
+        return prompt_data
+
+    def _finish_salvage(self, llm_model, partial: Salvage, repair: Optional[dict], usage: dict, repair_usage: Optional[dict]) -> tuple:
+        result = expand(llm_model.response_validator, partial.merge(repair))
+        regenerated = sum(partial.items.values())
+        total = dict(usage)
+        if repair_usage:
+            total = {name: int(usage.get(name) or 0) + int(repair_usage.get(name) or 0) for name in usage}
+        # a full regeneration would have cost about as much as the failed call
+        saved = int(usage.get("total_tokens") or 0) - int((repair_usage or {}).get("total_tokens") or 0)
+        metrics.incr("llm.salvage.salvaged")
+        metrics.incr("llm.salvage.items_kept", partial.kept)
+        metrics.incr("llm.salvage.items_regenerated", regenerated)
+        metrics.observe("llm.salvage.tokens_saved", saved)
+        logger.info(f"{self.log_tag} salvaged {partial.kept} items, regenerated {regenerated} items and {len(partial.fields)} fields, ~{saved} tokens saved")
+        return result, total
+
+    def _salvage_failed(self, error: Exception, reason: Exception):
+        logger.error(f"{self.log_tag} salvage failed ({type(reason).__name__}: {reason})")
+        metrics.incr("llm.salvage.failed")
+        raise error
+
+    def _validate_or_partial(self, llm_model, raw, usage) -> tuple:
+        """
+            (result, usage, None) for a valid or fully salvaged response, (None, usage, salvage)
+            when part of it has to be regenerated. CPU only, the repair call is made by the caller.
+        """
+        try:
+            return self._validate_response(llm_model, raw), usage, None
+        except ValueError as e:
+            error = e
+        partial = self._salvage(llm_model, raw, error)
+        partial.error = error
+        if partial.complete:
+            return self._apply_repair(llm_model, partial, usage) + (None,)
+        return None, usage, partial
+
+    def _invoke_repair(self, llm_model, partial: Salvage) -> tuple:
+        """ The call regenerating the missing part, (llm_model, raw, usage) like _invoke_raw """
+        try:
+            return self._invoke_raw(self._repair_prompt_data(llm_model, partial), partial.repair_model())
+        except Exception as e:
+            self._salvage_failed(partial.error, e)
+
+    async def _invoke_repair_async(self, llm_model, partial: Salvage) -> tuple:
+        try:
+            return await self._invoke_raw_async(self._repair_prompt_data(llm_model, partial), partial.repair_model())
+        except Exception as e:
+            self._salvage_failed(partial.error, e)
+
+    def _apply_repair(self, llm_model, partial: Salvage, usage, repair: tuple = (None, None, None)) -> tuple:
+        """ Validate the regenerated part and merge it with the kept items, returns (result, usage) """
+        repair_llm, repair_raw, repair_usage = repair
+        try:
+            repaired = self._validate_response(repair_llm, repair_raw) if repair_llm is not None else None
+            return self._finish_salvage(llm_model, partial, repaired, usage, repair_usage)
+        except Exception as e:
+            self._salvage_failed(partial.error, e)
+
+    def _validate_or_salvage(self, llm_model, raw, usage) -> tuple:
+        """ (result, usage), a response failing validation keeps its valid part and only the rest is regenerated """
+        result, usage, partial = self._validate_or_partial(llm_model, raw, usage)
+        if partial is None:
+            return result, usage
+        return self._apply_repair(llm_model, partial, usage, self._invoke_repair(llm_model, partial))
+
+    async def _validate_or_salvage_async(self, llm_model, raw, usage) -> tuple:
+        result, usage, partial = self._validate_or_partial(llm_model, raw, usage)
+        if partial is None:
+            return result, usage
+        return self._apply_repair(llm_model, partial, usage, await self._invoke_repair_async(llm_model, partial))
+
+    def _attempt(self, prompt_data: Dict[str, Any], validator=None) -> tuple:
+        """ One invoke + validate, returns (llm_model, model_result, usage) """
+        llm_model, raw, usage = self._invoke_raw(prompt_data, validator)
+        if llm_model is None:
+            return None, None, None
+        result, usage = self._validate_or_salvage(llm_model, raw, usage)
+        return llm_model, result, usage
+
+    async def _attempt_async(self, prompt_data: Dict[str, Any], validator=None) -> tuple:
+        llm_model, raw, usage = await self._invoke_raw_async(prompt_data, validator)
+        if llm_model is None:
+            return None, None, None
+        result, usage = await self._validate_or_salvage_async(llm_model, raw, usage)
+        return llm_model, result, usage
+
+    def _invoke_hedged(self, prompt_data: Dict[str, Any], validator=None) -> tuple:
+        """ Validated result from the primary call or its hedge, whichever is first """
+        hedge_data = hedge_prompt_data(prompt_data)
+        return get_hedger().call(
+            latency_key(prompt_data), lambda: self._attempt(prompt_data, validator),
+            latency_key(hedge_data), lambda: self._attempt(hedge_data, validator)
+        )
+
+    async def _invoke_hedged_async(self, prompt_data: Dict[str, Any], validator=None) -> tuple:
+        hedge_data = hedge_prompt_data(prompt_data)
+        return await get_hedger().call_async(
+            latency_key(prompt_data), lambda: self._attempt_async(prompt_data, validator),
+            latency_key(hedge_data), lambda: self._attempt_async(hedge_data, validator)
+        )
+
+    def _invoke_llm_model(self, prompt_data: Dict[str, Any]) -> tuple:
+        """Invoke and validate in one call, returns (model_result, usage)."""
+        try:
+            llm_model, raw, usage = self._invoke_raw(prompt_data)
+            if llm_model is None:
+                return None, None
+            return self._validate_or_salvage(llm_model, raw, usage)
+        except Exception as e:
+            logger.error(f"{self.log_tag} Failed in _invoke_llm_model: {e}")
+            return None, None
+
+    # --- entry points ---
+    def run(self) -> bool:
+        return get_pipeline().run(self)
+
+    async def run_async(self) -> bool:
+        return await get_pipeline().run_async(self)
+
+
+class GenerationPipeline:
+    def __init__(self, limits: Optional[Dict[str, int]] = None):
+        self.limits = {}
+        for stage in STAGES:
+            env_value = os.getenv(f"PIPELINE_{stage.upper()}_CONCURRENCY")
+            self.limits[stage] = max(1, int((limits or {}).get(stage) or env_value or DEFAULT_LIMITS[stage]))
+        self._executors = {
+            stage: ThreadPoolExecutor(max_workers=self.limits[stage], thread_name_prefix=f"pipeline-{stage}")
+            for stage in STAGES
+        }
+        self._chunk_executor = ThreadPoolExecutor(
+            max_workers=max(1, int(os.getenv("PIPELINE_CHUNK_CONCURRENCY", CHUNK_CONCURRENCY))),
+            thread_name_prefix="pipeline-chunk"
+        )
+        self._repair_executor = ThreadPoolExecutor(
+            max_workers=max(1, int(os.getenv("PIPELINE_REPAIR_CONCURRENCY", REPAIR_CONCURRENCY))),
+            thread_name_prefix="pipeline-repair"
+        )
+        self._semaphores = None
+        self._depth = {stage: 0 for stage in STAGES + ("repair",)}
+        self._lock = threading.Lock()
+        logger.info(f"[PIPELINE] stage concurrency limits: {self.limits}")
+
+    # --- stage bodies, return False to stop the job ---
+    def _stage_context(self, job: GenerationJob) -> bool:
+        job.context = job.processor._fetch_context()
+        return job.context is not None
+
+    def _stage_prompt(self, job: GenerationJob) -> bool:
+        try:
+            return self._build_prompts(job)
+        except ContextOverflowError as e:
+            job.rejected = str(e)
+            return False
+
+    def _build_prompts(self, job: GenerationJob) -> bool:
+        outline = job.processor._build_outline_config(job.context)
+        if outline is not None:
+            # the chunks depend on the outline's result, they are built in the invoke stage
+            prepared = self._prepare_chunks(job, [outline])
+            job.outline_chunk = prepared[0] if prepared else None
+            return job.outline_chunk is not None
+        chunks = job.processor._build_prompt_chunks(job.context)
+        if chunks:
+            return self._set_chunks(job, chunks)
+        job.prompt_config = job.processor._build_prompt_config(job.context)
+        if job.prompt_config is None:
+            return False
+        job.prompt_data = job.processor._build_prompt_data(job.prompt_config)
+        return job.prompt_data is not None
+
+    def _stage_invoke(self, job: GenerationJob) -> bool:
+        if job.salvage is not None:
+            # sent back by the validate stage, only the missing part of the response is generated
+            job.repair = job.processor._invoke_repair(job.llm_model, job.salvage)
+            return True
+        if job.outline_chunk is not None:
+            outline = self._generate_chunk(job, job.outline_chunk)
+            if not self._use_outline(job, outline):
+                return False
+        if job.chunks:
+            futures = [self._chunk_executor.submit(self._generate_chunk, job, chunk) for chunk in job.chunks]
+            return self._merge_chunks(job, [future.result() for future in futures])
+        flight = self._cache_lookup(job)
+        if flight is not None:
+            done, _ = wait([flight], timeout=self._flight_wait())
+            self._use_cached(job, flight.result() if done else None)
+        if job.result is not None:
+            return True
+        if hedging_enabled():
+            # hedged attempts validate themselves, the validate stage then only passes the result on
+            job.llm_model, job.result, job.usage = job.processor._invoke_hedged(job.prompt_data)
+            if job.result is not None and job.cache_key:
+                self._cache_store(job)
+            return job.result is not None
+        job.llm_model, job.raw_result, job.usage = job.processor._invoke_raw(job.prompt_data)
+        return job.llm_model is not None
+
+    def _stage_validate(self, job: GenerationJob):
+        """ CPU only, a salvage needing a repair call goes back to the invoke stage and returns here """
+        if job.result is None:
+            if job.salvage is not None:
+                partial, job.salvage = job.salvage, None
+                job.result, job.usage = job.processor._apply_repair(job.llm_model, partial, job.usage, job.repair)
+            else:
+                job.result, job.usage, job.salvage = job.processor._validate_or_partial(job.llm_model, job.raw_result, job.usage)
+                if job.salvage is not None:
+                    return "invoke"
+            if job.result is not None and job.cache_key:
+                self._cache_store(job)
+        return job.result is not None
+
+    def _stage_persist(self, job: GenerationJob) -> bool:
+        return bool(job.processor._save_generation_results(job.result, job.usage))
+
+    async def _stage_context_async(self, job: GenerationJob) -> bool:
+        job.context = await job.processor._fetch_context_async()
+        return job.context is not None
+
+    async def _stage_prompt_async(self, job: GenerationJob) -> bool:
+        return self._stage_prompt(job)
+
+    async def _stage_invoke_async(self, job: GenerationJob) -> bool:
+        if job.salvage is not None:
+            job.repair = await job.processor._invoke_repair_async(job.llm_model, job.salvage)
+            return True
+        if job.outline_chunk is not None:
+            outline = await self._generate_chunk_async(job, job.outline_chunk)
+            if not self._use_outline(job, outline):
+                return False
+        if job.chunks:
+            results = await asyncio.gather(*[self._generate_chunk_async(job, chunk) for chunk in job.chunks])
+            return self._merge_chunks(job, list(results))
+        flight = await self._cache_call_async(self._cache_lookup, job)
+        if flight is not None:
+            # asyncio.wait does not cancel on timeout, the flight is shared with the other followers
+            waiter = asyncio.wrap_future(flight)
+            done, _ = await asyncio.wait({waiter}, timeout=self._flight_wait())
+            self._use_cached(job, waiter.result() if done else None)
+        if job.result is not None:
+            return True
+        if hedging_enabled():
+            job.llm_model, job.result, job.usage = await job.processor._invoke_hedged_async(job.prompt_data)
+            if job.result is not None and job.cache_key:
+                await self._cache_call_async(self._cache_store, job)
+            return job.result is not None
+        job.llm_model, job.raw_result, job.usage = await job.processor._invoke_raw_async(job.prompt_data)
+        return job.llm_model is not None
+
+    async def _stage_validate_async(self, job: GenerationJob):
+        if job.result is None:
+            if job.salvage is not None:
+                partial, job.salvage = job.salvage, None
+                job.result, job.usage = job.processor._apply_repair(job.llm_model, partial, job.usage, job.repair)
+            else:
+                job.result, job.usage, job.salvage = job.processor._validate_or_partial(job.llm_model, job.raw_result, job.usage)
+                if job.salvage is not None:
+                    return "invoke"
+            if job.result is not None and job.cache_key:
+                await self._cache_call_async(self._cache_store, job)
+        return job.result is not None
+
+    async def _stage_persist_async(self, job: GenerationJob) -> bool:
+        return bool(await job.processor._save_generation_results_async(job.result, job.usage))
+
+    # --- response cache ---
+    def _cache_lookup(self, job: GenerationJob) -> Optional[Future]:
+        """
+            Fills job.result on a cache hit. Returns the leader's future when an identical
+            request is already in flight, None when this job should call the provider.
+        """
+        cache = get_response_cache()
+        if not cache.enabled:
+            return None
+        job.cache_key = cache_key(job.prompt_data, job.processor.validator_class)
+        entry = cache.get(job.cache_key)
+        if entry is not None:
+            self._use_cached(job, entry)
+            return None
+        leader, flight = cache.begin(job.cache_key)
+        if leader:
+            job.flight_leader = True
+            return None
+        logger.info(f"[PIPELINE] {job} waiting on an identical in-flight request")
+        return flight
+
+    def _flight_wait(self) -> float:
+        return float(os.getenv("RESPONSE_CACHE_FLIGHT_WAIT", 300))
+
+    def _use_cached(self, job: GenerationJob, entry: Optional[tuple]):
+        """ A follower whose leader failed or took longer than RESPONSE_CACHE_FLIGHT_WAIT gets None and makes its own call """
+        if entry is None:
+            return
+        result, _ = entry
+        job.result = copy.deepcopy(result)
+        job.usage = dict(CACHED_USAGE)
+        job.timings["cached"] = True
+
+    def _cache_store(self, job: GenerationJob):
+        cache = get_response_cache()
+        if job.flight_leader:
+            job.flight_leader = False
+            cache.finish(job.cache_key, job.result, job.usage)
+        else:
+            cache.put(job.cache_key, job.result, job.usage)
+
+    async def _cache_call_async(self, fn, *args):
+        """ Disk and postgres tiers block, keep them off the event loop """
+        if get_response_cache().persistent is None:
+            return fn(*args)
+        from Config.AsyncRuntime import run_blocking
+        return await run_blocking(fn, *args)
+
+    # --- chunked jobs ---
+    def _prepare_chunks(self, job: GenerationJob, chunks: List) -> Optional[List[Chunk]]:
+        """ Render every chunk's prompt, plain PromptConfigs use the processor's validator """
+        chunks = [chunk if isinstance(chunk, Chunk) else Chunk(chunk) for chunk in chunks]
+        for chunk in chunks:
+            try:
+                chunk.prompt_data = job.processor._build_prompt_data(chunk.prompt_config)
+            except ContextOverflowError as e:
+                job.rejected = f"chunk {chunk.name}: {e}"
+                return None
+            if chunk.prompt_data is None:
+                return None
+        return chunks
+
+    def _set_chunks(self, job: GenerationJob, chunks: Optional[List]) -> bool:
+        job.chunks = self._prepare_chunks(job, chunks) if chunks else None
+        if job.chunks:
+            metrics.observe("pipeline.chunks_per_job", len(job.chunks))
+        return bool(job.chunks)
+
+    def _use_outline(self, job: GenerationJob, outline: Optional[tuple]) -> bool:
+        if outline is None:
+            logger.error(f"[PIPELINE] {job} outline failed")
+            return False
+        job.outline, job.usage = outline
+        return self._set_chunks(job, job.processor._build_prompt_chunks(job.context, job.outline))
+
+    def _chunk_cache_key(self, job: GenerationJob, chunk: Chunk) -> Optional[str]:
+        if not get_response_cache().enabled:
+            return None
+        return cache_key(chunk.prompt_data, chunk.validator or job.processor.validator_class)
+
+    def _chunk_attempts(self) -> int:
+        return 1 + max(0, int(os.getenv("PIPELINE_CHUNK_RETRIES", 1)))
+
+    def _log_chunk_failure(self, job: GenerationJob, chunk: Chunk, attempt: int, error: Exception):
+        logger.warning(f"[PIPELINE] {job} chunk {chunk.name} attempt {attempt + 1} failed: {error}")
+        metrics.incr("pipeline.chunk.failed_attempts")
+
+    def _generate_chunk(self, job: GenerationJob, chunk: Chunk) -> Optional[tuple]:
+        """ One validated chunk as (result, usage), a failed chunk is retried on its own """
+        cache = get_response_cache()
+        key = self._chunk_cache_key(job, chunk)
+        entry = cache.get(key) if key else None
+        if entry is not None:
+            return entry[0], dict(CACHED_USAGE)
+        invoke = job.processor._invoke_hedged if hedging_enabled() else job.processor._attempt
+        for attempt in range(self._chunk_attempts()):
+            try:
+                _, result, usage = invoke(chunk.prompt_data, chunk.validator)
+            except Exception as e:
+                self._log_chunk_failure(job, chunk, attempt, e)
+                continue
+            if result is not None:
+                if key:
+                    cache.put(key, result, usage)
+                return result, usage
+        return None
+
+    async def _generate_chunk_async(self, job: GenerationJob, chunk: Chunk) -> Optional[tuple]:
+        cache = get_response_cache()
+        key = self._chunk_cache_key(job, chunk)
+        entry = await self._cache_call_async(cache.get, key) if key else None
+        if entry is not None:
+            return entry[0], dict(CACHED_USAGE)
+        invoke = job.processor._invoke_hedged_async if hedging_enabled() else job.processor._attempt_async
+        for attempt in range(self._chunk_attempts()):
+            try:
+                _, result, usage = await invoke(chunk.prompt_data, chunk.validator)
+            except Exception as e:
+                self._log_chunk_failure(job, chunk, attempt, e)
+                continue
+            if result is not None:
+                if key:
+                    await self._cache_call_async(cache.put, key, result, usage)
+                return result, usage
+        return None
+
+    def _merge_chunks(self, job: GenerationJob, chunks: List[Optional[tuple]]) -> bool:
+        failed = sum(1 for chunk in chunks if chunk is None)
+        if failed:
+            logger.error(f"[PIPELINE] {job} {failed} of {len(chunks)} chunks failed")
+            return False
+        usages = [usage for _, usage in chunks] + ([job.usage] if job.usage else [])
+        job.usage = {
+            name: sum(int(usage.get(name) or 0) for usage in usages)
+            for name in ("input_tokens", "output_tokens", "total_tokens")
+        }
+        # chunk results may be the response cache's own objects (a hit, or the entry just stored)
+        # and merging renumbers them in place, so the processor gets its own copies
+        job.result = job.processor._merge_chunks([copy.deepcopy(result) for result, _ in chunks], job.outline)
+        return job.result is not None
+
+    # --- rejected jobs ---
+    def _reject(self, job: GenerationJob) -> bool:
+        logger.warning(f"[PIPELINE] {job} rejected before calling the provider: {job.rejected}")
+        return bool(job.processor._save_rejection(job.rejected))
+
+    async def _reject_async(self, job: GenerationJob) -> bool:
+        logger.warning(f"[PIPELINE] {job} rejected before calling the provider: {job.rejected}")
+        return bool(await job.processor._save_rejection_async(job.rejected))
+
+    # --- bookkeeping ---
+    def _queue_change(self, stage: str, delta: int):
+        with self._lock:
+            self._depth[stage] += delta
+            metrics.gauge(f"pipeline.{stage}.queue_depth", self._depth[stage])
+
+    def _record(self, job: GenerationJob, stage: str, waited: float, elapsed: float):
+        job.timings[stage] = round(elapsed, 4)
+        metrics.observe(f"pipeline.{stage}.queue_wait", waited)
+        metrics.observe(f"pipeline.{stage}.duration", elapsed)
+
+    def _finish(self, job: GenerationJob, success: bool) -> bool:
+        if job.flight_leader:
+            # leader never produced a result, release the followers to call on their own
+            job.flight_leader = False
+            get_response_cache().finish(job.cache_key)
+        total = time.monotonic() - job.created_at
+        outcome = "rejected" if job.rejected and success else "succeeded" if success else "failed"
+        metrics.observe("pipeline.job.duration", total)
+        metrics.incr(f"pipeline.job.{outcome}")
+        logger.info(f"[PIPELINE] {job} {outcome} in {total:.2f}s, stage timings {job.timings}")
+        return success
+
+    def _lane(self, stage: str, job: GenerationJob) -> str:
+        """ Executor or semaphore a stage runs on, a job sent back for its repair call uses the repair lane """
+        return "repair" if stage == "invoke" and job.salvage is not None else stage
+
+    # --- threaded execution ---
+    def submit(self, processor: GenerationProcessor) -> Future:
+        """ Queue a job on the first stage, the future resolves to its success flag """
+        done = Future()
+        self._enqueue(0, GenerationJob(processor), done)
+        return done
+
+    def run(self, processor: GenerationProcessor) -> bool:
+        return self.submit(processor).result()
+
+    def _enqueue(self, index: int, job: GenerationJob, done: Future):
+        lane = self._lane(STAGES[index], job)
+        job.enqueued_at = time.monotonic()
+        self._queue_change(lane, 1)
+        executor = self._repair_executor if lane == "repair" else self._executors[lane]
+        executor.submit(self._run_stage, index, job, done)
+
+    def _run_stage(self, index: int, job: GenerationJob, done: Future):
+        stage = STAGES[index]
+        lane = self._lane(stage, job)
+        self._queue_change(lane, -1)
+        started = time.monotonic()
+        try:
+            ok = getattr(self, f"_stage_{stage}")(job)
+        except Exception as e:
+            logger.error(f"[PIPELINE] {job} failed in stage {stage}: {e}", exc_info=True)
+            ok = False
+        self._record(job, lane, started - job.enqueued_at, time.monotonic() - started)
+
+        if isinstance(ok, str):
+            # handed back to an earlier stage (validate -> invoke for a salvage repair)
+            self._enqueue(STAGES.index(ok), job, done)
+        elif not ok:
+            logger.info(f"[PIPELINE] {job} stopped at stage {stage}")
+            try:
+                # a rejected job is done once its status is saved, the message gets acknowledged
+                success = self._reject(job) if job.rejected else False
+            except Exception as e:
+                logger.error(f"[PIPELINE] {job} failed to save its rejection: {e}", exc_info=True)
+                success = False
+            done.set_result(self._finish(job, success))
+        elif index + 1 == len(STAGES):
+            done.set_result(self._finish(job, True))
+        else:
+            self._enqueue(index + 1, job, done)
+
+    # --- asyncio execution ---
+    def _get_semaphores(self) -> Dict[str, asyncio.Semaphore]:
+        if self._semaphores is None:
+            self._semaphores = {stage: asyncio.Semaphore(self.limits[stage]) for stage in STAGES}
+            self._semaphores["repair"] = asyncio.Semaphore(max(1, int(os.getenv("PIPELINE_REPAIR_CONCURRENCY", REPAIR_CONCURRENCY))))
+        return self._semaphores
+
+    async def run_async(self, processor: GenerationProcessor) -> bool:
+        job = GenerationJob(processor)
+        semaphores = self._get_semaphores()
+        index = 0
+        while index < len(STAGES):
+            stage = STAGES[index]
+            lane = self._lane(stage, job)
+            job.enqueued_at = time.monotonic()
+            self._queue_change(lane, 1)
+            async with semaphores[lane]:
+                self._queue_change(lane, -1)
+                started = time.monotonic()
+                try:
+                    ok = await getattr(self, f"_stage_{stage}_async")(job)
+                except Exception as e:
+                    logger.error(f"[PIPELINE] {job} failed in stage {stage}: {e}", exc_info=True)
+                    ok = False
+                self._record(job, lane, started - job.enqueued_at, time.monotonic() - started)
+            if isinstance(ok, str):
+                index = STAGES.index(ok)
+                continue
+            if not ok:
+                logger.info(f"[PIPELINE] {job} stopped at stage {stage}")
+                try:
+                    success = await self._reject_async(job) if job.rejected else False
+                except Exception as e:
+                    logger.error(f"[PIPELINE] {job} failed to save its rejection: {e}", exc_info=True)
+                    success = False
+                return self._finish(job, success)
+            index += 1
+        return self._finish(job, True)
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+def get_pipeline() -> GenerationPipeline:
+    """ Process wide pipeline shared by every processor instance """
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = GenerationPipeline()
+    return _pipeline
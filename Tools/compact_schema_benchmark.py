@@ -0,0 +1,153 @@
+"""
+    Output size and latency of the compact wire schema (Validation/CompactSchema.py).
+
+    Offline (default): converts the sample payloads in Validation/ to the compact format,
+    counts the output tokens of each format with the local token estimator, checks that
+    expansion reproduces the validated full model and times the expansion step. The
+    latency saving assumes --tokens-per-second of decoding.
+
+    Live (--live N): renders the real templates and calls the provider N times per format,
+    reporting median output tokens and wall time. Needs the provider credentials in env.
+
+    usage: python Tools/compact_schema_benchmark.py
+           python Tools/compact_schema_benchmark.py --live 5 --provider GOOGLE --question-count 20
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from Models.TokenEstimator import count_tokens
+from Validation.AssessmentResponseValidator import Assessment
+from Validation.MaterialsResponseValidation import Material
+from Validation.CompactSchema import CompactAssessment, CompactMaterial, QUESTION_TYPES, expand, wire_model
+
+TYPE_CODES = {name: code for code, name in QUESTION_TYPES.items()}
+
+
+def compact_assessment(full: dict) -> dict:
+    questions = []
+    for question in full["questions"]:
+        choices = sorted(question["choices"], key=lambda choice: choice["order_number"])
+        questions.append({
+            "t": TYPE_CODES[question["question_type"]],
+            "s": question["standard_text"],
+            "q": question["question_text"],
+            "p": question["points"],
+            "c": [choice["choice_text"] for choice in choices],
+            "a": [position for position, choice in enumerate(choices, start=1) if choice["is_correct"]],
+        })
+    return {"qs": questions}
+
+
+def compact_material(full: dict) -> dict:
+    return {
+        "gt": full["guide_type"],
+        "su": full["subject"],
+        "gl": full["grade_level"],
+        "dm": full["duration_minutes"],
+        "lo": full["learning_objectives"],
+        "kc": [{"t": item["title"], "e": item["explanation"], "x": item["examples"]} for item in full["key_concepts"]],
+        "ac": [
+            {"t": item["title"], "d": item["description"], "s": item["steps"], "o": item["expected_outcome"]}
+            for item in full["activities"]
+        ],
+        "aq": [
+            {"q": item["question"], "a": item["answer"], "d": item["difficulty"], "ty": item["question_type"], "p": item["points"]}
+            for item in full["assessment_questions"]
+        ],
+        "sm": full["summary"],
+        "mn": full["materials_needed"],
+        "ap": full["appendix"],
+    }
+
+
+CASES = [
+    ("Assessment", "Validation/assessment_test_payload.json", Assessment, CompactAssessment, compact_assessment),
+    ("Material", "Validation/meterials_test_payload.json", Material, CompactMaterial, compact_material),
+]
+
+
+def offline(tokens_per_second: float, repeat: int):
+    print(f"{'model':<11} {'format':<16} {'tokens':>7} {'saved':>7} {'decode s':>9}")
+    for name, path, model, wire, to_compact in CASES:
+        with open(os.path.join(ROOT, path)) as handle:
+            payload = json.load(handle)
+        full = model.model_validate(payload).model_dump(mode="json")
+        # a model leaves optional fields out rather than writing nulls
+        compact = wire.model_validate(to_compact(full)).model_dump(exclude_none=True)
+        if expand(wire, wire.model_validate(compact).model_dump()) != model.model_validate(full).model_dump():
+            raise SystemExit(f"{name}: expansion does not reproduce the full model")
+
+        formats = {
+            "verbose pretty": json.dumps(payload, indent=2, ensure_ascii=False),
+            "verbose minified": json.dumps(payload, ensure_ascii=False),
+            "compact": json.dumps(compact, ensure_ascii=False),
+        }
+        baseline = count_tokens(formats["verbose pretty"])
+        for label, text in formats.items():
+            tokens = count_tokens(text)
+            print(f"{name:<11} {label:<16} {tokens:>7} {1 - tokens / baseline:>7.1%} {tokens / tokens_per_second:>9.2f}")
+
+        started = time.perf_counter()
+        for _ in range(repeat):
+            expand(wire, wire.model_validate(compact).model_dump())
+        per_call = (time.perf_counter() - started) / repeat * 1e6
+        print(f"{name:<11} validate + expand: {per_call:.0f} us per response")
+
+
+def sample_variables(question_count: int, compact: bool) -> dict:
+    return {
+        "grade_level": 9, "difficulty": "medium", "question_count": question_count, "max_points": question_count * 5,
+        "topic": "Algebra I", "district": "Sample district", "custom_instructions": None, "compact_schema": compact,
+    }
+
+
+def live(runs: int, provider: str, question_count: int):
+    from Models.Prompts.Builder import PromptBuilder, PromptConfig
+    from Models.GeminiModel import GeminiModel
+    from Models.AmazonModel import AmazonModel
+
+    adapter = GeminiModel if provider == "GOOGLE" else AmazonModel
+    builder = PromptBuilder()
+    print(f"{'format':<8} {'runs':>4} {'output tokens':>14} {'seconds':>8}")
+    for compact in (False, True):
+        os.environ["COMPACT_SCHEMA"] = "true" if compact else "false"
+        validator = wire_model(Assessment)
+        prompt_data = builder.build(PromptConfig(
+            template_name="Identity_questions", model=provider, temperature=0.6, max_tokens=20000,
+            variables=sample_variables(question_count, compact)
+        ))
+        tokens, seconds = [], []
+        for _ in range(runs):
+            llm_model = adapter(validator, prompt_data)
+            started = time.perf_counter()
+            result = expand(validator, llm_model.validate(llm_model._invoke_raw()))
+            seconds.append(time.perf_counter() - started)
+            tokens.append(llm_model.get_usage()["output_tokens"])
+            Assessment.model_validate(result)
+        label = "compact" if compact else "verbose"
+        print(f"{label:<8} {runs:>4} {statistics.median(tokens):>14.0f} {statistics.median(seconds):>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tokens-per-second", type=float, default=150.0, help="decode speed used for the offline latency estimate")
+    parser.add_argument("--repeat", type=int, default=1000, help="expansion timing iterations")
+    parser.add_argument("--live", type=int, default=0, help="provider calls per format, 0 for offline only")
+    parser.add_argument("--provider", default=os.getenv("MODEL_TYPE", "GOOGLE").upper(), choices=("GOOGLE", "AMAZON"))
+    parser.add_argument("--question-count", type=int, default=10)
+    args = parser.parse_args()
+
+    offline(args.tokens_per_second, args.repeat)
+    if args.live:
+        live(args.live, args.provider, args.question_count)
+
+
+if __name__ == "__main__":
+    main()
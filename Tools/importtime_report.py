@@ -0,0 +1,88 @@
+"""
+    Import-time report for Lambda cold start.
+
+    Runs `python -X importtime -c "import <module>"` in a clean interpreter, prints the
+    slowest imports by cumulative and self time, and exits non-zero when the module
+    takes longer than --budget-ms to import or pulls in a --forbid module at import time.
+
+    usage: python Tools/importtime_report.py --module main --budget-ms 1500 --forbid google.genai
+"""
+import os
+import re
+import sys
+import argparse
+import subprocess
+
+LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+def collect(module: str, cwd: str) -> list:
+    env = dict(os.environ)
+    env.setdefault("PYTHONDONTWRITEBYTECODE", "1")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr)
+        raise SystemExit(f"import of {module} failed")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append({
+                "name": name,
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+                "depth": len(indent) // 2,
+            })
+    return rows
+
+
+def report(rows: list, module: str, top: int) -> float:
+    total = next((row["cumulative_ms"] for row in rows if row["name"] == module), 0.0)
+    print(f"import {module}: {total:.1f} ms cumulative, {len(rows)} modules imported")
+
+    print(f"\nTop {top} by cumulative time:")
+    for row in sorted(rows, key=lambda r: r["cumulative_ms"], reverse=True)[:top]:
+        print(f"  {row['cumulative_ms']:9.1f} ms  {row['name']}")
+
+    print(f"\nTop {top} by self time:")
+    for row in sorted(rows, key=lambda r: r["self_ms"], reverse=True)[:top]:
+        print(f"  {row['self_ms']:9.1f} ms  {row['name']}")
+    return total
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--budget-ms", type=float, default=None, help="fail if the module import exceeds this")
+    parser.add_argument("--forbid", nargs="*", default=[], help="modules that must not be imported at import time")
+    parser.add_argument("--cwd", default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    args = parser.parse_args()
+
+    rows = collect(args.module, args.cwd)
+    total = report(rows, args.module, args.top)
+
+    failures = []
+    if args.budget_ms is not None and total > args.budget_ms:
+        failures.append(f"import {args.module} took {total:.1f} ms, budget is {args.budget_ms:.1f} ms")
+    imported = {row["name"] for row in rows}
+    for name in args.forbid:
+        if name in imported:
+            failures.append(f"{name} is imported at import time of {args.module}")
+
+    if failures:
+        print("\nFAILED:")
+        for failure in failures:
+            print(f"  {failure}")
+        return 1
+    print("\nOK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
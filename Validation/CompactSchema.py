@@ -0,0 +1,143 @@
+import os
+import logging
+from typing import Callable, Dict, List, Literal, Optional, Tuple, Type
+from pydantic import BaseModel, Field
+from Validation.AssessmentResponseValidator import Assessment
+from Validation.MaterialsResponseValidation import Material
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+"""
+    Compact wire format for LLM output (COMPACT_SCHEMA=true).
+
+    Output tokens dominate generation latency, so the providers are asked for short keys,
+    no server-assigned fields (question_id, choice_id, image_url), positional order numbers
+    and choices given as a plain list with the 1-based positions of the correct ones. The
+    response schema and the template examples use this format, and expand() turns a
+    validated compact response back into the Assessment or Material dict that is persisted.
+"""
+QUESTION_TYPES = {
+    "mc": "multiple_choice",
+    "ms": "multi_select_choice",
+    "sa": "short_answer",
+    "tf": "true_false",
+}
+
+
+def compact_enabled() -> bool:
+    return os.getenv("COMPACT_SCHEMA", "false").lower() in ("1", "true", "yes")
+
+
+# --- Assessment ---
+class CompactQuestion(BaseModel):
+    t: Literal["mc", "ms", "sa", "tf"] = Field(..., description="type: mc multiple_choice, ms multi_select_choice, sa short_answer, tf true_false")
+    s: str = Field(..., description="standard text")
+    q: str = Field(..., description="question text")
+    p: float = Field(..., description="points")
+    c: List[str] = Field(default_factory=list, description="choices in display order, empty for sa")
+    a: List[int] = Field(default_factory=list, description="1-based positions of the correct choices")
+
+class CompactAssessment(BaseModel):
+    qs: List[CompactQuestion]
+
+
+def expand_assessment(compact: dict) -> dict:
+    questions = []
+    for number, question in enumerate(compact["qs"], start=1):
+        correct = set(question["a"])
+        questions.append({
+            "question_id": None,
+            "standard_text": question["s"],
+            "image_url": None,
+            "question_text": question["q"],
+            "question_type": QUESTION_TYPES[question["t"]],
+            "points": question["p"],
+            "order_number": number,
+            "is_required": True,
+            "choices": [
+                {"choice_id": None, "choice_text": text, "is_correct": position in correct, "order_number": position}
+                for position, text in enumerate(question["c"], start=1)
+            ],
+        })
+    return Assessment.model_validate({"questions": questions}).model_dump()
+
+
+# --- Material ---
+class CompactKeyConcept(BaseModel):
+    t: str = Field(..., description="title")
+    e: str = Field(..., description="explanation")
+    x: List[str] = Field(default_factory=list, description="examples")
+
+class CompactActivity(BaseModel):
+    t: str = Field(..., description="title")
+    d: str = Field(..., description="description")
+    s: List[str] = Field(..., min_length=1, description="steps")
+    o: str = Field(..., description="expected outcome")
+
+class CompactMaterialQuestion(BaseModel):
+    q: str = Field(..., description="question")
+    a: str = Field("(Student's response)", description="expected answer")
+    d: Literal["easy", "medium", "hard"] = Field("medium", description="difficulty")
+    ty: Optional[str] = Field(None, description="question type")
+    p: Optional[int] = Field(None, ge=0, description="points")
+
+class CompactMaterial(BaseModel):
+    gt: str = Field("study_guide", description="guide type")
+    su: str = Field(..., description="subject")
+    gl: str = Field(..., description="grade level")
+    dm: int = Field(..., description="duration in minutes")
+    lo: List[str] = Field(..., description="learning objectives")
+    kc: List[CompactKeyConcept] = Field(..., description="key concepts")
+    ac: List[CompactActivity] = Field(..., description="activities")
+    aq: List[CompactMaterialQuestion] = Field(..., description="assessment questions")
+    sm: str = Field(..., description="summary")
+    mn: List[str] = Field(..., description="materials needed")
+    ap: Optional[str] = Field(None, description="appendix")
+
+
+def expand_material(compact: dict) -> dict:
+    return Material.model_validate({
+        "guide_type": compact["gt"],
+        "subject": compact["su"],
+        "grade_level": compact["gl"],
+        "duration_minutes": compact["dm"],
+        "learning_objectives": compact["lo"],
+        "key_concepts": [
+            {"title": item["t"], "explanation": item["e"], "examples": item["x"]} for item in compact["kc"]
+        ],
+        "activities": [
+            {"title": item["t"], "description": item["d"], "steps": item["s"], "expected_outcome": item["o"]}
+            for item in compact["ac"]
+        ],
+        "assessment_questions": [
+            {"question": item["q"], "answer": item["a"], "difficulty": item["d"], "question_type": item["ty"], "points": item["p"]}
+            for item in compact["aq"]
+        ],
+        "summary": compact["sm"],
+        "materials_needed": compact["mn"],
+        "appendix": compact["ap"],
+    }).model_dump()
+
+
+# full model -> (compact wire model, expansion back to the full model's dict)
+COMPACT_MODELS: Dict[Type[BaseModel], Tuple[Type[BaseModel], Callable[[dict], dict]]] = {
+    Assessment: (CompactAssessment, expand_assessment),
+    Material: (CompactMaterial, expand_material),
+}
+_EXPANDERS = {wire: expand for wire, expand in COMPACT_MODELS.values()}
+
+
+def wire_model(validator: Optional[Type[BaseModel]]) -> Optional[Type[BaseModel]]:
+    """ The model the provider is asked to produce for this validator """
+    if compact_enabled() and validator in COMPACT_MODELS:
+        return COMPACT_MODELS[validator][0]
+    return validator
+
+
+def expand(validator: Optional[Type[BaseModel]], result: Optional[dict]) -> Optional[dict]:
+    """ Validated output of wire_model(validator) -> dict of the full model, other results pass through """
+    expander = _EXPANDERS.get(validator)
+    if expander is None or result is None:
+        return result
+    return expander(result)
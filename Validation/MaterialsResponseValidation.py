@@ -211,4 +211,29 @@ class Material(BaseModel):
     assessment_questions: List[AssessmentQuestion]
     summary: str
     materials_needed: List[str]
-    appendix: Optional[str] = None
\ No newline at end of file
+    appendix: Optional[str] = None
+
+# Section-parallel generation: an outline first, then each list section on its own
+class MaterialOutline(BaseModel):
+    """Everything in Material except the long list sections, which are only named here"""
+
+    guide_type: str = "study_guide"
+    subject: str
+    grade_level: str
+    duration_minutes: int
+    learning_objectives: List[str]
+    key_concept_titles: List[str] = Field(..., min_length=1)
+    activity_titles: List[str] = Field(..., min_length=1)
+    assessment_question_count: int = Field(..., gt=0)
+    summary: str
+    materials_needed: List[str]
+    appendix: Optional[str] = None
+
+class KeyConceptSection(BaseModel):
+    key_concepts: List[KeyConcept] = Field(..., min_length=1)
+
+class ActivitySection(BaseModel):
+    activities: List[Activity] = Field(..., min_length=1)
+
+class AssessmentQuestionSection(BaseModel):
+    assessment_questions: List[AssessmentQuestion] = Field(..., min_length=1)
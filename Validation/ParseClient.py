@@ -53,4 +53,32 @@ class ParseClient:
                 
         except Exception as e:
             logging.error(f"[ERROR] unable to parse with pydantic {e}")
-            return None
\ No newline at end of file
+            return None
+
+    def is_warmup(self) -> bool:
+        """ Warmup pings keep containers hot, they carry task or generate_type 'warmup' """
+        try:
+            data = json.loads(self.body)
+            if not isinstance(data, dict):
+                return False
+            body = data.get("body") if isinstance(data.get("body"), dict) else {}
+            return data.get("task") == "warmup" or body.get("generate_type") == "warmup"
+        except (TypeError, ValueError):
+            return False
+
+    def context_key(self) -> Optional[tuple]:
+        """
+            (table, organization_id, id) of the reference row this message looks up, read without validating it.
+            The ids are cast with int() like the int fields of Message, "12" and 12 give the same key.
+        """
+        try:
+            body = json.loads(self.body).get("body")
+            organization_id = int(body.get("organization_id"))
+            match body.get("generate_type"):
+                case "generate_questions" | "generate_questions_do_materials":
+                    return "district", organization_id, int((body.get("generate_questions") or {}).get("district_id"))
+                case "generate_materials":
+                    return "assessments", organization_id, int((body.get("generate_materials") or {}).get("assessment_id"))
+        except (TypeError, ValueError, AttributeError):
+            pass
+        return None
@@ -0,0 +1,179 @@
+import os
+import json
+import logging
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Type
+from pydantic import BaseModel, TypeAdapter, ValidationError, create_model
+from Validation.StreamingParser import item_models
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+"""
+    Salvage of partially invalid LLM output (SALVAGE_PARTIAL_OUTPUT, on by default).
+
+    When a response fails validation as a whole, the document is cut back to its last complete
+    top level member or list element and its open brackets are closed, then every element of
+    the top level item lists (questions, key_concepts, ...) is validated on its own. Valid
+    items and fields are kept; the invalid ones, the ones lost to truncation and the required
+    fields that are missing are asked for again through a repair model that only has those
+    fields, so the follow-up call regenerates a fraction of the output.
+"""
+
+
+def salvage_enabled() -> bool:
+    return os.getenv("SALVAGE_PARTIAL_OUTPUT", "true").lower() in ("1", "true", "yes")
+
+
+def close_truncated(text: str) -> Tuple[Optional[str], bool]:
+    """
+        Returns (document, truncated). A truncated document is cut after its last complete
+        top level member or list element and closed, so a half written item is dropped whole.
+    """
+    start = text.find("{")
+    if start < 0:
+        return None, False
+    stack = []
+    cut = None  # (end, open brackets) of the last complete value at depth 1 or 2
+    in_string = escape = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append(ch)
+        elif ch in "}]":
+            if not stack or stack[-1] != ("{" if ch == "}" else "["):
+                return None, False
+            stack.pop()
+            if not stack:
+                return text[start:i + 1], False
+            if len(stack) <= 2:
+                cut = (i + 1, "".join(stack))
+        elif ch == "," and len(stack) <= 2:
+            cut = (i, "".join(stack))
+    if cut is None:
+        return None, True
+    end, brackets = cut
+    closing = "".join("}" if bracket == "{" else "]" for bracket in reversed(brackets))
+    return text[start:end] + closing, True
+
+
+def _summary(item: dict) -> str:
+    """ Longest text field of an item, enough for the model to avoid repeating it """
+    texts = [value for value in item.values() if isinstance(value, str)]
+    return max(texts, key=len)[:120] if texts else json.dumps(item)[:120]
+
+
+class Salvage:
+    """ Valid part of a response and what the repair call has to produce """
+    def __init__(self, validator: Type[BaseModel], data: dict, truncated: bool):
+        self.validator = validator
+        self.data = data
+        self.truncated = truncated
+        self.kept = 0
+        self.dropped = 0
+        self.items: Dict[str, int] = {}  # list field -> items to regenerate
+        self.fields: List[str] = []      # fields to regenerate whole
+        self.error: Optional[Exception] = None  # the validation error, raised if the salvage fails
+
+    @property
+    def complete(self) -> bool:
+        return not self.items and not self.fields
+
+    def repair_model(self) -> Type[BaseModel]:
+        return repair_model(self.validator, tuple(sorted(self.items)), tuple(self.fields))
+
+    def repair_variables(self) -> dict:
+        return {
+            "items": self.items,
+            "fields": self.fields,
+            "kept": {name: [_summary(item) for item in self.data.get(name, [])] for name in self.items},
+        }
+
+    def merge(self, repair: Optional[dict]) -> dict:
+        """ Validated output of the original validator, the repair result fills the gaps """
+        data = dict(self.data)
+        lists = item_models(self.validator)
+        for name in self.fields:
+            data[name] = (repair or {}).get(name)
+        for name, count in self.items.items():
+            data[name] = list(data.get(name) or []) + list((repair or {}).get(name) or [])[:count]
+        for name, model in lists.items():
+            if "order_number" in model.model_fields and isinstance(data.get(name), list):
+                for number, item in enumerate(data[name], start=1):
+                    item["order_number"] = number
+        return self.validator.model_validate(data).model_dump()
+
+
+@lru_cache(maxsize=None)
+def repair_model(validator: Type[BaseModel], items: Tuple[str, ...], fields: Tuple[str, ...]) -> Type[BaseModel]:
+    """ Model with only the fields to regenerate, list fields keep their item model """
+    definitions = {}
+    for name in items + fields:
+        field = validator.model_fields[name]
+        definitions[name] = (field.annotation, field)
+    return create_model(f"{validator.__name__}Repair", **definitions)
+
+
+def salvage(validator: Type[BaseModel], text: Optional[str], expected_items: Optional[int] = None) -> Optional[Salvage]:
+    """ Tolerant parse of a response that failed validation, None when nothing can be kept """
+    if not text or validator is None:
+        return None
+    document, truncated = close_truncated(text)
+    if document is None:
+        return None
+    try:
+        data = json.loads(document)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    lists = item_models(validator)
+    result = Salvage(validator, {}, truncated)
+    for name, field in validator.model_fields.items():
+        if name in lists:
+            continue
+        if name not in data:
+            if field.is_required():
+                result.fields.append(name)
+            continue
+        try:
+            result.data[name] = TypeAdapter(field.annotation).validate_python(data[name])
+        except ValidationError:
+            result.fields.append(name)
+
+    for name, model in lists.items():
+        raw_items = data.get(name)
+        if not isinstance(raw_items, list):
+            result.fields.append(name)
+            continue
+        valid, invalid = [], 0
+        for item in raw_items:
+            try:
+                valid.append(model.model_validate(item).model_dump())
+            except ValidationError:
+                invalid += 1
+        # with a single item list the requested count tells how many items truncation lost
+        lost = max(0, expected_items - len(raw_items)) if expected_items and len(lists) == 1 else 0
+        result.data[name] = valid
+        result.kept += len(valid)
+        result.dropped += invalid
+        if invalid + lost:
+            result.items[name] = invalid + lost
+
+    if not result.kept and all(name in lists for name in result.data):
+        return None
+    logger.info(
+        f"[SALVAGE] {validator.__name__}: kept {result.kept} items, dropped {result.dropped}, "
+        f"truncated={truncated}, regenerate items {result.items} and fields {result.fields}"
+    )
+    return result
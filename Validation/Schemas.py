@@ -0,0 +1,13 @@
+from functools import lru_cache
+from pydantic import BaseModel
+import logging
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+""" JSON schema generation is slow in pydantic and is not cached by it, build each schema once """
+@lru_cache(maxsize=None)
+def response_schema(validator: type[BaseModel]) -> dict:
+    logger.info(f"[INFO] building json schema for {validator.__name__}")
+    return validator.model_json_schema()
@@ -0,0 +1,151 @@
+import os
+import time
+import typing
+import logging
+from typing import Callable, Dict, Optional, Type
+from pydantic import BaseModel, ValidationError
+from Config.Metrics import metrics
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+_FENCES = ("", "```", "```json")
+
+
+def streaming_enabled() -> bool:
+    return os.getenv("LLM_STREAMING", "false").lower() in ("1", "true", "yes")
+
+
+class StreamAborted(ValueError):
+    """ The streamed output is structurally broken, the provider call should be cancelled """
+    def __init__(self, message: str, items: int = 0):
+        self.items = items
+        super().__init__(message)
+
+
+def item_models(validator: Type[BaseModel]) -> Dict[str, Type[BaseModel]]:
+    """ Top level list fields whose elements are models, e.g. Assessment.questions -> Question """
+    models = {}
+    for name, field in validator.model_fields.items():
+        if typing.get_origin(field.annotation) is not list:
+            continue
+        args = typing.get_args(field.annotation)
+        if args and isinstance(args[0], type) and issubclass(args[0], BaseModel):
+            models[name] = args[0]
+    return models
+
+
+class IncrementalJSONValidator:
+    """
+        Consumes a JSON document chunk by chunk. Every element of a top level list of models
+        (questions, key_concepts, activities, assessment_questions) is validated as soon as its
+        closing brace arrives. Mismatched brackets, text outside the document or an invalid item
+        raise StreamAborted so the caller can stop reading the stream.
+    """
+    def __init__(self, validator: Type[BaseModel], provider: str = "llm", on_item: Optional[Callable] = None):
+        self.item_models = item_models(validator)
+        self.provider = provider
+        self.on_item = on_item
+        self.text = ""
+        self.items = 0
+        self.started_at = time.monotonic()
+        self.first_token_at = None
+        self.first_item_at = None
+        self._pos = 0
+        self._start = None
+        self._end = None
+        self._stack = []  # [bracket, current key, expecting key]
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._item_start = None
+        self._item_key = None
+
+    def feed(self, chunk: Optional[str]):
+        if not chunk:
+            return
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+            metrics.observe(f"llm.stream.{self.provider}.time_to_first_token", self.first_token_at - self.started_at)
+        self.text += chunk
+        self._scan()
+
+    def _abort(self, reason: str):
+        metrics.incr(f"llm.stream.{self.provider}.aborted")
+        logger.error(f"[ERROR] stream aborted after {self.items} items at char {self._pos}: {reason}")
+        raise StreamAborted(reason, self.items)
+
+    def _scan(self):
+        text = self.text
+        i = self._pos
+        while i < len(text):
+            ch = text[i]
+            self._pos = i
+            if self._end is not None:
+                if not ch.isspace() and ch != "`":
+                    self._abort("unexpected text after the JSON document")
+            elif self._start is None:
+                if ch == "{":
+                    if text[:i].strip() not in _FENCES:
+                        self._abort("response does not start with a JSON object")
+                    self._start = i
+                    self._stack.append(["{", None, True])
+                elif not _FENCES[-1].startswith(text[:i + 1].strip()):
+                    self._abort("response does not start with a JSON object")
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    frame = self._stack[-1]
+                    if frame[0] == "{" and frame[2]:
+                        frame[1] = text[self._string_start + 1:i]
+            elif ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch in "{[":
+                if ch == "{" and len(self._stack) == 2 and self._stack[1][0] == "[" and self._stack[0][1] in self.item_models:
+                    self._item_start = i
+                    self._item_key = self._stack[0][1]
+                self._stack.append([ch, None, ch == "{"])
+            elif ch in "}]":
+                if not self._stack or self._stack[-1][0] != ("{" if ch == "}" else "["):
+                    self._abort(f"unbalanced '{ch}'")
+                self._stack.pop()
+                if ch == "}" and len(self._stack) == 2 and self._item_start is not None:
+                    self._validate_item(text[self._item_start:i + 1])
+                if not self._stack:
+                    self._end = i
+            elif ch == ":":
+                if self._stack[-1][0] == "{":
+                    self._stack[-1][2] = False
+            elif ch == ",":
+                if self._stack[-1][0] == "{":
+                    self._stack[-1][2] = True
+            i += 1
+        self._pos = i
+
+    def _validate_item(self, item_text: str):
+        key = self._item_key
+        self._item_start = None
+        try:
+            item = self.item_models[key].model_validate_json(item_text)
+        except ValidationError as e:
+            self._abort(f"invalid {key} item #{self.items + 1}: {e}")
+        self.items += 1
+        metrics.incr(f"llm.stream.{self.provider}.items")
+        if self.first_item_at is None:
+            self.first_item_at = time.monotonic()
+            metrics.observe(f"llm.stream.{self.provider}.time_to_first_item", self.first_item_at - self.started_at)
+            logger.info(f"[INFO] first {key} item validated after {self.first_item_at - self.started_at:.2f}s")
+        if self.on_item is not None:
+            self.on_item(key, item)
+
+    def finish(self) -> str:
+        """ Returns the JSON document without code fences, raises if the stream stopped early """
+        if self._start is None or self._end is None:
+            self._abort("stream ended before the JSON document was complete")
+        metrics.observe(f"llm.stream.{self.provider}.duration", time.monotonic() - self.started_at)
+        return self.text[self._start:self._end + 1]
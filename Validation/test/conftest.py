@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the project has no package metadata, modules are imported from the repository root like main.py does
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
@@ -0,0 +1,125 @@
+import pytest
+from Config.Metrics import metrics
+from Processors.AssessmentGeneration import AssessmentGeneration, split_evenly, split_points, rebalance_points
+
+
+def question(text, points=1, number=1):
+    return {
+        "question_id": None,
+        "standard_text": "S1",
+        "question_text": text,
+        "question_type": "short_answer",
+        "points": points,
+        "order_number": number,
+        "choices": []
+    }
+
+
+def processor(question_count, max_points=None):
+    return AssessmentGeneration(1, {"question_count": question_count, "max_points": max_points}, None)
+
+
+@pytest.mark.parametrize("total, parts, expected", [
+    (23, 3, [8, 8, 7]),
+    (20, 2, [10, 10]),
+    (2, 3, [1, 1, 0]),
+    (11, 1, [11]),
+])
+def test_split_evenly(total, parts, expected):
+    assert split_evenly(total, parts) == expected
+    assert sum(split_evenly(total, parts)) == total
+
+
+def test_split_points_whole_distributes_residue():
+    shares = split_points(100, [8, 8, 7])
+    assert shares == [35, 35, 30]
+    assert all(isinstance(share, int) for share in shares)
+
+
+def test_split_points_whole_even():
+    assert split_points(20, [10, 10]) == [10, 10]
+
+
+def test_split_points_fractional_adds_up():
+    shares = split_points(10.5, [1, 1, 1])
+    assert shares[:2] == [3.5, 3.5]
+    assert sum(shares) == pytest.approx(10.5)
+
+
+def test_split_points_fractional_rounding_residue():
+    shares = split_points(0.1, [1, 1, 1])
+    assert sum(shares) == pytest.approx(0.1)
+
+
+def test_rebalance_points_scales_to_max():
+    questions = [question("a", 10), question("b", 10), question("c", 10)]
+    rebalance_points(questions, 100)
+    assert [q["points"] for q in questions] == [33.33, 33.33, 33.34]
+    assert sum(q["points"] for q in questions) == pytest.approx(100)
+
+
+@pytest.mark.parametrize("points, max_points", [
+    ([0, 0], 10),
+    ([5, 5], None),
+    ([5, 5], 0),
+])
+def test_rebalance_points_leaves_unscalable_alone(points, max_points):
+    questions = [question(str(index), value) for index, value in enumerate(points)]
+    rebalance_points(questions, max_points)
+    assert [q["points"] for q in questions] == points
+
+
+def test_rebalance_points_empty():
+    questions = []
+    rebalance_points(questions, 10)
+    assert questions == []
+
+
+def test_merge_chunks_dedupes_renumbers_and_rebalances():
+    results = [
+        {"questions": [question("What is 2 + 2?", 5, 1), question("Name a prime number.", 5, 2)]},
+        {"questions": [question("what is 2+2 ?", 5, 1), question("Define a fraction.", 5, 2), question("What is a ratio?", 5, 3)]},
+    ]
+    merged = processor(4, 20)._merge_chunks(results)
+    texts = [q["question_text"] for q in merged["questions"]]
+    assert texts == ["What is 2 + 2?", "Name a prime number.", "Define a fraction.", "What is a ratio?"]
+    assert [q["order_number"] for q in merged["questions"]] == [1, 2, 3, 4]
+    assert sum(q["points"] for q in merged["questions"]) == pytest.approx(20)
+
+
+def test_merge_chunks_threshold_from_env(monkeypatch):
+    monkeypatch.setenv("ASSESSMENT_DEDUPE_THRESHOLD", "1.01")
+    results = [{"questions": [question("What is 2 + 2?")]}, {"questions": [question("What is 2 + 2?")]}]
+    assert len(processor(2)._merge_chunks(results)["questions"]) == 2
+
+
+def test_merge_chunks_accepts_and_records_small_shortfall():
+    before = metrics.counter("assessment.merge.missing_questions")
+    results = [
+        {"questions": [question(text) for text in ("Define photosynthesis.", "Name the planets.", "What is erosion?",
+                                                   "Explain gravity.", "Describe a food chain.")]},
+        {"questions": [question(text) for text in ("Why do seasons change?", "What is a mammal?", "How do magnets work?",
+                                                   "List three states of matter.", "Define photosynthesis!")]},
+    ]
+    merged = processor(10, 10)._merge_chunks(results)
+    assert len(merged["questions"]) == 9
+    assert metrics.counter("assessment.merge.missing_questions") - before == 1
+
+
+def test_merge_chunks_fails_below_min_fill(monkeypatch):
+    monkeypatch.setenv("ASSESSMENT_MIN_FILL", "0.9")
+    results = [{"questions": [question("Same question")]}, {"questions": [question("Same question")]}]
+    assert processor(2)._merge_chunks(results) is None
+
+
+def test_merge_chunks_no_questions():
+    assert processor(2)._merge_chunks([{"questions": []}, {}]) is None
+
+
+def test_pipeline_merge_leaves_cached_chunks_untouched():
+    from Processors.Pipeline import GenerationJob, GenerationPipeline
+    cached = {"questions": [question("What is 2 + 2?", 5, 7), question("Define a fraction.", 5, 9)]}
+    job = GenerationJob(processor(2, 20))
+    assert GenerationPipeline()._merge_chunks(job, [(cached, {"total_tokens": 0})])
+    assert [q["order_number"] for q in job.result["questions"]] == [1, 2]
+    assert [(q["order_number"], q["points"]) for q in cached["questions"]] == [(7, 5), (9, 5)]
@@ -0,0 +1,77 @@
+import asyncio
+import pytest
+from Config.AsyncPostgreSQL import AsyncPostgresClient
+
+
+class FakePool:
+    def __init__(self):
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+def client():
+    db = AsyncPostgresClient()
+    db.opened = []
+
+    async def open_pool():
+        pool = FakePool()
+        db.opened.append(pool)
+        return pool
+
+    db._open_pool = open_pool
+    return db
+
+
+def test_concurrent_first_callers_share_one_pool():
+    db = client()
+
+    async def main():
+        return await asyncio.gather(*(db._get_pool() for _ in range(5)))
+
+    pools = asyncio.run(main())
+    assert len(db.opened) == 1 and all(pool is db.opened[0] for pool in pools)
+
+
+def test_a_new_loop_is_rejected_until_the_pool_is_closed():
+    db = client()
+    pool = asyncio.run(db._get_pool())
+    with pytest.raises(RuntimeError, match="another event loop"):
+        asyncio.run(db._get_pool())
+    assert not pool.closed and len(db.opened) == 1
+
+
+def test_close_lets_the_next_loop_open_a_new_pool():
+    db = client()
+
+    async def use_and_close():
+        pool = await db._get_pool()
+        await db.close()
+        return pool
+
+    first = asyncio.run(use_and_close())
+    second = asyncio.run(use_and_close())
+    assert first.closed and second.closed and first is not second
+
+
+def test_execute_values_expands_the_placeholder():
+    db = client()
+    sent = []
+
+    async def run(query, params, fetch):
+        sent.append((query, params))
+        return []
+
+    db._run = run
+    asyncio.run(db.execute_values("UPDATE t SET a = v.a FROM (VALUES %s) AS v (a, b) WHERE t.note = 'VALUES'", [(1, 2), (3, 4)], "(%s::integer, %s::text)"))
+    assert sent == [("UPDATE t SET a = v.a FROM (VALUES (%s::integer, %s::text), (%s::integer, %s::text)) AS v (a, b) WHERE t.note = 'VALUES'", (1, 2, 3, 4))]
+    asyncio.run(db.execute_values("INSERT INTO t VALUES %s", [(1, 2)]))
+    assert sent[-1] == ("INSERT INTO t VALUES (%s, %s)", (1, 2))
+
+
+def test_execute_values_rejects_other_placeholders():
+    db = client()
+    with pytest.raises(ValueError):
+        asyncio.run(db.execute_values("UPDATE t SET a = %s FROM (VALUES %s) AS v (a)", [(1,)]))
+    assert asyncio.run(db.execute_values("INSERT INTO t VALUES %s", [])) == []
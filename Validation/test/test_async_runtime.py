@@ -0,0 +1,31 @@
+import asyncio
+import threading
+from Config import AsyncRuntime
+
+
+def test_racing_threads_share_one_executor():
+    AsyncRuntime.shutdown(executors=["race"])
+    barrier = threading.Barrier(16)
+    found = []
+
+    def get():
+        barrier.wait()
+        found.append(AsyncRuntime._get_executor("race"))
+
+    threads = [threading.Thread(target=get) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    try:
+        assert all(executor is found[0] for executor in found)
+    finally:
+        AsyncRuntime.shutdown(executors=["race"])
+
+
+def test_run_blocking_runs_off_the_loop():
+    async def main():
+        return await AsyncRuntime.run_blocking(threading.current_thread), threading.current_thread()
+
+    worker, loop_thread = asyncio.run(main())
+    assert worker is not loop_thread and worker.name.startswith("async-io")
@@ -0,0 +1,169 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from Data.Repositories.CompletionWriter import AsyncCompletionWriter, CompletionWriter
+from Processors.AssessmentGeneration import AssessmentGeneration
+
+QUERY = "UPDATE ... FROM (VALUES %s) ... RETURNING t.organization_id, t.s3_output_key;"
+TEMPLATE = "(%s, %s, %s)"
+
+
+class FakeDB:
+    """ Matches the rows whose s3_output_key is in existing, RETURNING an int organization_id like Postgres """
+    def __init__(self, existing=None, error=None, as_dict=False):
+        self.existing = set(existing or [])
+        self.error = error
+        self.as_dict = as_dict
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def returning(self, rows):
+        matched = [(int(row[1]), row[2]) for row in rows if row[2] in self.existing]
+        if self.as_dict:
+            return [{"organization_id": org, "s3_output_key": key} for org, key in matched]
+        return matched
+
+    def execute_values(self, query, rows, template, **kw):
+        with self.lock:
+            self.calls.append(list(rows))
+        if self.error:
+            raise self.error
+        return self.returning(rows)
+
+
+class AsyncFakeDB(FakeDB):
+    async def execute_values(self, query, rows, template, **kw):
+        return FakeDB.execute_values(self, query, rows, template)
+
+
+def write_all(writer, rows):
+    with ThreadPoolExecutor(len(rows)) as pool:
+        futures = [pool.submit(writer.write, QUERY, TEMPLATE, (org, key), (value, org, key)) for value, org, key in rows]
+        return [future.exception() or future.result() for future in futures]
+
+
+def test_rows_are_written_in_one_batch():
+    db = FakeDB(existing={"a", "b", "c"})
+    writer = CompletionWriter(db, batch_size=3, flush_ms=5000)
+    assert write_all(writer, [("x", 1, "a"), ("y", 1, "b"), ("z", 2, "c")]) == [1, 1, 1]
+    assert len(db.calls) == 1 and len(db.calls[0]) == 3
+
+
+def test_same_key_is_coalesced_and_every_waiter_answered():
+    db = FakeDB(existing={"a"})
+    writer = CompletionWriter(db, batch_size=2, flush_ms=5000)
+    assert write_all(writer, [("first", 1, "a"), ("second", 1, "a")]) == [1, 1]
+    assert len(db.calls) == 1 and len(db.calls[0]) == 1
+    assert db.calls[0][0][0] in ("first", "second")
+
+
+@pytest.mark.parametrize("as_dict", [False, True])
+def test_key_types_are_normalised(as_dict):
+    # organization_id arrives as a str from the message, RETURNING gives it back as an int
+    db = FakeDB(existing={"a"}, as_dict=as_dict)
+    writer = CompletionWriter(db, batch_size=1, flush_ms=0)
+    assert writer.write(QUERY, TEMPLATE, ("1", "a"), ("x", "1", "a")) == 1
+
+
+def test_unmatched_row_returns_zero():
+    db = FakeDB(existing={"a"})
+    writer = CompletionWriter(db, batch_size=2, flush_ms=5000)
+    assert write_all(writer, [("x", 1, "a"), ("y", 1, "missing")]) == [1, 0]
+
+
+def test_flush_error_reaches_every_waiter():
+    db = FakeDB(error=RuntimeError("connection lost"))
+    writer = CompletionWriter(db, batch_size=2, flush_ms=5000)
+    results = write_all(writer, [("x", 1, "a"), ("y", 1, "b")])
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def run_async(writer, rows):
+    async def main():
+        return await asyncio.gather(
+            *(writer.write(QUERY, TEMPLATE, (org, key), (value, org, key)) for value, org, key in rows),
+            return_exceptions=True
+        )
+    return asyncio.run(main())
+
+
+def test_async_batching_coalescing_and_normalisation():
+    db = AsyncFakeDB(existing={"a", "b"})
+    writer = AsyncCompletionWriter(db, batch_size=10, flush_ms=5)
+    assert run_async(writer, [("x", "1", "a"), ("y", 1, "a"), ("z", 2, "b"), ("w", 2, "missing")]) == [1, 1, 1, 0]
+    assert len(db.calls) == 1 and len(db.calls[0]) == 3
+
+
+def test_async_flush_error_reaches_every_waiter():
+    db = AsyncFakeDB(error=RuntimeError("connection lost"))
+    writer = AsyncCompletionWriter(db, batch_size=2, flush_ms=5000)
+    results = run_async(writer, [("x", 1, "a"), ("y", 1, "b")])
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+class Repo:
+    def __init__(self, updated):
+        self.updated = updated
+
+    def complete_aquestion_by_input_key(self, params):
+        return self.updated
+
+
+def test_save_fails_when_the_task_row_was_not_updated():
+    usage = {"input_tokens": 1, "output_tokens": 2}
+    task = {"s3_output_key": "a"}
+    assert AssessmentGeneration(1, task, Repo(1))._save_generation_results({"questions": []}, usage)
+    assert not AssessmentGeneration(1, task, Repo(0))._save_generation_results({"questions": []}, usage)
+
+
+def test_rows_expired_while_queued_are_not_written():
+    db = FakeDB(existing={"a", "b"})
+    writer = CompletionWriter(db, batch_size=2, flush_ms=5000)
+    expired, live = threading.Event(), threading.Event()
+    expired.set()
+    with ThreadPoolExecutor(2) as pool:
+        dropped = pool.submit(writer.write, QUERY, TEMPLATE, (1, "a"), ("x", 1, "a"), expired)
+        written = pool.submit(writer.write, QUERY, TEMPLATE, (1, "b"), ("y", 1, "b"), live)
+        assert isinstance(dropped.exception(timeout=5), RuntimeError)
+        assert written.result(timeout=5) == 1
+    assert db.calls == [[("y", 1, "b")]]
+
+
+def test_async_rows_expired_while_queued_are_not_written():
+    db = AsyncFakeDB(existing={"a"})
+    writer = AsyncCompletionWriter(db, batch_size=10, flush_ms=5)
+    expired = threading.Event()
+    expired.set()
+
+    async def main():
+        return await asyncio.gather(writer.write(QUERY, TEMPLATE, (1, "a"), ("x", 1, "a"), expired), return_exceptions=True)
+
+    assert isinstance(asyncio.run(main())[0], RuntimeError)
+    assert db.calls == []
+
+
+def test_write_times_out_when_the_flush_never_returns(monkeypatch):
+    monkeypatch.setenv("COMPLETION_WRITE_TIMEOUT", "0.1")
+    release = threading.Event()
+
+    class StuckDB(FakeDB):
+        def execute_values(self, query, rows, template, **kw):
+            release.wait(5)
+            return []
+
+    writer = CompletionWriter(StuckDB(), batch_size=1, flush_ms=0)
+    try:
+        with pytest.raises(TimeoutError):
+            writer.write(QUERY, TEMPLATE, (1, "a"), ("x", 1, "a"))
+    finally:
+        release.set()
+
+
+def test_dead_writer_thread_is_restarted():
+    db = FakeDB(existing={"a"})
+    writer = CompletionWriter(db, batch_size=1, flush_ms=0)
+    writer._thread = threading.Thread(target=lambda: None)
+    writer._thread.start()
+    writer._thread.join()
+    assert writer.write(QUERY, TEMPLATE, (1, "a"), ("x", 1, "a")) == 1
@@ -0,0 +1,71 @@
+import asyncio
+import time
+import pytest
+from Models.Hedging import Hedger, LatencyTracker, latency_key
+
+
+def hedger(threshold=None):
+    hedger = Hedger()
+    hedger.threshold = lambda key: threshold
+    return hedger
+
+
+@pytest.mark.parametrize("max_tokens, size", [(None, "any"), (500, "1k"), (1024, "1k"), (1025, "2k"), (6000, "8k"), (20000, "32k")])
+def test_latency_key_buckets_the_output_budget(max_tokens, size):
+    prompt_data = {"model": "amazon", "template": "Identity_questions", "max_tokens": max_tokens}
+    assert latency_key(prompt_data) == f"AMAZON:Identity_questions:{size}"
+
+
+def test_tracker_keeps_one_window_per_key():
+    tracker = LatencyTracker(window=10, min_samples=3)
+    for _ in range(3):
+        tracker.record("GOOGLE:Identity_questions:1k", 1.0)
+        tracker.record("GOOGLE:Identity_materials:32k", 30.0)
+    assert tracker.percentile("GOOGLE:Identity_questions:1k", 95) == 1.0
+    assert tracker.percentile("GOOGLE:Identity_materials:32k", 95) == 30.0
+    assert tracker.percentile("GOOGLE:other:1k", 95) is None
+
+
+def test_fast_primary_is_not_hedged():
+    calls = []
+    result = hedger(1.0).call("p", lambda: ("m", "primary", {}), "h", lambda: calls.append(1) or ("m", "hedge", {}))
+    assert result[1] == "primary" and calls == []
+
+
+def test_slow_primary_is_hedged():
+    def slow():
+        time.sleep(0.5)
+        return "m", "primary", {}
+
+    assert hedger(0.05).call("p", slow, "h", lambda: ("m", "hedge", {}))[1] == "hedge"
+
+
+def test_provider_timeout_is_raised_not_hedged():
+    def timeout():
+        raise TimeoutError("read timeout")
+
+    with pytest.raises(TimeoutError):
+        hedger(1.0).call("p", timeout, "h", lambda: ("m", "hedge", {}))
+
+
+def test_cancelled_caller_cancels_both_attempts():
+    started = []
+
+    def attempt(name):
+        async def run():
+            started.append(name)
+            await asyncio.sleep(10)
+            return "m", name, {}
+        return run
+
+    async def main():
+        call = asyncio.ensure_future(hedger(0.01).call_async("p", attempt("primary"), "h", attempt("hedge")))
+        await asyncio.sleep(0.1)
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+        await asyncio.sleep(0)
+        return [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    assert asyncio.run(main()) == []
+    assert started == ["primary", "hedge"]
@@ -0,0 +1,109 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import pytest
+import main
+from Data.Repositories.BusinessRepository import BusinessRepository
+
+
+class Context:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+class FakeSQS:
+    def __init__(self):
+        self.deleted = []
+
+    def delete_sqs_message(self, receipt_handle, queue_url=None):
+        self.deleted.append(receipt_handle)
+
+
+def record(number, behaviour):
+    return {"messageId": f"m{number}", "receiptHandle": f"r{number}", "body": json.dumps({"behaviour": behaviour})}
+
+
+@pytest.fixture
+def handler(monkeypatch):
+    """ lambda_handler with handle_message driven by each record's body """
+    sqs = FakeSQS()
+    repositories = []
+    running = []
+    lock = threading.Lock()
+
+    def handle_message(msg, repository):
+        behaviour = json.loads(msg["Body"])["behaviour"]
+        with lock:
+            running.append(msg["MessageId"])
+        if behaviour == "slow":
+            time.sleep(0.5)
+            # a stale worker trying to persist after the deadline is refused
+            repository._check_writable()
+        if behaviour == "raise":
+            raise RuntimeError("boom")
+        return behaviour != "fail"
+
+    def batch_repository(bodies):
+        repository = BusinessRepository(None)
+        repositories.append(repository)
+        return repository
+
+    monkeypatch.setattr(main, "handle_message", handle_message)
+    monkeypatch.setattr(main, "batch_repository", batch_repository)
+    monkeypatch.setattr(main, "get_db", lambda: None)
+    monkeypatch.setattr(main, "get_sqs", lambda: sqs)
+    monkeypatch.setattr(main, "polling_pause", lambda: 0)
+    executor = ThreadPoolExecutor(4)
+    monkeypatch.setattr(main, "record_executor", executor)
+    monkeypatch.setenv("LAMBDA_DEADLINE_MARGIN_MS", "0")
+    yield SimpleNamespace(sqs=sqs, repositories=repositories, running=running)
+    executor.shutdown(wait=True)
+
+
+def outcomes(result):
+    return json.loads(result["body"])["outcomes"], sorted(item["itemIdentifier"] for item in result["batchItemFailures"])
+
+
+def test_only_unsuccessful_records_are_reported(handler):
+    records = [record(1, "ok"), record(2, "fail"), record(3, "raise"), record(4, "ok")]
+    counts, failures = outcomes(main.lambda_handler({"Records": records}, Context(60000)))
+    assert counts["succeeded"] == 2 and counts["failed"] == 1 and counts["errored"] == 1
+    assert failures == ["m2", "m3"]
+    assert sorted(handler.sqs.deleted) == ["r1", "r4"]
+
+
+def test_records_run_concurrently(handler):
+    records = [record(number, "slow") for number in range(4)]
+    started = time.monotonic()
+    counts, failures = outcomes(main.lambda_handler({"Records": records}, Context(60000)))
+    assert counts["succeeded"] == 4 and failures == []
+    assert time.monotonic() - started < 1.5
+
+
+def test_records_past_the_deadline_are_not_acknowledged(handler):
+    records = [record(1, "ok"), record(2, "slow")]
+    counts, failures = outcomes(main.lambda_handler({"Records": records}, Context(200)))
+    assert counts["succeeded"] == 1 and counts["timed_out"] == 1
+    assert failures == ["m2"]
+    assert handler.repositories[0].expired.is_set()
+    time.sleep(0.6)
+    # the slow worker finished after the deadline, it must neither write nor acknowledge
+    assert handler.sqs.deleted == ["r1"]
+
+
+def test_short_budget_still_starts_records(handler, monkeypatch):
+    # LAMBDA_MIN_RECORD_MS longer than the whole budget is clamped to a share of it
+    monkeypatch.setenv("LAMBDA_MIN_RECORD_MS", "120000")
+    counts, failures = outcomes(main.lambda_handler({"Records": [record(1, "ok")]}, Context(5000)))
+    assert counts["succeeded"] == 1 and counts["unprocessed"] == 0
+
+
+def test_warmup_ping(handler):
+    result = main.lambda_handler({"warmup": True}, None)
+    assert json.loads(result["body"]) == {"warmup": True}
+    assert handler.running == []
@@ -0,0 +1,29 @@
+import json
+import pytest
+from Validation.ParseClient import ParseClient
+
+
+def body(generate_type, organization_id, **task):
+    section = "generate_materials" if generate_type == "generate_materials" else "generate_questions"
+    return json.dumps({"task": "x", "body": {"generate_type": generate_type, "organization_id": organization_id, section: task}})
+
+
+@pytest.mark.parametrize("organization_id, district_id", [(12, 3), ("12", "3"), ("12", 3)])
+def test_context_key_matches_the_parsed_message(organization_id, district_id):
+    assert ParseClient(body("generate_questions", organization_id, district_id=district_id)).context_key() == ("district", 12, 3)
+
+
+def test_context_key_for_materials():
+    assert ParseClient(body("generate_materials", "7", assessment_id="41")).context_key() == ("assessments", 7, 41)
+    assert ParseClient(body("generate_questions_do_materials", 7, district_id=2)).context_key() == ("district", 7, 2)
+
+
+@pytest.mark.parametrize("text", [
+    body("generate_materials", 7),
+    body("generate_questions", "abc", district_id=1),
+    body("warmup", 7),
+    "not json",
+    json.dumps([1, 2]),
+])
+def test_context_key_none_when_unusable(text):
+    assert ParseClient(text).context_key() is None
@@ -0,0 +1,133 @@
+import time
+import uuid
+import asyncio
+from pydantic import BaseModel
+from Processors.Pipeline import GenerationPipeline
+
+
+class Result(BaseModel):
+    text: str
+
+
+class FakeProcessor:
+    """ Duck-typed processor, needs_repair makes validation hand back a salvage that must be repaired """
+    validator_class = Result
+
+    def __init__(self, prompt: str, needs_repair: bool = False, context_delay: float = 0, validate_delay: float = 0, invoke_delay: float = 0):
+        self.organization_id = 1
+        self.prompt = prompt
+        self.needs_repair = needs_repair
+        self.context_delay = context_delay
+        self.validate_delay = validate_delay
+        self.invoke_delay = invoke_delay
+        self.provider_calls = 0
+        self.saved = None
+
+    def _fetch_context(self):
+        time.sleep(self.context_delay)
+        return {}
+
+    async def _fetch_context_async(self):
+        await asyncio.sleep(self.context_delay)
+        return {}
+
+    def _build_outline_config(self, context):
+        return None
+
+    def _build_prompt_chunks(self, context):
+        return None
+
+    def _build_prompt_config(self, context):
+        return object()
+
+    def _build_prompt_data(self, prompt_config):
+        return {"model": "GOOGLE", "messages": [{"role": "user", "content": self.prompt}]}
+
+    def _invoke_raw(self, prompt_data):
+        self.provider_calls += 1
+        return "model", "raw", {"total_tokens": 1}
+
+    async def _invoke_raw_async(self, prompt_data):
+        await asyncio.sleep(self.invoke_delay)
+        return self._invoke_raw(prompt_data)
+
+    def _validate_or_partial(self, llm_model, raw, usage):
+        time.sleep(self.validate_delay)
+        if self.needs_repair:
+            return None, usage, "partial"
+        return {"text": self.prompt}, usage, None
+
+    def _invoke_repair(self, llm_model, partial):
+        self.provider_calls += 1
+        return "model", "repair", {"total_tokens": 1}
+
+    async def _invoke_repair_async(self, llm_model, partial):
+        return self._invoke_repair(llm_model, partial)
+
+    def _apply_repair(self, llm_model, partial, usage, repair):
+        return {"text": self.prompt + " repaired"}, usage
+
+    def _save_generation_results(self, result, usage):
+        self.saved = result
+        return True
+
+    async def _save_generation_results_async(self, result, usage):
+        return self._save_generation_results(result, usage)
+
+
+def test_jobs_run_through_every_stage():
+    pipeline = GenerationPipeline({"invoke": 2})
+    processors = [FakeProcessor(str(uuid.uuid4())) for _ in range(5)]
+    futures = [pipeline.submit(processor) for processor in processors]
+    assert [future.result(timeout=5) for future in futures] == [True] * 5
+    assert all(processor.saved == {"text": processor.prompt} for processor in processors)
+
+
+def test_identical_requests_are_coalesced():
+    prompt = str(uuid.uuid4())
+    pipeline = GenerationPipeline({"invoke": 4})
+    leader = FakeProcessor(prompt, validate_delay=0.2)
+    followers = [FakeProcessor(prompt, context_delay=0.05) for _ in range(3)]
+    futures = [pipeline.submit(processor) for processor in [leader] + followers]
+    assert all(future.result(timeout=5) for future in futures)
+    assert leader.provider_calls == 1 and sum(follower.provider_calls for follower in followers) == 0
+    assert all(follower.saved == {"text": prompt} for follower in followers)
+
+
+def test_leader_repair_is_not_starved_by_waiting_followers(monkeypatch):
+    # the only invoke slot is held by a follower waiting on the leader, the repair must still run
+    monkeypatch.setenv("RESPONSE_CACHE_FLIGHT_WAIT", "60")
+    prompt = str(uuid.uuid4())
+    pipeline = GenerationPipeline({"invoke": 1})
+    leader = FakeProcessor(prompt, needs_repair=True, validate_delay=0.2)
+    follower = FakeProcessor(prompt, context_delay=0.05)
+    futures = [pipeline.submit(leader), pipeline.submit(follower)]
+    assert [future.result(timeout=5) for future in futures] == [True, True]
+    assert follower.saved == {"text": prompt + " repaired"}
+    assert follower.provider_calls == 0
+
+
+def test_follower_calls_on_its_own_after_the_flight_wait(monkeypatch):
+    monkeypatch.setenv("RESPONSE_CACHE_FLIGHT_WAIT", "0.05")
+    prompt = str(uuid.uuid4())
+    pipeline = GenerationPipeline({"invoke": 2})
+    leader = FakeProcessor(prompt, validate_delay=0.5)
+    follower = FakeProcessor(prompt, context_delay=0.05)
+    futures = [pipeline.submit(leader), pipeline.submit(follower)]
+    assert [future.result(timeout=5) for future in futures] == [True, True]
+    assert follower.provider_calls == 1
+
+
+def test_async_leader_repair_is_not_starved(monkeypatch):
+    monkeypatch.setenv("RESPONSE_CACHE_FLIGHT_WAIT", "60")
+    prompt = str(uuid.uuid4())
+    pipeline = GenerationPipeline({"invoke": 1})
+    # the follower takes the invoke semaphore as soon as the leader's first call releases it
+    leader = FakeProcessor(prompt, needs_repair=True, invoke_delay=0.1)
+    follower = FakeProcessor(prompt, context_delay=0.05)
+
+    async def run():
+        return await asyncio.wait_for(asyncio.gather(pipeline.run_async(leader), pipeline.run_async(follower)), 5)
+
+    assert asyncio.run(run()) == [True, True]
+    assert follower.saved == {"text": prompt + " repaired"}
@@ -0,0 +1,169 @@
+import threading
+import time
+import psycopg2
+import pytest
+from Config import PostgreSQL
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def close(self):
+        pass
+
+    def execute(self, query, params=None):
+        self.conn.log.append((self.conn.number, query))
+        if self.conn.broken:
+            self.conn.closed = 2
+            raise psycopg2.OperationalError("server closed the connection")
+        time.sleep(self.conn.delay)
+
+    def fetchone(self):
+        return {"x": 1}
+
+
+class FakeConnection:
+    def __init__(self, number, log, delay):
+        self.number = number
+        self.log = log
+        self.delay = delay
+        self.closed = 0
+        self.autocommit = False
+        self.broken = False
+
+    def cursor(self, cursor_factory=None):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.log.append((self.number, "commit"))
+
+    def rollback(self):
+        pass
+
+
+class FakePool:
+    """ ThreadedConnectionPool stand-in that fails like psycopg2 when maxconn are checked out """
+
+    def __init__(self, minconn, maxconn, **kwargs):
+        self.maxconn = maxconn
+        self.free = []
+        self.used = 0
+        self.created = 0
+        self.log = []
+        self.delay = 0
+        self.closed_all = False
+
+    def getconn(self):
+        if self.used >= self.maxconn:
+            raise psycopg2.pool.PoolError("connection pool exhausted")
+        self.used += 1
+        if self.free:
+            return self.free.pop()
+        self.created += 1
+        return FakeConnection(self.created, self.log, self.delay)
+
+    def putconn(self, conn, close=False):
+        self.used -= 1
+        if not close:
+            self.free.append(conn)
+
+    def closeall(self):
+        self.closed_all = True
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setenv("POSTGRES_MAX_CONN", "2")
+    monkeypatch.setenv("POSTGRES_VALIDATE_IDLE_SECONDS", "300")
+    monkeypatch.setattr(PostgreSQL.pool, "ThreadedConnectionPool", FakePool)
+    PostgreSQL.PostgresClient.close_pool()
+    yield PostgreSQL.PostgresClient()
+    PostgreSQL.PostgresClient.close_pool()
+
+
+def shared_pool():
+    return PostgreSQL.PostgresClient._pool
+
+
+def test_more_threads_than_connections_wait_instead_of_failing(db):
+    shared_pool().delay = 0.02
+    errors = []
+
+    def query():
+        try:
+            db.fetch_one("SELECT x")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=query) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert shared_pool().created <= 2 and shared_pool().used == 0
+    assert PostgreSQL.PostgresClient._in_use == 0
+
+
+def test_lease_times_out_when_no_connection_frees_up(db, monkeypatch):
+    monkeypatch.setenv("POSTGRES_POOL_TIMEOUT", "0.05")
+    with db._lease(), db._lease():
+        with pytest.raises(RuntimeError, match="POSTGRES_POOL_TIMEOUT"):
+            with db._lease():
+                pass
+    with db._lease() as conn:
+        assert conn.closed == 0
+
+
+def test_idle_connections_are_pinged_before_reuse(db, monkeypatch):
+    db.fetch_one("SELECT x")
+    monkeypatch.setenv("POSTGRES_VALIDATE_IDLE_SECONDS", "0")
+    shared_pool().log.clear()
+    db.fetch_one("SELECT y")
+    assert [query for _, query in shared_pool().log] == ["SELECT 1", "SELECT y"]
+
+
+def test_idempotent_statement_is_retried_on_a_fresh_connection(db):
+    db.fetch_one("SELECT x")
+    broken = shared_pool().free[-1]
+    broken.broken = True
+    assert db.fetch_one("SELECT r", idempotent=True) == {"x": 1}
+    assert [conn for conn, query in shared_pool().log if query == "SELECT r"] == [broken.number, broken.number + 1]
+    assert broken not in shared_pool().free and shared_pool().used == 0
+
+
+def test_non_idempotent_statement_is_not_repeated(db):
+    db.fetch_one("SELECT x")
+    shared_pool().free[-1].broken = True
+    shared_pool().log.clear()
+    with pytest.raises(RuntimeError, match="Database command failed"):
+        db.execute_res("UPDATE counter SET n = n + 1")
+    assert sum(1 for _, query in shared_pool().log if query.startswith("UPDATE")) == 1
+    assert shared_pool().used == 0
+
+
+def test_transaction_commits_and_restores_autocommit(db):
+    with db._get_cursor_transaction() as cursor:
+        cursor.execute("INSERT")
+    conn = shared_pool().free[-1]
+    assert shared_pool().log[-2:] == [(conn.number, "INSERT"), (conn.number, "commit")]
+    assert conn.autocommit is True
+
+
+def test_close_pool_resets_state_and_next_use_reopens(db):
+    closing = shared_pool()
+    db.fetch_one("SELECT x")
+    PostgreSQL.PostgresClient.close_pool()
+    assert closing.closed_all
+    assert PostgreSQL.PostgresClient._pool is None and PostgreSQL.PostgresClient._slots is None
+    assert PostgreSQL.PostgresClient._last_used == {}
+    assert db.fetch_one("SELECT again") == {"x": 1}
+    assert shared_pool() is not closing
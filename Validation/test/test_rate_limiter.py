@@ -0,0 +1,67 @@
+import threading
+import pytest
+from Models.RateLimiter import PostgresTokenBucket, RateLimiter, TokenBucket
+
+
+class FakeBucketDB:
+    """ One llm_rate_limit table in a dict, without refill """
+    def __init__(self):
+        self.rows = {}
+        self.upserts = 0
+        self.lose_upserts = False
+
+    def execute(self, query, params, **kw):
+        self.upserts += 1
+        key, tokens, capacity, _ = params
+        if not self.lose_upserts:
+            self.rows.setdefault(key, {"tokens": tokens})
+
+    def fetch_one(self, query, params, **kw):
+        amount, key = params
+        if key not in self.rows:
+            return None
+        self.rows[key]["tokens"] -= amount
+        return dict(self.rows[key])
+
+
+def test_token_bucket_waits_once_empty():
+    bucket = TokenBucket(60)
+    assert bucket.reserve(60) == 0
+    assert bucket.reserve(30) == pytest.approx(30, abs=0.1)
+    bucket.refund(30)
+    assert bucket.reserve(1) == pytest.approx(1, abs=0.1)
+
+
+def test_postgres_bucket_recreates_a_missing_row():
+    db = FakeBucketDB()
+    bucket = PostgresTokenBucket("gemini:rpm", 60, db)
+    db.rows.clear()
+    assert bucket.reserve(1) == 0
+    assert db.upserts == 2
+
+
+def test_postgres_bucket_raises_a_clear_error():
+    db = FakeBucketDB()
+    bucket = PostgresTokenBucket("gemini:rpm", 60, db)
+    db.rows.clear()
+    db.lose_upserts = True
+    with pytest.raises(RuntimeError, match="gemini:rpm"):
+        bucket.reserve(1)
+
+
+def test_limiter_is_built_once_per_model():
+    limiter = RateLimiter({"gemini": {"rpm": 60}}, backend="memory")
+    barrier = threading.Barrier(8)
+    found = []
+
+    def get():
+        barrier.wait()
+        found.append(limiter._limiter("gemini:flash"))
+
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(item is found[0] for item in found)
+    assert limiter._limiter("amazon:titan") is None
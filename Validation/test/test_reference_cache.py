@@ -0,0 +1,38 @@
+import time
+from Config.LRUCache import TTLCache
+from Data.Repositories.ReferenceCache import ReferenceCache
+
+
+def test_uncached_does_not_count_as_lookups():
+    cache = ReferenceCache(16, 60)
+    cache.put("district", (1, 2), {"name": "D"})
+    cache.put("subjects", (1, 2), {"title": "T"})
+    keys = [("district", 1, 2), ("district", 1, 3), ("assessments", 1, 4)]
+    assert cache.uncached(keys) == [("district", 1, 3), ("assessments", 1, 4)]
+    assert cache.cache.stats()["hits"] == 0 and cache.cache.stats()["misses"] == 0
+
+
+def test_district_needs_its_subjects_row():
+    cache = ReferenceCache(16, 60)
+    cache.put("district", (1, 2), {"name": "D"})
+    assert cache.uncached([("district", 1, 2)]) == [("district", 1, 2)]
+
+
+def test_read_through_counts_hits_and_copies():
+    cache = ReferenceCache(16, 60)
+    loads = []
+    load = lambda: loads.append(1) or {"name": "D"}
+    first = cache.read_through("district", (1, 2), load)
+    first["name"] = "edited"
+    assert cache.read_through("district", (1, 2), load) == {"name": "D"}
+    assert len(loads) == 1
+    assert cache.cache.stats()["hits"] == 1 and cache.cache.stats()["misses"] == 1
+
+
+def test_contains_respects_ttl_without_stats():
+    cache = TTLCache(4, 0.05)
+    cache.set("k", 1)
+    assert "k" in cache
+    time.sleep(0.06)
+    assert "k" not in cache
+    assert cache.stats()["hits"] == 0 and cache.stats()["misses"] == 0
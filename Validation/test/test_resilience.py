@@ -0,0 +1,116 @@
+import asyncio
+import time
+import uuid
+import pytest
+from Models.Resilience import (
+    CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, call_with_retry, call_with_retry_async,
+    get_breaker, is_retryable, provider_chain, should_fail_over
+)
+
+
+class ClientError(Exception):
+    def __init__(self, code, status=400):
+        self.response = {"Error": {"Code": code}, "ResponseMetadata": {"HTTPStatusCode": status}}
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setenv("LLM_RETRY_BASE_SECONDS", "0")
+    monkeypatch.setenv("LLM_RETRY_ATTEMPTS", "3")
+
+
+def provider():
+    return f"TEST-{uuid.uuid4()}"
+
+
+@pytest.mark.parametrize("exc, retryable", [
+    (TimeoutError(), True),
+    (ConnectionResetError(), True),
+    (ClientError("ThrottlingException"), True),
+    (ClientError("Other", 503), True),
+    (ClientError("Other", 429), True),
+    (ClientError("ValidationException"), False),
+    (ValueError("bad json"), False),
+])
+def test_is_retryable(exc, retryable):
+    assert is_retryable(exc) is retryable
+
+
+def test_retries_transient_errors_then_succeeds():
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ClientError("ThrottlingException")
+        return "ok"
+
+    name = provider()
+    assert call_with_retry(name, fn) == "ok"
+    assert len(calls) == 3 and get_breaker(name).state == CLOSED
+
+
+def test_permanent_error_is_not_retried():
+    calls = []
+
+    def fn():
+        calls.append(1)
+        raise ClientError("ValidationException")
+
+    with pytest.raises(ClientError):
+        call_with_retry(provider(), fn)
+    assert len(calls) == 1
+
+
+def test_breaker_opens_and_lets_one_probe_through():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0.05)
+    breaker.allow()
+    breaker.record_failure()
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    time.sleep(0.06)
+    breaker.allow()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    breaker.allow()
+
+
+def test_failed_probe_reopens():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN and breaker.retry_in() > 0
+
+
+def test_open_circuit_fails_over(monkeypatch):
+    assert provider_chain("GOOGLE") == ["GOOGLE"]
+    monkeypatch.setenv("MODEL_FAILOVER", "true")
+    assert provider_chain("GOOGLE") == ["GOOGLE", "AMAZON"]
+    assert should_fail_over(CircuitOpenError("GOOGLE", 1))
+    assert not should_fail_over(ClientError("ValidationException"))
+
+
+def test_async_cancel_releases_the_probe():
+    name = provider()
+    breaker = get_breaker(name)
+    breaker.state, breaker.opened_at = OPEN, 0.0
+
+    async def main():
+        task = asyncio.ensure_future(call_with_retry_async(name, lambda: asyncio.sleep(10)))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    # the cancelled probe says nothing about the provider, the next call may probe again
+    breaker.allow()
+    assert breaker.state == HALF_OPEN
@@ -0,0 +1,64 @@
+import threading
+from Models.ResponseCache import DiskCacheTier, ResponseCache
+
+
+def test_disk_tier_round_trip(tmp_path):
+    tier = DiskCacheTier(str(tmp_path), 60, 1 << 20)
+    tier.put("k", {"a": 1}, {"total_tokens": 3})
+    assert tier.get("k") == ({"a": 1}, {"total_tokens": 3})
+    assert tier.get("missing") is None
+    assert list(tmp_path.glob("*.tmp")) == []
+
+
+def test_disk_tier_does_not_scan_on_every_put(tmp_path, monkeypatch):
+    tier = DiskCacheTier(str(tmp_path), 60, 1 << 20)
+    scans = []
+    evict = tier._evict
+    monkeypatch.setattr(tier, "_evict", lambda: scans.append(1) or evict())
+    for index in range(50):
+        tier.put(f"k{index}", {"a": index}, {})
+    # the first put learns the directory size, the rest are tracked
+    assert len(scans) == 1
+    assert tier._bytes == sum(path.stat().st_size for path in tmp_path.glob("*.json"))
+
+
+def test_disk_tier_evicts_oldest_past_max_bytes(tmp_path):
+    tier = DiskCacheTier(str(tmp_path), 60, 300)
+    for index in range(20):
+        tier.put(f"k{index:02}", {"text": "x" * 40}, {})
+    total = sum(path.stat().st_size for path in tmp_path.glob("*.json"))
+    assert total <= 300
+    assert tier.get("k19") is not None
+
+
+def test_disk_tier_concurrent_puts_of_one_key(tmp_path):
+    tier = DiskCacheTier(str(tmp_path), 60, 1 << 20)
+    barrier = threading.Barrier(8)
+    errors = []
+
+    def put(index):
+        barrier.wait()
+        try:
+            tier.put("same", {"writer": index, "pad": "x" * 1000 * index}, {})
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=put, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    result, _ = tier.get("same")
+    assert result["pad"] == "x" * 1000 * result["writer"]
+    assert list(tmp_path.glob("*.tmp")) == []
+
+
+def test_single_flight():
+    cache = ResponseCache("memory")
+    leader, flight = cache.begin("k")
+    follower, same = cache.begin("k")
+    assert leader and not follower and flight is same
+    cache.finish("k", {"a": 1}, {})
+    assert same.result(timeout=1) == ({"a": 1}, {})
+    assert cache.get("k") == ({"a": 1}, {})
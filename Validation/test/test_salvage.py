@@ -0,0 +1,132 @@
+import json
+from typing import List
+from pydantic import BaseModel
+from Validation.Salvage import close_truncated, salvage
+
+
+class Item(BaseModel):
+    text: str
+    tags: List[str] = []
+    order_number: int
+
+
+class Document(BaseModel):
+    title: str
+    items: List[Item]
+
+
+class TwoLists(BaseModel):
+    items: List[Item]
+    extras: List[Item]
+
+
+def item(text, number, tags=None):
+    return {"text": text, "tags": tags or [], "order_number": number}
+
+
+def test_close_truncated_complete_document():
+    text = 'Sure: {"title": "t", "items": []} trailing'
+    assert close_truncated(text) == ('{"title": "t", "items": []}', False)
+
+
+def test_close_truncated_no_document():
+    assert close_truncated("no json here") == (None, False)
+
+
+def test_close_truncated_mismatched_brackets():
+    assert close_truncated('{"items": [}') == (None, False)
+
+
+def test_close_truncated_drops_half_written_item():
+    text = '{"title": "t", "items": [{"text": "a", "order_number": 1}, {"text": "b", "ord'
+    document, truncated = close_truncated(text)
+    assert truncated
+    assert json.loads(document) == {"title": "t", "items": [{"text": "a", "order_number": 1}]}
+
+
+def test_close_truncated_inside_string_with_brackets():
+    text = '{"title": "t", "items": [{"text": "a", "order_number": 1}, {"text": "has ], { and , in'
+    document, truncated = close_truncated(text)
+    assert truncated
+    assert json.loads(document)["items"] == [{"text": "a", "order_number": 1}]
+
+
+def test_close_truncated_escaped_quotes():
+    text = '{"title": "say \\"hi\\", {x}", "items": [{"text": "\\\\", "order_number": 1}, {"text": "\\"'
+    document, truncated = close_truncated(text)
+    assert truncated
+    data = json.loads(document)
+    assert data["title"] == 'say "hi", {x}'
+    assert data["items"] == [{"text": "\\", "order_number": 1}]
+
+
+def test_close_truncated_nested_lists_cut_at_item_boundary():
+    text = '{"title": "t", "items": [{"text": "a", "tags": ["x", "y"], "order_number": 1}, {"text": "b", "tags": ["x", "y'
+    document, truncated = close_truncated(text)
+    assert truncated
+    assert json.loads(document)["items"] == [{"text": "a", "tags": ["x", "y"], "order_number": 1}]
+
+
+def test_close_truncated_nothing_complete():
+    assert close_truncated('{"title": "unfinished') == (None, True)
+
+
+def test_salvage_keeps_valid_items_and_counts_invalid():
+    text = json.dumps({"title": "t", "items": [item("a", 1), {"text": "no number"}, item("c", 3)]})
+    result = salvage(Document, text)
+    assert not result.truncated
+    assert result.kept == 2 and result.dropped == 1
+    assert result.items == {"items": 1}
+    assert result.fields == []
+
+
+def test_salvage_counts_items_lost_to_truncation():
+    text = '{"title": "t", "items": [' + json.dumps(item("a", 1)) + ', ' + json.dumps(item("b", 2)) + ', {"text": "c'
+    result = salvage(Document, text, expected_items=5)
+    assert result.truncated
+    assert result.kept == 2
+    assert result.items == {"items": 3}
+
+
+def test_salvage_expected_items_ignored_with_several_lists():
+    text = json.dumps({"items": [item("a", 1)], "extras": [item("b", 1)]})
+    result = salvage(TwoLists, text, expected_items=5)
+    assert result.complete
+
+
+def test_salvage_regenerates_missing_and_invalid_fields():
+    result = salvage(Document, json.dumps({"title": 7, "items": [item("a", 1)]}))
+    assert result.fields == ["title"]
+    result = salvage(Document, json.dumps({"items": [item("a", 1)]}))
+    assert result.fields == ["title"]
+    result = salvage(Document, json.dumps({"title": "t", "items": "oops"}))
+    assert result.fields == ["items"]
+
+
+def test_salvage_nothing_to_keep():
+    assert salvage(Document, json.dumps({"items": [{"text": "bad"}]})) is None
+    assert salvage(Document, "not json") is None
+    assert salvage(Document, "") is None
+    assert salvage(Document, '["a list"]') is None
+
+
+def test_merge_fills_gaps_and_renumbers():
+    text = json.dumps({"title": "t", "items": [item("a", 1), {"text": "bad"}, item("c", 3)]})
+    result = salvage(Document, text, expected_items=4)
+    assert result.items == {"items": 2}
+    merged = result.merge({"items": [item("x", 9), item("y", 9), item("extra", 9)]})
+    assert [i["text"] for i in merged["items"]] == ["a", "c", "x", "y"]
+    assert [i["order_number"] for i in merged["items"]] == [1, 2, 3, 4]
+    assert merged["title"] == "t"
+
+
+def test_merge_regenerated_field():
+    result = salvage(Document, json.dumps({"items": [item("a", 1)]}))
+    assert result.merge({"title": "new"})["title"] == "new"
+
+
+def test_repair_model_has_only_gaps():
+    result = salvage(Document, json.dumps({"title": "t", "items": [item("a", 1), {"text": "bad"}]}))
+    assert set(result.repair_model().model_fields) == {"items"}
+    assert result.repair_variables()["kept"] == {"items": ["a"]}
+
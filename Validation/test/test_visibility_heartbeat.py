@@ -0,0 +1,77 @@
+import threading
+import main
+from Config.VisibilityHeartbeat import VisibilityHeartbeat
+from Config.WorkerPool import WorkerPool
+
+
+class FakeSQSClient:
+    def __init__(self):
+        self.extended = []
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        self.extended.extend(entry["Id"] for entry in Entries)
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries]}
+
+
+class FakeSQS:
+    def __init__(self):
+        self.sqs = FakeSQSClient()
+        self.deleted = []
+
+    def delete_sqs_message(self, receipt_handle, queue_url=None):
+        self.deleted.append(receipt_handle)
+
+
+def message(number):
+    return {"MessageId": f"m{number}", "ReceiptHandle": f"r{number}", "Body": "{}"}
+
+
+def heartbeat(sqs, **kw):
+    return VisibilityHeartbeat(sqs, "queue", visibility_timeout=300, interval=60, **kw)
+
+
+def test_track_beat_and_done():
+    sqs = FakeSQS()
+    beat = heartbeat(sqs)
+    beat.track(message(1))
+    beat.track(message(2))
+    beat._beat()
+    assert sorted(sqs.sqs.extended) == ["m1", "m2"]
+    beat.done(message(1))
+    beat._beat()
+    assert sqs.sqs.extended.count("m1") == 1 and sqs.sqs.extended.count("m2") == 2
+
+
+def test_stops_extending_after_max_seconds():
+    sqs = FakeSQS()
+    beat = heartbeat(sqs, max_seconds=0.000001)
+    beat.track(message(1))
+    threading.Event().wait(0.01)
+    beat._beat()
+    assert sqs.sqs.extended == []
+
+
+def test_queued_messages_are_extended_before_a_worker_starts(monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+
+    def handle_message(msg, repository):
+        started.set()
+        release.wait(5)
+        return True
+
+    monkeypatch.setattr(main, "handle_message", handle_message)
+    sqs = FakeSQS()
+    beat = heartbeat(sqs)
+    pool = WorkerPool(workers=1, queue_depth=2)
+    try:
+        main.dispatch_messages(pool, sqs, [message(1), message(2), message(3)], beat)
+        assert started.wait(5)
+        # m2 and m3 wait in the executor queue behind m1, their visibility must still be extended
+        beat._beat()
+        assert sorted(sqs.sqs.extended) == ["m1", "m2", "m3"]
+    finally:
+        release.set()
+        pool.shutdown(wait=True)
+    assert sorted(sqs.deleted) == ["r1", "r2", "r3"]
+    assert beat._in_flight == {}
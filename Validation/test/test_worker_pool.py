@@ -0,0 +1,87 @@
+import threading
+import time
+from Config.WorkerPool import WorkerPool
+
+
+def blocked_pool(workers, queue_depth):
+    release = threading.Event()
+    pool = WorkerPool(workers=workers, queue_depth=queue_depth)
+    return pool, release
+
+
+def test_capacity_is_workers_plus_queue_depth():
+    pool = WorkerPool(workers=3, queue_depth=2)
+    try:
+        assert pool.capacity == 5 and pool.available() == 5
+    finally:
+        pool.shutdown()
+
+
+def test_env_defaults_and_invalid_values(monkeypatch):
+    monkeypatch.setenv("SQS_WORKERS", "2")
+    monkeypatch.setenv("SQS_QUEUE_DEPTH", "not a number")
+    pool = WorkerPool()
+    try:
+        # an invalid depth falls back to one queued job per worker
+        assert pool.workers == 2 and pool.queue_depth == 2
+    finally:
+        pool.shutdown()
+
+
+def test_full_pool_blocks_submit_until_a_job_finishes():
+    pool, release = blocked_pool(1, 1)
+    try:
+        pool.submit(release.wait, 5)
+        pool.submit(release.wait, 5)
+        assert pool.available() == 0 and pool.in_flight() == 2
+        assert pool.wait_for_capacity(timeout=0.05) == 0
+
+        submitted = threading.Event()
+        threading.Thread(target=lambda: pool.submit(lambda: None) and submitted.set(), daemon=True).start()
+        assert not submitted.wait(0.1)
+        release.set()
+        assert submitted.wait(5)
+    finally:
+        release.set()
+        pool.shutdown()
+    assert pool.in_flight() == 0 and pool.available() == 2
+
+
+def test_wait_for_capacity_reports_free_slots():
+    pool, release = blocked_pool(2, 2)
+    try:
+        pool.submit(release.wait, 5)
+        assert pool.wait_for_capacity(timeout=1) == 3
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+def test_only_workers_jobs_run_at_once():
+    pool = WorkerPool(workers=2, queue_depth=4)
+    running, peak = [0], [0]
+    lock = threading.Lock()
+
+    def job():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+
+    futures = [pool.submit(job) for _ in range(6)]
+    for future in futures:
+        future.result(timeout=5)
+    pool.shutdown()
+    assert peak[0] == 2
+
+
+def test_failing_job_releases_its_slot():
+    pool = WorkerPool(workers=1, queue_depth=0)
+    try:
+        future = pool.submit(lambda: 1 / 0)
+        assert isinstance(future.exception(timeout=5), ZeroDivisionError)
+        assert pool.wait_for_capacity(timeout=1) == 1
+    finally:
+        pool.shutdown()
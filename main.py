@@ -1,14 +1,20 @@
 import os
 import json
+import time
+import asyncio
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from dotenv import load_dotenv
 from Config.SQS import SQS
 from Config.PostgreSQL import PostgresClient
-from Validation.AssessmentResponseValidator import Assessment
-from Processors.AssessmentGeneration import AssessmentGeneration
-from Processors.AssessmentDoMaterials import AssessmentDoMaterials
-from Processors.MaterialsGeneration import MaterialsGeneration
-from Data.Repositories.BusinessRepository import BusinessRepository
+from Config.WorkerPool import WorkerPool
+from Config.AsyncRuntime import is_async_mode
+from Config.AsyncPostgreSQL import AsyncPostgresClient
+from Config.VisibilityHeartbeat import VisibilityHeartbeat
+from Config.Metrics import metrics
+from Models.Resilience import polling_pause
+from Data.Repositories.ReferenceCache import CachedBusinessRepository, AsyncCachedBusinessRepository
 from Validation.ParseClient import ParseClient, Message, GenerateQuestions
 
 load_dotenv()
@@ -18,16 +24,123 @@ logger.setLevel(logging.INFO)
 
 db = None
 s3 = None
+sqs_client = None
+record_executor = None
+_db_lock = threading.Lock()
 def get_db():
-    """Lazy load database connection"""
+    """Lazy load the database client, shared by every worker thread since it leases a pooled connection per query"""
     global db
     if db is None:
-        db = PostgresClient()
+        with _db_lock:
+            if db is None:
+                db = PostgresClient()
     return db
 
-def handle_message(msg)->bool:
+# Awaitable repository for the asyncio mode, queries are awaited on the async connection pool
+# reference lookups of both repositories go through the shared reference cache
+async_db = AsyncPostgresClient()
+async_repository = AsyncCachedBusinessRepository(async_db)
+
+def prime() -> dict:
+    """
+    Pay one-time costs up front, ideally during the Lambda init phase:
+    the DB pool and a connection, compiled Jinja templates, pydantic JSON
+    schemas and a client (plus TLS connection) for the selected provider.
+    Each step is best effort, a failure is logged and left to the request path.
+    """
+    timings = {}
+
+    def step(name, fn):
+        started = time.monotonic()
+        try:
+            fn()
+        except Exception as e:
+            logger.warning(f"[PRIME] {name} failed: {e}")
+        timings[name] = round((time.monotonic() - started) * 1000, 1)
+
+    def prime_templates():
+        from Models.Prompts.Registry import registry
+        registry.preload()
+
+    def prime_schemas():
+        from Validation.Schemas import response_schema
+        from Validation.AssessmentResponseValidator import Assessment
+        from Validation.MaterialsResponseValidation import Material
+        from Validation.CompactSchema import wire_model
+        response_schema(wire_model(Assessment))
+        response_schema(wire_model(Material))
+
+    def prime_processors():
+        import Processors.AssessmentGeneration
+        import Processors.AssessmentDoMaterials
+        import Processors.MaterialsGeneration
+
+    def prime_provider():
+        match (os.getenv("MODEL_TYPE") or "GOOGLE").upper():
+            case "GOOGLE":
+                from Models.GeminiModel import get_client
+                # Cheap metadata read that opens the TLS connection
+                get_client().models.get(model="gemini-2.5-flash")
+            case "AMAZON":
+                from Models.AmazonModel import get_bedrock
+                from botocore.exceptions import ClientError
+                try:
+                    # Cheapest bedrock-runtime read, an access denied still leaves a warm connection
+                    get_bedrock().list_async_invokes(maxResults=1)
+                except ClientError as e:
+                    logger.info(f"[PRIME] bedrock connection opened ({e.response.get('Error', {}).get('Code')})")
+
+    step("db", get_db)
+    step("templates", prime_templates)
+    step("schemas", prime_schemas)
+    step("processors", prime_processors)
+    step("provider", prime_provider)
+    logger.info(f"[PRIME] completed in ms: {timings}")
+    return timings
+
+
+def context_keys(bodies) -> list:
+    """ (table, organization_id, id) of the reference rows the messages of one batch look up """
+    return [key for key in (ParseClient(body).context_key() for body in bodies) if key is not None]
+
+
+def context_preload_enabled() -> bool:
+    return os.getenv("CONTEXT_PRELOAD", "true").lower() in ("1", "true", "yes")
+
+
+def batch_repository(bodies):
+    """
+    Repository shared by the messages of one receive or Lambda batch, with their district,
+    subject and assessment rows already loaded by one query per table and organization.
+    A failed preload is only logged, each job then fetches its own rows.
+    """
+    repository = CachedBusinessRepository(get_db())
+    if context_preload_enabled():
+        try:
+            metrics.incr("db.context_preload.rows", repository.preload_context(context_keys(bodies)))
+        except Exception as e:
+            logger.warning(f"[DB] context preload failed, jobs fetch their own rows: {e}")
+            repository.preloaded.clear()
+    return repository
+
+
+async def batch_repository_async(bodies):
+    repository = AsyncCachedBusinessRepository(async_db)
+    if context_preload_enabled():
+        try:
+            metrics.incr("db.context_preload.rows", await repository.preload_context(context_keys(bodies)))
+        except Exception as e:
+            logger.warning(f"[DB] context preload failed, jobs fetch their own rows: {e}")
+            repository.preloaded.clear()
+    return repository
+
+
+def handle_message(msg, business_repository=None)->bool:
     try:
         client = ParseClient(msg['Body'])
+        if client.is_warmup():
+            logger.info("[INFO] warmup message, nothing to generate")
+            return True
         message = client.parse_body()
 
         if not message:
@@ -36,10 +149,11 @@ def handle_message(msg)->bool:
             logger.info(f"[INFO] invalid message with not generate_type: {message}")
             return False
         
-        business_repository, organization_id = BusinessRepository(db), message.get("organization_id")
+        business_repository, organization_id = business_repository or CachedBusinessRepository(get_db()), message.get("organization_id")
 
         match message.get("generate_type"):
             case "generate_questions_do_materials":    
+                from Processors.AssessmentDoMaterials import AssessmentDoMaterials
                 generate_questions = message.get("generate_questions")
                 builder = AssessmentDoMaterials(organization_id, generate_questions, business_repository)
                 success = builder.process_question_generation()
@@ -49,6 +163,7 @@ def handle_message(msg)->bool:
                 
                 return True
             case "generate_questions":    
+                from Processors.AssessmentGeneration import AssessmentGeneration
                 generate_questions = message.get("generate_questions")
                 builder = AssessmentGeneration(organization_id, generate_questions, business_repository)
                 success = builder.process_question_generation()
@@ -58,6 +173,7 @@ def handle_message(msg)->bool:
                 
                 return True
             case "generate_materials":
+                from Processors.MaterialsGeneration import MaterialsGeneration
                 generate_materials = message.get("generate_materials")
                 builder = MaterialsGeneration(organization_id, generate_materials , business_repository)
                 success = builder.process_materials_generation()
@@ -74,6 +190,81 @@ def handle_message(msg)->bool:
         
     
 
+async def handle_message_async(msg, repository=None) -> bool:
+    """ Asyncio twin of handle_message, selected with EXECUTION_MODE=async """
+    try:
+        client = ParseClient(msg['Body'])
+        if client.is_warmup():
+            logger.info("[INFO] warmup message, nothing to generate")
+            return True
+        message = client.parse_body()
+
+        if not message:
+            return False
+        if not message.get("generate_type"):
+            logger.info(f"[INFO] invalid message with not generate_type: {message}")
+            return False
+
+        organization_id, repository = message.get("organization_id"), repository or async_repository
+
+        match message.get("generate_type"):
+            case "generate_questions_do_materials":
+                from Processors.AssessmentDoMaterials import AssessmentDoMaterials
+                builder = AssessmentDoMaterials(organization_id, message.get("generate_questions"), None, repository)
+                success = await builder.process_question_generation_async()
+            case "generate_questions":
+                from Processors.AssessmentGeneration import AssessmentGeneration
+                builder = AssessmentGeneration(organization_id, message.get("generate_questions"), None, repository)
+                success = await builder.process_question_generation_async()
+            case "generate_materials":
+                from Processors.MaterialsGeneration import MaterialsGeneration
+                builder = MaterialsGeneration(organization_id, message.get("generate_materials"), None, repository)
+                success = await builder.process_materials_generation_async()
+            case _:
+                return False
+
+        if not success:
+            logger.error(f"[ERROR] {message.get('generate_type')} result {success}")
+            return False
+        return True
+    except Exception as e:
+        logger.error(f"[ERROR] unable to procecess message {e}")
+        return False
+
+
+def process_sqs_message(sqs: SQS, msg, heartbeat: VisibilityHeartbeat = None, business_repository=None) -> bool:
+    """ Worker body: run one message and delete it as soon as it succeeds """
+    logger.info(f"[SQS INFO] Processing message: {msg['MessageId']}")
+    logger.info(f"[SQS INFO] Processing message: {msg['Body']}")
+    try:
+        success = handle_message(msg, business_repository)
+        if success:
+            # Delete message from queue
+            sqs.delete_sqs_message(msg['ReceiptHandle'])
+            logger.info(f"[SQS INFO] Message deleted: {msg['MessageId']}")
+        else:
+            # Message will become visible again after visibility timeout
+            logger.warning(f"[SQS] Message processing failed, will retry: {msg['MessageId']}")
+        return success
+    except Exception as e:
+        logger.error(f"[SQS ERROR] worker failed on message {msg['MessageId']}: {e}", exc_info=True)
+        return False
+    finally:
+        if heartbeat:
+            heartbeat.done(msg)
+
+
+def dispatch_messages(pool: WorkerPool, sqs: SQS, messages: list, heartbeat: VisibilityHeartbeat, repository=None):
+    """ Hand received messages to the pool, the heartbeat keeps them invisible while they wait in its queue """
+    for msg in messages:
+        heartbeat.track(msg)
+        try:
+            pool.submit(process_sqs_message, sqs, msg, heartbeat, repository)
+        except Exception:
+            heartbeat.done(msg)
+            raise
+
+
 def main():##
     """EC2/Local polling mode"""
     sqs = SQS()
@@ -81,34 +272,39 @@ def main():##
     if not queue_url:
         raise ValueError("DATA_PROCESS_SQS environment variable not set")
     
+    # Receive up to SQS_PREFETCH messages per call and fan them out to a bounded pool
+    prefetch = max(1, min(10, int(os.getenv("SQS_PREFETCH", 10))))
+    pool = WorkerPool()
+    heartbeat = VisibilityHeartbeat(sqs, queue_url)
+    heartbeat.start()
+
     logger.info(f"Starting SQS consumer on queue: {queue_url}")
-    # Initialize connections once
-    get_db()
+    # Initialize connections, templates and provider client once
+    prime()
 
     while True:
         try:
-            response = sqs.sqs.receive_message(
-                QueueUrl=queue_url,
-                MaxNumberOfMessages=1,
-                WaitTimeSeconds=20,  # Long polling
-                VisibilityTimeout=300  # 5 minutes to process
+            # Only ask for as many messages as the pool can run or queue right now,
+            # queued messages are tracked by the heartbeat from the moment they are received
+            free_slots = pool.wait_for_capacity()
+            metrics.maybe_log()
+            # Provider circuit open: leave messages in the queue instead of failing them
+            pause = polling_pause()
+            if pause > 0:
+                logger.warning(f"[SQS] provider circuit open, pausing polling for {pause:.1f}s")
+                time.sleep(min(pause, 30))
+                continue
+            messages = sqs.receive_messages(
+                queue_url,
+                max_messages=min(prefetch, free_slots),
+                wait_time=20,  # Long polling
+                visibility_timeout=heartbeat.visibility_timeout  # extended by the heartbeat while processing
             )
-            
-            messages = response.get("Messages", [])
             if not messages:
                 continue
             
-            for msg in messages:
-                logger.info(f"[SQS INFO] Processing message: {msg['MessageId']}")
-                logger.info(f"[SQS INFO] Processing message: {msg['Body']}")
-                success = handle_message(msg)
-                if success:
-                    # Delete message from queue
-                    sqs.delete_sqs_message(msg['ReceiptHandle'])
-                    logger.info(f"[SQS INFO] Message deleted: {msg['MessageId']}")
-                else:
-                    # Message will become visible again after visibility timeout
-                    logger.warning(f"[SQS] Message processing failed, will retry: {msg['MessageId']}")
+            repository = batch_repository([msg['Body'] for msg in messages])
+            dispatch_messages(pool, sqs, messages, heartbeat, repository)
                     
         except KeyboardInterrupt:
             logger.info("[SQS ERROR] Shutting down gracefully...")
@@ -116,9 +312,145 @@ def main():##
         except Exception as e:
             logger.error(f" [SQS ERROR] Error in main loop: {e}", exc_info=True)
             # Continue processing next messages
+
+    pool.shutdown(wait=True)
+    heartbeat.stop()
+    metrics.log_snapshot()
    
 
 
+async def process_sqs_message_async(sqs: SQS, msg, heartbeat: VisibilityHeartbeat = None, repository=None) -> bool:
+    logger.info(f"[SQS INFO] Processing message: {msg['MessageId']}")
+    try:
+        success = await handle_message_async(msg, repository)
+        if success:
+            await sqs.delete_sqs_message_async(msg['ReceiptHandle'])
+            logger.info(f"[SQS INFO] Message deleted: {msg['MessageId']}")
+        else:
+            logger.warning(f"[SQS] Message processing failed, will retry: {msg['MessageId']}")
+        return success
+    except Exception as e:
+        logger.error(f"[SQS ERROR] task failed on message {msg['MessageId']}: {e}", exc_info=True)
+        return False
+    finally:
+        if heartbeat:
+            heartbeat.done(msg)
+
+
+async def main_async():
+    """EC2/Local polling mode on a single event loop (EXECUTION_MODE=async)"""
+    sqs = SQS()
+    queue_url = os.getenv("DATA_PROCESS_SQS")
+    if not queue_url:
+        raise ValueError("DATA_PROCESS_SQS environment variable not set")
+
+    prefetch = max(1, min(10, int(os.getenv("SQS_PREFETCH", 10))))
+    max_in_flight = max(1, int(os.getenv("ASYNC_MAX_IN_FLIGHT", 200)))
+    tasks = set()
+    heartbeat = VisibilityHeartbeat(sqs, queue_url)
+    heartbeat.start()
+
+    logger.info(f"Starting async SQS consumer on queue: {queue_url} (max in flight {max_in_flight})")
+    prime()
+    try:
+        while True:
+            try:
+                free_slots = max_in_flight - len(tasks)
+                if free_slots <= 0:
+                    await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+
+                metrics.maybe_log()
+                pause = polling_pause()
+                if pause > 0:
+                    logger.warning(f"[SQS] provider circuit open, pausing polling for {pause:.1f}s")
+                    await asyncio.sleep(min(pause, 30))
+                    continue
+                messages = await sqs.receive_messages_async(
+                    queue_url,
+                    max_messages=min(prefetch, free_slots),
+                    wait_time=20,  # Long polling
+                    visibility_timeout=heartbeat.visibility_timeout  # extended by the heartbeat while processing
+                )
+                repository = await batch_repository_async([msg['Body'] for msg in messages]) if messages else None
+                for msg in messages:
+                    heartbeat.track(msg)
+                    task = asyncio.create_task(process_sqs_message_async(sqs, msg, heartbeat, repository))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            except Exception as e:
+                logger.error(f" [SQS ERROR] Error in async main loop: {e}", exc_info=True)
+    finally:
+        if tasks:
+            logger.info(f"[SQS INFO] Waiting for {len(tasks)} in-flight messages")
+            await asyncio.gather(*tasks, return_exceptions=True)
+        heartbeat.stop()
+        await async_db.close()
+        metrics.log_snapshot()
+
+
+def get_sqs():
+    """Lazy load the SQS client"""
+    global sqs_client
+    if sqs_client is None:
+        sqs_client = SQS()
+    return sqs_client
+
+
+def process_record(record, business_repository=None) -> str:
+    """ Run one Lambda SQS record, returns its outcome: succeeded, failed or errored """
+    try:
+        # Format message to match handle_message expectations
+        msg = {
+            'Body': record['body'],
+            'ReceiptHandle': record['receiptHandle'],
+            'MessageId': record['messageId']
+        }
+        if not handle_message(msg, business_repository):
+            return "failed"
+    except Exception as e:
+        logger.error(f"Error processing record {record['messageId']}: {e}", exc_info=True)
+        return "errored"
+
+    if business_repository is not None and business_repository.expired.is_set():
+        # the handler already reported this record for retry, leave the message to the redelivery
+        logger.warning(f"[LAMBDA] record {record['messageId']} finished after the deadline, not acknowledging it")
+        return "timed_out"
+
+    # Acknowledge right away so a timeout later in this invocation cannot
+    # send an already generated record back to the queue
+    if os.getenv("LAMBDA_ACK_EARLY", "true").lower() == "true":
+        try:
+            queue_url = SQS.queue_url_from_arn(record.get('eventSourceARN'))
+            get_sqs().delete_sqs_message(record['receiptHandle'], queue_url=queue_url)
+        except Exception as e:
+            # Lambda still deletes it since it is not reported as a failure
+            logger.warning(f"[SQS] unable to acknowledge record {record['messageId']} early: {e}")
+    return "succeeded"
+
+
+def get_record_executor() -> ThreadPoolExecutor:
+    """ Record workers live across warm invocations """
+    global record_executor
+    if record_executor is None:
+        # workers lease a pooled connection per statement and wait for a free one, so
+        # LAMBDA_RECORD_CONCURRENCY is not bounded by POSTGRES_MAX_CONN
+        workers = max(1, int(os.getenv("LAMBDA_RECORD_CONCURRENCY", 5)))
+        record_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lambda-record")
+    return record_executor
+
+
+def process_record_before(record, start_cutoff: float, business_repository=None) -> str:
+    """ Worker body: skip records that could no longer finish inside the invocation """
+    if time.monotonic() > start_cutoff:
+        logger.warning(f"[LAMBDA] not enough time left to start record {record['messageId']}, returning it unprocessed")
+        return "unprocessed"
+    if polling_pause() > 0:
+        logger.warning(f"[LAMBDA] provider circuit open, returning record {record['messageId']} unprocessed")
+        return "unprocessed"
+    return process_record(record, business_repository)
+
+
 def lambda_handler(event, context):
     """
     AWS Lambda entry point.
@@ -126,51 +458,79 @@ def lambda_handler(event, context):
     Lambda automatically:
     - Polls SQS
     - Invokes this function with batches of messages
-    - Deletes messages if function succeeds (no exception)
-    - Retries messages if function fails (exception raised)
+    - Deletes every message not listed in batchItemFailures
+    - Retries only the messages listed in batchItemFailures
+
+    The event source mapping must have ReportBatchItemFailures enabled.
+
+    Records run concurrently, up to LAMBDA_RECORD_CONCURRENCY at a time, leasing pooled
+    DB connections per statement. The invocation deadline is the remaining time minus
+    LAMBDA_DEADLINE_MARGIN_MS; a record is only started if at least LAMBDA_MIN_RECORD_MS
+    remain before it, otherwise it is returned unprocessed. LAMBDA_MIN_RECORD_MS is capped
+    at LAMBDA_MIN_RECORD_FRACTION (default 0.5) of that budget so short function timeouts
+    still start records. Records still running at the deadline are reported for retry and
+    can neither persist nor acknowledge afterwards.
     """
-    logger.info(f"Lambda invoked with {len(event['Records'])} messages")
+    if not event.get('Records') and (event.get('warmup') or event.get('source') == 'aws.events'):
+        # Scheduled keep-warm ping, the container was primed during init
+        logger.info("[INFO] warmup invocation")
+        return {"statusCode": 200, "body": json.dumps({"warmup": True})}
+
+    records = event.get('Records', [])
+    logger.info(f"Lambda invoked with {len(records)} messages")
     
     # Initialize connections (reused across warm starts) 
     get_db()
+
+    margin_ms = int(os.getenv("LAMBDA_DEADLINE_MARGIN_MS", 10000))
+    remaining_ms = context.get_remaining_time_in_millis() if context else 15 * 60 * 1000
+    budget_ms = max(0, remaining_ms - margin_ms)
+    # a fixed minimum longer than the whole budget would return every record unprocessed
+    min_record_ms = min(int(os.getenv("LAMBDA_MIN_RECORD_MS", 120000)), budget_ms * float(os.getenv("LAMBDA_MIN_RECORD_FRACTION", 0.5)))
+    deadline = time.monotonic() + budget_ms / 1000
+    start_cutoff = deadline - min_record_ms / 1000
     
-    processed = 0
-    failed = 0
-    
-    for record in event['Records']:
-        try:
-            # Format message to match handle_message expectations
-            msg = {
-                'Body': record['body'],
-                'ReceiptHandle': record['receiptHandle'],
-                'MessageId': record['messageId']
-            }
-            success = handle_message(msg)
-            if success:
-                processed += 1
-            else:
-                failed += 1
-                # Don't raise exception - let Lambda retry individual messages
-                
-        except Exception as e:
-            logger.error(f"Error processing record {record['messageId']}: {e}", exc_info=True)
-            failed += 1
+    # one query per table and organization for the whole batch instead of two or three per record
+    repository = batch_repository([record['body'] for record in records])
+    executor = get_record_executor()
+    futures = {executor.submit(process_record_before, record, start_cutoff, repository): record for record in records}
+    done, not_done = wait(futures, timeout=max(0, deadline - time.monotonic()))
+    if not_done:
+        # workers cannot be interrupted, stop them from persisting or acknowledging what is reported below
+        repository.expire()
+
+    outcomes = {"succeeded": 0, "failed": 0, "errored": 0, "unprocessed": 0, "timed_out": 0}
+    batch_item_failures = []
     
-    logger.info(f"Batch complete: {processed} processed, {failed} failed")
+    for future, record in futures.items():
+        if future in done:
+            outcome = future.result()
+        else:
+            # Still running at the deadline: a queued record never starts, a running one
+            # keeps generating but its writes and its acknowledgement are refused
+            future.cancel()
+            outcome = "timed_out"
+        outcomes[outcome] += 1
+        if outcome != "succeeded":
+            # Only this record is retried, the rest of the batch is not regenerated
+            batch_item_failures.append({"itemIdentifier": record['messageId']})
     
-    # If any messages failed, raise exception to trigger Lambda retry
-    if failed > 0:
-        raise Exception(f"{failed} messages failed processing")
+    processed = outcomes["succeeded"]
+    failed = len(batch_item_failures)
+    logger.info(f"Batch complete: {processed} processed, {failed} failed, outcomes {outcomes}")
     
     return {
+        "batchItemFailures": batch_item_failures,
         "statusCode": 200,
         "body": json.dumps({
             "processed": processed,
-            "failed": failed
+            "failed": failed,
+            "outcomes": outcomes
         })
     }
 
 def is_valid():
+    from Validation.AssessmentResponseValidator import Assessment
     try:
         with open("./Validation/assessment_test_payload.json") as file:
             body = json.load(file)
@@ -180,10 +540,22 @@ def is_valid():
         logger.error(f"[ERROR] unable to load file {e}")
 
 
+# Lambda runs module level code in the init phase, outside the first request
+if os.getenv("AWS_LAMBDA_FUNCTION_NAME") and os.getenv("PRIME_ON_INIT", "true").lower() == "true":
+    prime()
+
+
 if __name__ == "__main__":
     if os.getenv("APP_MODE") == "prod":
         logger.info("Running on lambda mode - waiting for invocations")
     else:
-        logger.info("[INFO] Running in polling mode")
         ## is_valid()
-        main()
\ No newline at end of file
+        if is_async_mode():
+            logger.info("[INFO] Running in async polling mode")
+            try:
+                asyncio.run(main_async())
+            except KeyboardInterrupt:
+                logger.info("[SQS ERROR] Shutting down gracefully...")
+        else:
+            logger.info("[INFO] Running in polling mode")
+            main()
\ No newline at end of file